@@ -1,4 +1,4 @@
-from . import controller
+from . import cli
 
 if __name__ == '__main__':
-    controller.main()
+    cli.main()
@@ -0,0 +1,345 @@
+'''Counts of the characters in a list of words, which give the exact number
+and size of the words that substitutions make from them without making the
+words.
+
+The words are grouped by their profile: the characters of the word that the
+substitutions can match, sorted. A substitution makes the same number of
+words from every word with the same profile, and changes their lengths by
+the same amount, so each profile only has to be counted once.
+
+Case changes are counted in the same way, with the words grouped by which of
+a fixed list of case changes give the same word, and by which of their first
+TOGGLE_LENGTH characters can be toggled, see CaseCounts.
+
+A CharacterIndex holds both for the profiles of INDEXED_CHARACTERS, the
+characters of the substitutions offered in the GUI. Wordlist files build
+theirs once and keep it next to the metadata cache, see FileAttr.
+'''
+
+import gzip
+import itertools
+import json
+import math
+import os
+import re
+
+# The characters of the profiles kept in a CharacterIndex
+INDEXED_CHARACTERS = frozenset('abcdefghikloqstvxy')
+
+# Changed when CharacterIndex files are no longer compatible
+INDEX_VERSION = 2
+
+# The number of leading characters whose toggles are counted by CaseCounts
+TOGGLE_LENGTH = 16
+
+# Gives the toggle profile of an ASCII word, see get_toggle_profile()
+ASCII_TOGGLE_TABLE = {code: 't' if chr(code).isalpha() else '.' for code in range(128)}
+
+TOGGLE_PROFILE_RE = re.compile(r'\.|t|[+-]\d+')
+
+def get_byte_count(text):
+    '''Returns the length of text in bytes when encoded like the output
+    '''
+    if text.isascii():
+        return len(text)
+    return len(text.encode('utf-8', 'surrogateescape'))
+
+def count_combinations(change_count, added_byte_count, max_size=None, include_empty=True):
+    '''Returns (number of words, bytes added to the input word's length over
+    all of them) for the words made by making every combination of
+    change_count changes to a word, as with SubstitutionAttr's
+    'Combinations' type
+
+    added_byte_count: the bytes added to the word by making all the changes
+    max_size: the most changes made in one word, or None for all of them
+    include_empty: whether the unchanged word is one of the words
+    '''
+    stop = change_count if max_size is None else min(change_count, max_size)
+    word_count = 1 if include_empty else 0
+    byte_count = 0
+    for size in range(1, stop + 1):
+        # each change is made in math.comb(change_count - 1, size - 1) of
+        # the combinations of size changes
+        word_count += math.comb(change_count, size)
+        byte_count += math.comb(change_count - 1, size - 1) * added_byte_count
+    return word_count, byte_count
+
+class CharacterCounts(object):
+    '''The number of words with each profile, and their total length in
+    bytes
+    '''
+    def __init__(self, originals):
+        '''originals: the lowercase characters the substitutions match
+        '''
+        self.originals = frozenset(originals)
+        # profile -> [word count, byte count]
+        self.profiles = {}
+        # deletes the ASCII characters that aren't in profiles
+        self.ascii_table = {code: None for code in range(128)
+                            if chr(code).lower() not in self.originals}
+
+    def add(self, words):
+        '''Counts the strings in the list words
+        '''
+        profiles = self.profiles
+        originals = self.originals
+        ascii_table = self.ascii_table
+        for word in words:
+            if word.isascii():
+                profile = ''.join(sorted(word.translate(ascii_table)))
+                byte_count = len(word)
+            else:
+                profile = ''.join(sorted(c for c in word if c.lower() in originals))
+                byte_count = get_byte_count(word)
+            entry = profiles.get(profile)
+            if entry is None:
+                profiles[profile] = [1, byte_count]
+            else:
+                entry[0] += 1
+                entry[1] += byte_count
+
+    def merge(self, other):
+        '''Adds the words counted by other, which counts the same characters
+        '''
+        add_entries(self.profiles, other.profiles)
+
+    def project(self, originals):
+        '''Returns the CharacterCounts of the same words for originals, a
+        subset of this one's characters
+        '''
+        originals = frozenset(originals)
+        counts = CharacterCounts(originals)
+        if originals == self.originals:
+            counts.profiles = self.profiles
+            return counts
+        profiles = counts.profiles
+        for profile, (word_count, byte_count) in self.profiles.items():
+            profile = ''.join([c for c in profile if c.lower() in originals])
+            entry = profiles.get(profile)
+            if entry is None:
+                profiles[profile] = [word_count, byte_count]
+            else:
+                entry[0] += word_count
+                entry[1] += byte_count
+        return counts
+
+    def count(self, count_profile):
+        '''Returns (word count, byte count) of the words made from the
+        counted words
+
+        count_profile: a function that gives (number of words, bytes added to
+                       the input word's length over all of them) for an
+                       input word with the given profile
+        '''
+        word_count = byte_count = 0
+        for profile, (profile_word_count, profile_byte_count) in self.profiles.items():
+            new_word_count, added_byte_count = count_profile(profile)
+            word_count += new_word_count * profile_word_count
+            byte_count += new_word_count * profile_byte_count + added_byte_count * profile_word_count
+        return word_count, byte_count
+
+class CaseCounts(object):
+    '''The number of words in each case class, and their total length in
+    bytes. Words are in the same class when the same case changes, from a
+    fixed list, give the same word as each other and add the same number of
+    bytes to it, and they have the same toggle profile (see
+    get_toggle_profile()).
+    '''
+    def __init__(self, functions):
+        '''functions: the list of case changes, functions of a word
+        '''
+        self.functions = functions
+        # class -> [word count, byte count]
+        self.classes = {}
+
+    def add(self, words):
+        '''Counts the strings in the list words
+        '''
+        classes = self.classes
+        functions = self.functions
+        for word in words:
+            # For each case change, the first case change that gives the
+            # same word, and the bytes it adds
+            first_changes = {}
+            byte_count = get_byte_count(word)
+            parts = []
+            for i, function in enumerate(functions):
+                new_word = function(word)
+                first = first_changes.setdefault(new_word, i)
+                added = get_byte_count(new_word) - byte_count
+                parts.append(str(first) if added == 0 else '{}{:+d}'.format(first, added))
+            parts.append(get_toggle_profile(word))
+            case_class = ' '.join(parts)
+            entry = classes.get(case_class)
+            if entry is None:
+                classes[case_class] = [1, byte_count]
+            else:
+                entry[0] += 1
+                entry[1] += byte_count
+
+    def merge(self, other):
+        '''Adds the words counted by other, which counts the same case
+        changes
+        '''
+        add_entries(self.classes, other.classes)
+
+    def count(self, indexes):
+        '''Returns (word count, byte count) of the different words made by
+        the case changes at indexes in the list of functions
+        '''
+        word_count = byte_count = 0
+        for case_class, (class_word_count, class_byte_count) in self.classes.items():
+            parts = case_class.split(' ')
+            # the added bytes of each different word
+            added_byte_counts = dict(map(parse_case_part, (parts[i] for i in indexes)))
+            word_count += len(added_byte_counts) * class_word_count
+            byte_count += (len(added_byte_counts) * class_byte_count
+                           + sum(added_byte_counts.values()) * class_word_count)
+        return word_count, byte_count
+
+    def count_toggles(self, length, max_variants=None):
+        '''Returns (word count, byte count) of the words made by toggling
+        every combination of the letters in the first length characters of
+        the counted words, up to TOGGLE_LENGTH, as with CaseAttr's
+        'Combinations' type
+        
+        max_variants: the most words made from one word, or None for all of
+                      them
+        '''
+        word_count = byte_count = 0
+        for case_class, (class_word_count, class_byte_count) in self.classes.items():
+            toggle_profile = case_class[case_class.rfind(' ') + 1:]
+            added_byte_counts = [0 if code == 't' else int(code)
+                                 for code in TOGGLE_PROFILE_RE.findall(toggle_profile)[:length]
+                                 if code != '.']
+            new_word_count, added_byte_count = count_toggles(added_byte_counts, max_variants)
+            word_count += new_word_count * class_word_count
+            byte_count += new_word_count * class_byte_count + added_byte_count * class_word_count
+        return word_count, byte_count
+
+class CharacterIndex(object):
+    '''The CharacterCounts of INDEXED_CHARACTERS and the CaseCounts of a
+    list of words
+    '''
+    def __init__(self, case_functions):
+        self.characters = CharacterCounts(INDEXED_CHARACTERS)
+        self.cases = CaseCounts(case_functions)
+
+    def add(self, words):
+        self.characters.add(words)
+        self.cases.add(words)
+
+    def merge(self, other):
+        self.characters.merge(other.characters)
+        self.cases.merge(other.cases)
+
+def get_toggles(word, length):
+    '''Returns a list of (position, toggled character) for the characters
+    in the first length characters of word whose case can be switched. Other
+    characters, such as digits, are left out.
+    '''
+    if word.isascii():
+        return [(i, c.swapcase()) for i, c in enumerate(word[:length]) if c.isalpha()]
+    toggles = []
+    for i, c in enumerate(word[:length]):
+        toggled = c.lower() if c.isupper() else c.upper()
+        if toggled != c:
+            toggles.append((i, toggled))
+    return toggles
+
+def get_toggle_profile(word):
+    '''Returns the toggle profile of word: a code for each of its first
+    TOGGLE_LENGTH characters, '.' if its case can't be switched, 't' if it
+    can, or the signed number of bytes switching it adds when that isn't 0
+    '''
+    if word.isascii():
+        return word[:TOGGLE_LENGTH].translate(ASCII_TOGGLE_TABLE)
+    codes = ['.'] * min(len(word), TOGGLE_LENGTH)
+    for i, toggled in get_toggles(word, TOGGLE_LENGTH):
+        added = get_byte_count(toggled) - get_byte_count(word[i])
+        codes[i] = 't' if added == 0 else '{:+d}'.format(added)
+    return ''.join(codes)
+
+def count_toggles(added_byte_counts, max_variants=None):
+    '''Returns (number of words, bytes added to the input word's length over
+    all of them) for the words made by toggling every combination of a
+    word's letters, the input word first and then the fewest toggles, as
+    with CaseAttr's 'Combinations' type
+    
+    added_byte_counts: the bytes added by toggling each letter
+    max_variants: the most words made, or None for all of them
+    '''
+    toggle_count = len(added_byte_counts)
+    word_count = 2 ** toggle_count
+    if max_variants is not None:
+        word_count = min(word_count, max_variants)
+    if not any(added_byte_counts):
+        return word_count, 0
+    total_added = sum(added_byte_counts)
+    remaining = word_count - 1
+    byte_count = 0
+    for size in range(1, toggle_count + 1):
+        size_count = math.comb(toggle_count, size)
+        if remaining >= size_count:
+            # each letter is toggled in math.comb(toggle_count - 1, size - 1)
+            # of the combinations of size letters
+            byte_count += math.comb(toggle_count - 1, size - 1) * total_added
+            remaining -= size_count
+        else:
+            combinations = itertools.combinations(added_byte_counts, size)
+            byte_count += sum(map(sum, itertools.islice(combinations, remaining)))
+            break
+    return word_count, byte_count
+
+def parse_case_part(part):
+    '''Returns (first case change, added bytes) for a part of a case class
+    '''
+    for sign in '+-':
+        first, found, added = part.partition(sign)
+        if found:
+            return first, int(sign + added)
+    return part, 0
+
+def add_entries(entries, other_entries):
+    '''Adds the [word count, byte count] entries of other_entries to those
+    of entries with the same keys
+    '''
+    for key, (word_count, byte_count) in other_entries.items():
+        entry = entries.get(key)
+        if entry is None:
+            entries[key] = [word_count, byte_count]
+        else:
+            entry[0] += word_count
+            entry[1] += byte_count
+
+def save_index(path, index):
+    '''Writes the CharacterIndex index to a compressed JSON file at path. The
+    file appears in a single step once it is complete. Errors are ignored,
+    the file is only a cache.
+    '''
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with gzip.open(tmp_path, 'wt', encoding='ascii') as f:
+            json.dump({'version': INDEX_VERSION, 'case_count': len(index.cases.functions),
+                       'profiles': index.characters.profiles, 'cases': index.cases.classes}, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def load_index(path, case_functions):
+    '''Returns the CharacterIndex saved at path by save_index(), or None if
+    there isn't a compatible one
+    '''
+    try:
+        with gzip.open(path, 'rt', encoding='ascii') as f:
+            data = json.load(f)
+    except (OSError, ValueError, EOFError):
+        return None
+    if data.get('version') != INDEX_VERSION or data.get('case_count') != len(case_functions):
+        return None
+    index = CharacterIndex(case_functions)
+    index.characters.profiles = data['profiles']
+    index.cases.classes = data['cases']
+    return index
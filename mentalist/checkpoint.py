@@ -0,0 +1,116 @@
+'''Checkpoints for resuming the output of a chain that was interrupted.
+
+A checkpoint is a JSON file next to the output that records the chain, the
+number of words and bytes of complete output, and the position reached in
+the base words (see Chain.iter_positioned_base_batches()). Checkpoints are
+taken between lists of base words, once each list has gone through the
+whole chain, so the rest of the chain holds no state at that point. Output
+written after the last checkpoint is truncated when resuming.
+'''
+
+import json
+import os
+import time
+
+from . import sink
+
+# Seconds between checkpoints
+DEFAULT_INTERVAL = 10.
+
+class CheckpointException(Exception):
+    '''Raised when a checkpoint does not match the chain or the output
+    '''
+    pass
+
+def get_checkpoint_path(output_path):
+    return output_path + '.checkpoint'
+
+def new_checkpoint(chain_dict, basewords_only=False):
+    '''Returns the checkpoint for the start of the output
+    '''
+    return {'chain': chain_dict, 'basewords_only': basewords_only,
+            'position': None, 'word_count': 0, 'byte_count': 0}
+
+def save_checkpoint(path, checkpoint):
+    '''Write the checkpoint, replacing the previous one in a single step
+    '''
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+def load_checkpoint(path, chain_dict, basewords_only=False):
+    '''Load a checkpoint and check that it was taken for the same chain
+    '''
+    with open(path, 'r') as f:
+        checkpoint = json.load(f)
+    if checkpoint['chain']['nodes'] != chain_dict['nodes']:
+        raise CheckpointException('The checkpoint {} was taken for a different chain'.format(path))
+    if checkpoint['basewords_only'] != basewords_only:
+        raise CheckpointException('The checkpoint {} was taken with basewords only {}'.format(
+            path, 'on' if checkpoint['basewords_only'] else 'off'))
+    return checkpoint
+
+def open_resumed_output(path, checkpoint):
+    '''Open the partial output for appending after the checkpoint's bytes,
+    dropping anything written after the checkpoint was taken
+
+    return value: an unbuffered binary file object
+    '''
+    if os.path.getsize(path) < checkpoint['byte_count']:
+        raise CheckpointException('{} is shorter than the checkpoint expects'.format(path))
+    f = open(path, 'r+b', buffering=0)
+    f.truncate(checkpoint['byte_count'])
+    f.seek(checkpoint['byte_count'])
+    return f
+
+def write_with_checkpoints(compiled_chain, f, checkpoint_path, checkpoint,
+                           interval=DEFAULT_INTERVAL, buffer_size=sink.DEFAULT_BUFFER_SIZE,
+                           progress_callback=None):
+    '''Write the chain's words to the binary file f from the checkpoint's
+    position on, saving a checkpoint every interval seconds and when
+    interrupted by an exception. The checkpoint file is removed when the
+    output is complete.
+
+    f: opened at the checkpoint's byte count, see open_resumed_output()
+
+    return value: the OutputSink, with the counts of the words written in
+    this call
+    '''
+    output_sink = sink.OutputSink(f, buffer_size=buffer_size, progress_callback=progress_callback)
+    start_words = checkpoint['word_count']
+    start_bytes = checkpoint['byte_count']
+    # the last position between lists of base words and the output at it
+    position = checkpoint['position']
+    word_count, byte_count = start_words, start_bytes
+
+    def save():
+        output_sink.flush()
+        os.fsync(f.fileno())
+        checkpoint.update(position=position, word_count=word_count, byte_count=byte_count)
+        save_checkpoint(checkpoint_path, checkpoint)
+
+    save()
+    last_save_time = time.monotonic()
+    try:
+        for batch, new_position in compiled_chain.iter_positioned_batches(position):
+            if new_position is None:
+                output_sink.write_batch(batch)
+                continue
+            position = new_position
+            word_count = start_words + output_sink.word_count
+            byte_count = start_bytes + output_sink.byte_count
+            now = time.monotonic()
+            if now - last_save_time >= interval:
+                save()
+                last_save_time = now
+    except BaseException:
+        try:
+            save()
+        except Exception:
+            pass # the previous checkpoint is still valid
+        raise
+
+    output_sink.close()
+    os.remove(checkpoint_path)
+    return output_sink
@@ -0,0 +1,513 @@
+#! /usr/bin/env python3
+
+'''Command line entry point. Without a command the GUI is started, otherwise
+the command runs headless and never imports tkinter.
+
+    mentalist                                 start the GUI
+    mentalist run chain.mentalist -o out.txt  output the chain's wordlist
+    mentalist run chain.mentalist -o - | hashcat -a 0 hashes.txt
+                                              stream the wordlist to stdout
+    mentalist run chain.mentalist -o out.txt.gz
+                                              compress the output
+    mentalist run chain.mentalist -o out.txt -j 8
+                                              use 8 processes
+    mentalist run chain.mentalist -o out.txt -s 1000000 -l 5000
+                                              output 5000 words, starting
+                                              at word 1000000
+    mentalist run chain.mentalist -o out.txt --checkpoint
+                                              save checkpoints in
+                                              out.txt.checkpoint
+    mentalist run chain.mentalist -o out.txt --resume
+                                              continue from the checkpoint
+    mentalist run chain.mentalist -o out.txt --dedupe
+                                              leave out repeated base words
+    mentalist keyspace chain.mentalist        print the number of words
+    mentalist serve chain.mentalist --listen 0.0.0.0:7373
+                                              hand out chunks of the wordlist
+    mentalist work HOST:7373 -o chunks/       generate chunks from a server
+    mentalist index chain.mentalist           index the chain's files for
+                                              fast skipping
+    mentalist pack words.txt -o words.mwl     convert a wordlist to the
+                                              packed format
+'''
+
+import sys
+
+if (sys.version_info < (3, 11)):
+    print('Error: Mentalist requires Python 3.11 or higher')
+    print(f'You are running Python {sys.version_info.major}.{sys.version_info.minor}.{sys.version_info.micro}')
+    sys.exit(1)
+
+import argparse
+import json
+import os
+import signal
+import stat
+import time
+
+from . import checkpoint
+from . import coordinator
+from . import dedupe
+from . import model
+from . import packed
+from . import parallel
+from . import sink
+
+def load_chain(path):
+    '''Load a chain stored on disk without a controller
+    '''
+    with open(path, 'r') as f:
+        d = json.load(f)
+    return model.Serializable.chain_from_string_dict(d)
+
+def check_files(chain):
+    '''Returns a list of error strings for FileAttrs with missing files
+    '''
+    errors = []
+    for node in chain.nodes:
+        for attr in node.attrs:
+            if isinstance(attr, (model.FileAttr, model.DirectoryAttr)):
+                attr.check_file()
+                if attr.file_error is not None:
+                    errors.append(attr.file_error)
+    return errors
+
+def write_words(chain, f, basewords_only=False, buffer_size=sink.DEFAULT_BUFFER_SIZE,
+                skip=0, limit=None, compression=None, compress_threads=1):
+    '''Write the chain's words to the binary file f, one per line
+
+    skip: the number of words to leave out at the start
+    limit: the maximum number of words to write, or None for all of them
+    compression: 'gz', 'bz2', 'xz' or None
+    compress_threads: the number of threads compressing the output
+
+    return value: the OutputSink, which has the word and byte counts
+    before compression
+    '''
+    compiled_chain = chain.compile_for_output(basewords_only=basewords_only)
+    if skip == 0 and limit is None:
+        if compiled_chain.can_write_blocks():
+            write = lambda output_sink: output_sink.write_blocks(compiled_chain.iter_blocks())
+        else:
+            write = lambda output_sink: output_sink.write_batches(compiled_chain.iter_batches())
+    else:
+        batches = compiled_chain.iter_range_batches(skip, None if limit is None else skip + limit)
+        write = lambda output_sink: output_sink.write_batches(batches)
+    if compression is None:
+        with sink.OutputSink(f, buffer_size=buffer_size) as output_sink:
+            write(output_sink)
+    else:
+        with sink.CompressedWriter(f, compression, threads=compress_threads) as out:
+            with sink.OutputSink(out, buffer_size=buffer_size) as output_sink:
+                write(output_sink)
+    return output_sink
+
+def is_stream(path):
+    '''Whether the output path is stdout ('-') or a named pipe, which can
+    only be written in order
+    '''
+    if path == '-':
+        return True
+    try:
+        return stat.S_ISFIFO(os.stat(path).st_mode)
+    except OSError:
+        return False
+
+def open_output(path):
+    '''Open the output path for writing without buffering. '-' is stdout,
+    and a named pipe blocks until it has a reader. Writes block while the
+    reader is behind, so words are generated only as fast as they are used.
+    '''
+    if path == '-':
+        return os.fdopen(sys.stdout.fileno(), 'wb', buffering=0, closefd=False)
+    return open(path, 'wb', buffering=0)
+
+def print_stats(word_count, byte_count, seconds):
+    '''Print the output totals and throughput to stderr
+    '''
+    seconds = max(seconds, 1e-9)
+    mb = byte_count / (1024. * 1024.)
+    print('Word count: {:,}'.format(word_count), file=sys.stderr)
+    print('Size: {:.1f} MB'.format(mb), file=sys.stderr)
+    print('Running time (seconds): {:.2f}'.format(seconds), file=sys.stderr)
+    print('Throughput: {:,.0f} words/s, {:.1f} MB/s'.format(word_count / seconds, mb / seconds),
+          file=sys.stderr)
+
+def load_checked_chain(path):
+    '''Load a chain stored on disk, printing any errors
+
+    return value: the chain, or None if it could not be loaded or has missing
+    files
+    '''
+    try:
+        chain = load_chain(path)
+    except Exception as e:
+        print('Error: {} is not a valid chain file: {}'.format(path, e), file=sys.stderr)
+        return None
+
+    errors = check_files(chain)
+    if errors:
+        for error in errors:
+            print('Error:', error, file=sys.stderr)
+        return None
+    return chain
+
+def set_dedupe(chain, args):
+    '''Applies the --dedupe options to the chain's base node
+
+    return value: False if the options are invalid
+    '''
+    if args.dedupe_memory <= 0 or not 0 < args.dedupe_error_rate < 1:
+        print('Error: --dedupe-memory must be positive and --dedupe-error-rate between 0 and 1',
+              file=sys.stderr)
+        return False
+    base_node = chain.nodes[0]
+    base_node.dedupe = base_node.dedupe or args.dedupe
+    base_node.dedupe_memory_limit = args.dedupe_memory << 20
+    base_node.dedupe_error_rate = args.dedupe_error_rate
+    return True
+
+def run(args):
+    '''The 'run' command: output the wordlist of a saved chain
+    '''
+    chain = load_checked_chain(args.chain)
+    if chain is None:
+        return 1
+    if not set_dedupe(chain, args):
+        return 1
+
+    if args.compress == 'auto':
+        compression = sink.get_compression(args.output)
+    elif args.compress == 'none':
+        compression = None
+    else:
+        compression = args.compress
+
+    if args.jobs < 1 or args.compress_threads < 1:
+        print('Error: --jobs and --compress-threads must be at least 1', file=sys.stderr)
+        return 1
+    if compression is not None and (args.checkpoint or args.resume):
+        print('Error: --checkpoint and --resume cannot be used with compressed output', file=sys.stderr)
+        return 1
+    if args.skip < 0 or (args.limit is not None and args.limit < 0):
+        print('Error: --skip and --limit cannot be negative', file=sys.stderr)
+        return 1
+    if (args.jobs > 1 or args.split) and (args.skip != 0 or args.limit is not None):
+        print('Error: --skip and --limit cannot be used with --jobs or --split', file=sys.stderr)
+        return 1
+    if (args.jobs > 1 or args.split) and chain.nodes[0].dedupe:
+        print('Error: --jobs and --split cannot be used when duplicate base words are removed',
+              file=sys.stderr)
+        return 1
+    if (args.checkpoint or args.resume) and (args.jobs > 1 or args.split or
+                                             args.skip != 0 or args.limit is not None):
+        print('Error: --checkpoint and --resume cannot be used with --jobs, --split, --skip or --limit',
+              file=sys.stderr)
+        return 1
+    if is_stream(args.output) and (args.checkpoint or args.resume or args.split or
+                                   (args.output == '-' and args.jobs > 1)):
+        print('Error: output to stdout or a named pipe cannot be used with --checkpoint, --resume, '
+              '--split or --jobs', file=sys.stderr)
+        return 1
+
+    start_time = time.perf_counter()
+    if args.checkpoint or args.resume:
+        try:
+            output_sink = run_checkpointed(args, chain)
+        except (checkpoint.CheckpointException, OSError) as e:
+            print('Error:', e, file=sys.stderr)
+            return 1
+        except KeyboardInterrupt:
+            print('Interrupted, continue with --resume', file=sys.stderr)
+            return 1
+        if output_sink is None:
+            return 1
+        word_count, byte_count = output_sink.word_count, output_sink.byte_count
+    elif args.jobs > 1 or args.split:
+        word_count, byte_count, paths = parallel.write_parallel(
+            chain, args.output, args.jobs, basewords_only=args.basewords_only,
+            split=args.split, buffer_size=args.buffer_size, compression=compression,
+            compress_threads=args.compress_threads)
+        if args.split:
+            print('Wrote {} files: {} ... {}'.format(len(paths), paths[0], paths[-1]), file=sys.stderr)
+    else:
+        try:
+            with open_output(args.output) as f:
+                output_sink = write_words(chain, f, args.basewords_only, args.buffer_size,
+                                          args.skip, args.limit, compression, args.compress_threads)
+        except model.FileException:
+            return 1
+        except BrokenPipeError:
+            # The reader exited early, e.g. hashcat found every hash. Point
+            # stdout at devnull so flushing it at exit doesn't fail again.
+            if args.output == '-':
+                os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            print('The output was closed by the reader before the wordlist was complete',
+                  file=sys.stderr)
+            return 1
+        word_count, byte_count = output_sink.word_count, output_sink.byte_count
+    print_stats(word_count, byte_count, time.perf_counter() - start_time)
+    return 0
+
+def run_checkpointed(args, chain):
+    '''Write the output of the 'run' command with checkpoints, resuming from
+    an existing checkpoint with --resume
+
+    return value: the OutputSink of the words written in this run, or None
+    on a file error
+    '''
+    with open(args.chain, 'r') as f:
+        chain_dict = json.load(f)
+    if chain.nodes[0].dedupe:
+        # --dedupe changes the output, so it has to match when resuming
+        chain_dict['nodes'][0]['dedupe'] = True
+    checkpoint_path = checkpoint.get_checkpoint_path(args.output)
+    if args.resume:
+        run_checkpoint = checkpoint.load_checkpoint(checkpoint_path, chain_dict, args.basewords_only)
+        f = checkpoint.open_resumed_output(args.output, run_checkpoint)
+        print('Resuming after {:,} words'.format(run_checkpoint['word_count']), file=sys.stderr)
+    else:
+        run_checkpoint = checkpoint.new_checkpoint(chain_dict, args.basewords_only)
+        f = open(args.output, 'wb', buffering=0)
+
+    # Save a checkpoint when the process is terminated too
+    def terminate(signum, frame):
+        raise KeyboardInterrupt()
+    previous_handler = signal.signal(signal.SIGTERM, terminate)
+    try:
+        with f:
+            compiled_chain = chain.compile_for_output(basewords_only=args.basewords_only)
+            return checkpoint.write_with_checkpoints(compiled_chain, f, checkpoint_path, run_checkpoint,
+                                                     args.checkpoint_interval, args.buffer_size)
+    except model.FileException:
+        return None
+    finally:
+        signal.signal(signal.SIGTERM, previous_handler)
+
+def keyspace(args):
+    '''The 'keyspace' command: print the number of words in a saved chain's
+    wordlist, the range of valid --skip values
+    '''
+    chain = load_checked_chain(args.chain)
+    if chain is None:
+        return 1
+    if not set_dedupe(chain, args):
+        return 1
+
+    if args.basewords_only:
+        print(chain.nodes[0].count_words(0))
+    else:
+        print(chain.count_words())
+        if not chain.has_exact_counts():
+            print('Warning: the chain has Substitution or multiple Case attributes, '
+                  'so the count is an estimate', file=sys.stderr)
+    if chain.nodes[0].dedupe and not chain.nodes[0].get_word_filter().is_exact():
+        print('Warning: the base words don\'t fit in --dedupe-memory, so some words are '
+              'wrongly removed as duplicates and the count is an estimate', file=sys.stderr)
+    return 0
+
+def serve(args):
+    '''The 'serve' command: hand out chunks of a saved chain's wordlist to
+    workers until all of them are done
+    '''
+    chain = load_checked_chain(args.chain)
+    if chain is None:
+        return 1
+    if chain.nodes[0].dedupe:
+        print('Error: chains that remove duplicate base words cannot be split into chunks',
+              file=sys.stderr)
+        return 1
+    with open(args.chain, 'r') as f:
+        chain_dict = json.load(f)
+
+    work_coordinator = coordinator.Coordinator(chain_dict, args.chunk_size, args.lease_timeout)
+    address = work_coordinator.start(args.listen)
+    print('Serving {} chunks of {} {} on {}'.format(len(work_coordinator.chunks), args.chunk_size,
+                                                    work_coordinator.unit, address), file=sys.stderr)
+    try:
+        while not work_coordinator.wait(args.status_interval):
+            done, leased, total = work_coordinator.get_counts()
+            print('Chunks done: {}/{}, leased: {}'.format(done, total, leased), file=sys.stderr)
+        # give the last workers time to receive the 'done' response
+        time.sleep(1)
+    finally:
+        work_coordinator.stop()
+    print('All chunks done', file=sys.stderr)
+    return 0
+
+def work(args):
+    '''The 'work' command: generate chunks handed out by a 'serve' command
+    '''
+    os.makedirs(args.output, exist_ok=True)
+    try:
+        chunk_count = coordinator.run_worker(args.address, args.output, args.id, args.buffer_size)
+    except (OSError, ValueError) as e:
+        print('Error:', e, file=sys.stderr)
+        return 1
+    print('Chunks written: {}'.format(chunk_count), file=sys.stderr)
+    return 0
+
+def index(args):
+    '''The 'index' command: build line indexes for wordlist files, or for
+    the files in saved chains, so that skipping into them, resuming and
+    splitting them into shards don't have to read them from the start
+    '''
+    attrs = []
+    for path in args.files:
+        if path.endswith('.mentalist'):
+            chain = load_checked_chain(path)
+            if chain is None:
+                return 1
+            for node in chain.nodes:
+                for attr in node.attrs:
+                    if isinstance(attr, model.FileAttr):
+                        attrs.append(attr)
+                    elif isinstance(attr, model.DirectoryAttr):
+                        attrs.extend(attr.files)
+        else:
+            attr = model.FileAttr(path)
+            if attr.file_error is not None:
+                print('Error:', attr.file_error, file=sys.stderr)
+                return 1
+            attrs.append(attr)
+
+    for attr in attrs:
+        try:
+            line_index = attr.build_line_index()
+        except OSError as e:
+            print('Error:', e, file=sys.stderr)
+            return 1
+        if line_index is None:
+            print('Error: {} is not a regular file, or MENTALIST_CACHE_DIR is empty'.format(attr.path),
+                  file=sys.stderr)
+            return 1
+        print('Indexed {}: {:,} lines'.format(attr.path, line_index.line_count), file=sys.stderr)
+    return 0
+
+def pack(args):
+    '''The 'pack' command: convert a wordlist into a packed wordlist, which
+    is used without counting or indexing it first
+    '''
+    if not packed.is_packed(args.output):
+        print('Error: the output file name must end with {}'.format(packed.EXTENSION), file=sys.stderr)
+        return 1
+    if args.dedupe_memory <= 0 or not 0 < args.dedupe_error_rate < 1:
+        print('Error: --dedupe-memory must be positive and --dedupe-error-rate between 0 and 1',
+              file=sys.stderr)
+        return 1
+    try:
+        header = packed.pack(args.input, args.output, args.dedupe, args.sort_length,
+                             args.dedupe_memory << 20, args.dedupe_error_rate)
+    except (OSError, ValueError) as e:
+        print('Error:', e, file=sys.stderr)
+        return 1
+    print('Packed {:,} words into {}'.format(header['word_count'], args.output), file=sys.stderr)
+    return 0
+
+def add_dedupe_arguments(parser, dedupe_help):
+    parser.add_argument('--dedupe', action='store_true', help=dedupe_help)
+    parser.add_argument('--dedupe-memory', type=int, default=dedupe.DEFAULT_MEMORY_LIMIT >> 20,
+                        metavar='MB',
+                        help='memory used to remember words. When they don\'t fit, a Bloom '
+                             'filter is used, which also removes a few new words (default: %(default)s)')
+    parser.add_argument('--dedupe-error-rate', type=float, default=dedupe.DEFAULT_ERROR_RATE,
+                        metavar='RATE',
+                        help='fraction of new words removed by the Bloom filter (default: %(default)s)')
+
+BASE_DEDUPE_HELP = ('leave out base words seen before, such as words in several of the base '
+                    'wordlists. Also set by the chain\'s "Remove duplicates" option.')
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog='mentalist',
+                                     description='Mentalist wordlist generator. Run without a command to start the GUI.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    run_parser = subparsers.add_parser('run', help='output the wordlist of a saved chain without the GUI')
+    run_parser.add_argument('chain', help='chain file saved from the GUI')
+    run_parser.add_argument('-o', '--output', required=True,
+                            help='output wordlist path, a named pipe, or - for stdout')
+    run_parser.add_argument('-b', '--basewords-only', action='store_true',
+                            help='output just the base words rather than processing the whole chain')
+    run_parser.add_argument('--buffer-size', type=int, default=sink.DEFAULT_BUFFER_SIZE,
+                            help='number of bytes to collect before each write (default: %(default)s)')
+    run_parser.add_argument('-j', '--jobs', type=int, default=1,
+                            help='number of processes generating words (default: %(default)s)')
+    run_parser.add_argument('--split', action='store_true',
+                            help='write each shard of the base words to its own numbered file OUTPUT.N '
+                                 'instead of one file in order')
+    run_parser.add_argument('--compress', choices=['auto', 'none'] + sorted(sink.COMPRESSION_FORMATS),
+                            default='auto',
+                            help='compress the output. auto compresses according to the output\'s '
+                                 'extension .gz, .bz2 or .xz (default: %(default)s)')
+    run_parser.add_argument('--compress-threads', type=int, default=1,
+                            help='number of threads compressing the output. With more than one, '
+                                 'blocks are compressed independently (default: %(default)s)')
+    run_parser.add_argument('-s', '--skip', type=int, default=0,
+                            help='skip the first SKIP words of the wordlist')
+    run_parser.add_argument('-l', '--limit', type=int,
+                            help='output at most LIMIT words')
+    run_parser.add_argument('--checkpoint', action='store_true',
+                            help='regularly save the position reached to OUTPUT.checkpoint, '
+                                 'which is removed when the output is complete')
+    run_parser.add_argument('--checkpoint-interval', type=float, default=checkpoint.DEFAULT_INTERVAL,
+                            help='seconds between checkpoints (default: %(default)s)')
+    run_parser.add_argument('--resume', action='store_true',
+                            help='continue writing OUTPUT from OUTPUT.checkpoint')
+    add_dedupe_arguments(run_parser, BASE_DEDUPE_HELP)
+    run_parser.set_defaults(func=run)
+
+    keyspace_parser = subparsers.add_parser('keyspace', help='print the number of words a saved chain generates')
+    keyspace_parser.add_argument('chain', help='chain file saved from the GUI')
+    keyspace_parser.add_argument('-b', '--basewords-only', action='store_true',
+                                 help='count just the base words')
+    add_dedupe_arguments(keyspace_parser, BASE_DEDUPE_HELP)
+    keyspace_parser.set_defaults(func=keyspace)
+
+    serve_parser = subparsers.add_parser('serve', help='hand out chunks of a saved chain\'s wordlist to workers')
+    serve_parser.add_argument('chain', help='chain file saved from the GUI')
+    serve_parser.add_argument('--listen', default='127.0.0.1:7373',
+                              help='HOST:PORT or unix:PATH to listen on (default: %(default)s)')
+    serve_parser.add_argument('--chunk-size', type=int, default=100000000,
+                              help='number of words in each chunk (default: %(default)s)')
+    serve_parser.add_argument('--lease-timeout', type=float, default=coordinator.DEFAULT_LEASE_TIMEOUT,
+                              help='seconds without a heartbeat before a chunk is given to '
+                                   'another worker (default: %(default)s)')
+    serve_parser.add_argument('--status-interval', type=float, default=10.,
+                              help='seconds between progress messages (default: %(default)s)')
+    serve_parser.set_defaults(func=serve)
+
+    work_parser = subparsers.add_parser('work', help='generate chunks handed out by \'mentalist serve\'')
+    work_parser.add_argument('address', help='HOST:PORT or unix:PATH of the server')
+    work_parser.add_argument('-o', '--output', required=True,
+                             help='directory for the chunk files chunk_NNNNNN.txt')
+    work_parser.add_argument('--id', help='worker name reported to the server')
+    work_parser.add_argument('--buffer-size', type=int, default=sink.DEFAULT_BUFFER_SIZE,
+                             help='number of bytes to collect before each write (default: %(default)s)')
+    work_parser.set_defaults(func=work)
+
+    index_parser = subparsers.add_parser('index', help='build line indexes for fast skipping into large '
+                                                       'wordlist files')
+    index_parser.add_argument('files', nargs='+', metavar='file',
+                              help='wordlist file, or chain file (.mentalist) to index all of its files')
+    index_parser.set_defaults(func=index)
+
+    pack_parser = subparsers.add_parser('pack', help='convert a wordlist to the packed format, which is '
+                                                     'read without counting or indexing it first')
+    pack_parser.add_argument('input', help='wordlist file, which may be compressed')
+    pack_parser.add_argument('-o', '--output', required=True,
+                             help='packed wordlist path, ending with {}'.format(packed.EXTENSION))
+    pack_parser.add_argument('--sort-length', action='store_true',
+                             help='sort the words by length, keeping their order within each length')
+    add_dedupe_arguments(pack_parser, 'leave out words seen before')
+    pack_parser.set_defaults(func=pack)
+
+    return parser
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    if args.command is None:
+        # Import the GUI lazily so headless commands don't need tkinter
+        from . import controller
+        controller.main()
+        return
+    sys.exit(args.func(args))
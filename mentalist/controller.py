@@ -18,6 +18,7 @@ if (sys.version_info < (3, 11)):
 
 from . import version
 from . import model
+from . import sink
 from . import view
 
 import json
@@ -64,7 +65,8 @@ class Controller():
             widget = view.BaseWordsNode(right_label_text='Calculating...',
                                         allow_remove=False,
                                         **widget_kwargs)
-            node = model.BaseNode(is_root=True)
+            node = model.BaseNode(is_root=True, controller=self)
+            widget.add_dedupe_button()
             self.mainview.set_base_file_box(widget)
         elif type_ == 'Case':
             widget = view.CaseNode(**widget_kwargs)
@@ -83,6 +85,14 @@ class Controller():
         self.mainview.nodes.append(widget)
         self.update_counts()
 
+    def set_dedupe(self, dedupe):
+        '''Set whether repeated base words are left out, and update the
+        display
+        '''
+        self.model.nodes[0].dedupe = dedupe
+        self.mainview.nodes[0].dedupe_var.set(dedupe)
+        self.update_counts()
+
     def file_attr_error(self, target_attr_model):
         '''A FileAttr has encountered an error opening its file. Display the
         error and add a "Locate file" button on the node.
@@ -105,8 +115,12 @@ class Controller():
         if self.exiting:
             return
             
+        # Words without repeated base words are counted in the background
+        # once the attributes have counted theirs
+        counting_unique = len(self.model.nodes) > 0 and self.model.nodes[0].count_unique_in_background()
+        
         # Update the main word count
-        if self.word_calculator_count == 0:
+        if self.word_calculator_count == 0 and not counting_unique:
             word_count = self.model.count_words()
         else:
             word_count = "Calculating..."
@@ -124,14 +138,20 @@ class Controller():
                 if attr_model.calculating:
                     calculating = True
                     chain_calculating = True
+                    if isinstance(attr_model, (model.FileAttr, model.DirectoryAttr)) and attr_view.right_label is not None:
+                        percent = int(100 * attr_model.count_progress)
+                        attr_view.right_label.configure(text='Calculating... {}%'.format(percent))
                 elif attr_view.right_label is not None:
                     word_count = attr_model.count_words(0)
                     word_count = view.word_count_to_string(word_count)
                     attr_view.right_label.configure(text=word_count)
         
-                if isinstance(attr_model, model.FileAttr) and attr_model.file_error is not None:
+                if isinstance(attr_model, (model.FileAttr, model.DirectoryAttr)) and attr_model.file_error is not None:
                     has_file_error = True
             
+            if node_model.is_root and counting_unique:
+                calculating = True
+                chain_calculating = True
             if node_view.right_label is not None:
                 if calculating:
                     word_count = "Calculating..."
@@ -198,7 +218,7 @@ class Controller():
         self.mainview.nodes[node_idx].add_attr(label, right_label_text)
         
         # This occurs when de-serializing a chain with missing files
-        if isinstance(attr, model.FileAttr) and attr.file_error is not None:
+        if isinstance(attr, (model.FileAttr, model.DirectoryAttr)) and attr.file_error is not None:
             self.file_attr_error(attr)
         
         self.update_counts()
@@ -295,7 +315,7 @@ class Controller():
         has_file_error = False
         for node in self.model.nodes:
             for attr in node.attrs:
-                if isinstance(attr, model.FileAttr):
+                if isinstance(attr, (model.FileAttr, model.DirectoryAttr)):
                     attr.check_file()
                     if attr.file_error is not None:
                         self.file_attr_error(attr)
@@ -320,45 +340,53 @@ class Controller():
         # Now pull all the words from the model and write them to the output
         start_time = datetime.datetime.now()
         
-        # This counts the words output so far, to know when to update progress
-        output_word_count = 0
-        output_byte_count = 0
-        progress_percent = 0.
+        progress_percent = 0
+        def update_progress(output_sink):
+            nonlocal progress_percent
+            self.mainview.progress_popup.update() # process cancel button
+            new_percent = self.model.get_progress_percent()
+            # update the progress bar when the integer % changes
+            if int(new_percent) != int(progress_percent):
+                self.mainview.update_progress_bar(new_percent)
+                progress_percent = new_percent
         
-        with open(path, "w", errors='ignore') as f:
+        compression = sink.get_compression(path)
+        with open(path, 'wb', buffering=0) as f:
+            if compression is None:
+                out = f
+            else:
+                out = sink.CompressedWriter(f, compression, threads=os.cpu_count() or 1)
+            output_sink = sink.OutputSink(out, progress_callback=update_progress)
             try:
                 self.mainview.start_progress_bar(path)
                 
                 # This flag is used to cancel processing from another thread
                 self.stop_processing_flag = False
                 
-                for word in self.model.get_words(basewords_only):
+                compiled_chain = self.model.compile_for_output(basewords_only=basewords_only)
+                for batch in compiled_chain.iter_batches():
                     if self.exiting or self.stop_processing_flag:
                         self.mainview.cancel_progress_bar()
-                        os.remove(path)
+                        if compression is not None:
+                            out.abort()
+                        f.close()
+                        if os.path.isfile(path): # don't remove named pipes
+                            os.remove(path)
                         print('Cancelled processing of', path)
                         return
                     
-                    f.write(word + "\n")
-                    output_word_count += 1
-                    
-                    if output_word_count % 5000 == 0: # process cancel button
-                        self.mainview.progress_popup.update()
-                    
-                    if output_word_count % 100 == 0: # don't check too often
-                        new_percent = self.model.get_progress_percent()
-                        # update the progress bar when the integer % changes
-                        if int(new_percent) != int(progress_percent):
-                            self.mainview.update_progress_bar(new_percent)
-                            progress_percent = new_percent
+                    output_sink.write_batch(batch)
             except model.FileException:
                 pass
+            output_sink.close()
+            if compression is not None:
+                out.close()
         
         self.mainview.progress_bar_done()
         
         end_time = datetime.datetime.now()
         print('Running time (seconds):', (end_time - start_time).seconds)
-        print('Word count:', view.main.word_count_to_string(output_word_count))
+        print('Word count:', view.main.word_count_to_string(output_sink.word_count))
         print()
         print('------ OUTPUT COMPLETE ------')
         print()
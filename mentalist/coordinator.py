@@ -0,0 +1,313 @@
+'''Distributes a chain's wordlist between worker processes, which may run on
+other machines.
+
+The coordinator splits the keyspace into chunks of word indexes and hands
+them out over a TCP or Unix socket. A chunk leased to a worker that stops
+sending heartbeats is leased again to another worker. Workers load the chain
+from the coordinator, so its files must be present at the same paths on
+every worker, and write each chunk to its own numbered file.
+
+Requests and responses are single lines of JSON:
+
+    {"op": "chain"}                          -> {"chain": <chain dict>}
+    {"op": "lease", "worker": id}            -> {"chunk": n, "start": s, "stop": e, "unit": u,
+                                                 "lease_timeout": seconds}
+                                                {"wait": seconds} or {"done": true}
+    {"op": "heartbeat", "worker": id, "chunk": n}
+                                             -> {"ok": whether the lease is held}
+    {"op": "complete", "worker": id, "chunk": n, "word_count": c}
+                                             -> {"ok": whether the lease was held}
+
+The unit of a chunk is 'words' when every base word generates the same
+number of words, so that chunks are ranges of the output, and 'basewords'
+otherwise.
+'''
+
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+import uuid
+
+from . import model
+from . import sink
+
+DEFAULT_LEASE_TIMEOUT = 60.
+
+def parse_address(address):
+    '''Converts 'host:port' or 'unix:path' into a socket family and address
+    '''
+    if address.startswith('unix:'):
+        return socket.AF_UNIX, address[len('unix:'):]
+    host, sep, port = address.rpartition(':')
+    if sep == '' or not port.isdigit():
+        raise ValueError('Expected host:port or unix:path, got {}'.format(address))
+    return socket.AF_INET, (host or '127.0.0.1', int(port))
+
+def send_request(address, request, timeout=30.):
+    '''Sends one request to the coordinator at address and returns the
+    response
+    '''
+    family, sock_address = parse_address(address)
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(sock_address)
+        with sock.makefile('rwb') as f:
+            f.write(json.dumps(request).encode() + b'\n')
+            f.flush()
+            line = f.readline()
+    if not line:
+        raise ConnectionError('The coordinator closed the connection')
+    return json.loads(line)
+
+class Chunk(object):
+    def __init__(self, index, start, stop):
+        self.index = index
+        self.start = start
+        self.stop = stop
+        self.worker = None
+        self.deadline = None
+        self.done = False
+
+class Coordinator(object):
+    '''Keeps track of which chunks of a chain's keyspace are waiting, leased
+    to a worker or done, and answers worker requests
+    '''
+    def __init__(self, chain_dict, chunk_size, lease_timeout=DEFAULT_LEASE_TIMEOUT):
+        '''
+        chain_dict: the chain as loaded from a chain file
+        chunk_size: the number of words (or base words) in each chunk
+        lease_timeout: seconds without a heartbeat after which a chunk is
+                       leased to another worker
+        '''
+        self.chain_dict = chain_dict
+        self.lease_timeout = lease_timeout
+
+        chain = model.Serializable.chain_from_string_dict(chain_dict)
+        if chain.nodes[0].dedupe:
+            raise ValueError('Chains that remove duplicate base words cannot be split into chunks')
+        if chain.get_fanout() is None:
+            self.unit = 'basewords'
+            total = chain.nodes[0].count_words(0)
+        else:
+            self.unit = 'words'
+            total = chain.count_words()
+        self.total = total
+        self.chunks = [Chunk(i, start, min(start + chunk_size, total))
+                       for i, start in enumerate(range(0, total, chunk_size))]
+
+        self.lock = threading.Lock()
+        self.all_done = threading.Event()
+        if len(self.chunks) == 0:
+            self.all_done.set()
+        self.server = None
+
+    def handle(self, request):
+        '''Returns the response to one request
+        '''
+        op = request.get('op')
+        with self.lock:
+            if op == 'chain':
+                return {'chain': self.chain_dict}
+            elif op == 'lease':
+                return self.lease(request['worker'])
+            elif op == 'heartbeat':
+                chunk = self.chunks[request['chunk']]
+                held = not chunk.done and chunk.worker == request['worker']
+                if held:
+                    chunk.deadline = time.monotonic() + self.lease_timeout
+                return {'ok': held}
+            elif op == 'complete':
+                chunk = self.chunks[request['chunk']]
+                held = not chunk.done and chunk.worker == request['worker']
+                if held:
+                    chunk.done = True
+                    chunk.worker = None
+                    if all(c.done for c in self.chunks):
+                        self.all_done.set()
+                return {'ok': held}
+            else:
+                return {'error': 'Unknown op: {}'.format(op)}
+
+    def lease(self, worker):
+        now = time.monotonic()
+        waiting = False
+        for chunk in self.chunks:
+            if chunk.done:
+                continue
+            if chunk.worker is None or chunk.deadline < now:
+                chunk.worker = worker
+                chunk.deadline = now + self.lease_timeout
+                return {'chunk': chunk.index, 'start': chunk.start, 'stop': chunk.stop,
+                        'unit': self.unit, 'lease_timeout': self.lease_timeout}
+            waiting = True
+        if waiting:
+            # every remaining chunk is leased, ask again when a lease could
+            # have expired
+            return {'wait': min(1., self.lease_timeout / 2)}
+        return {'done': True}
+
+    def get_counts(self):
+        '''return value: (done chunks, leased chunks, total chunks)
+        '''
+        now = time.monotonic()
+        with self.lock:
+            done = sum(1 for c in self.chunks if c.done)
+            leased = sum(1 for c in self.chunks
+                         if not c.done and c.worker is not None and c.deadline >= now)
+        return done, leased, len(self.chunks)
+
+    def start(self, address):
+        '''Start answering requests on address in a background thread
+
+        return value: the address being listened on, with the actual port
+        when address has port 0
+        '''
+        coordinator = self
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        response = coordinator.handle(json.loads(line))
+                    except Exception as e:
+                        response = {'error': str(e)}
+                    self.wfile.write(json.dumps(response).encode() + b'\n')
+                    self.wfile.flush()
+
+        family, sock_address = parse_address(address)
+        if family == socket.AF_UNIX:
+            if os.path.exists(sock_address):
+                os.remove(sock_address)
+            base_class = socketserver.ThreadingUnixStreamServer
+        else:
+            base_class = socketserver.ThreadingTCPServer
+        class Server(base_class):
+            daemon_threads = True
+            allow_reuse_address = True
+        self.server = Server(sock_address, Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        if family == socket.AF_UNIX:
+            return address
+        host, port = self.server.server_address[:2]
+        return '{}:{}'.format(host, port)
+
+    def wait(self, timeout=None):
+        '''Wait until every chunk is done. Returns whether they are.
+        '''
+        return self.all_done.wait(timeout)
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            if isinstance(self.server.server_address, str):
+                os.remove(self.server.server_address)
+            self.server = None
+
+def get_chunk_path(output_dir, chunk_index):
+    return os.path.join(output_dir, 'chunk_{:06d}.txt'.format(chunk_index))
+
+def iter_chunk_batches(compiled_chain, lease):
+    '''A generator that yields the lists of words in a leased chunk
+    '''
+    if lease['unit'] == 'words':
+        yield from compiled_chain.iter_range_batches(lease['start'], lease['stop'])
+    else:
+        chain = compiled_chain.chain
+        source_batches = chain.iter_base_range_batches(lease['start'], lease['stop'],
+                                                       compiled_chain.batch_size,
+                                                       compiled_chain.encoding)
+        yield from compiled_chain.iter_batches(source_batches)
+
+class Heartbeat(object):
+    '''Sends heartbeats for a leased chunk from a background thread until
+    stop() is called, and notes when the coordinator says the lease is no
+    longer held
+    '''
+    def __init__(self, address, chunk_request, interval):
+        self.address = address
+        self.chunk_request = chunk_request
+        self.interval = interval
+        self.lost = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                response = send_request(self.address, dict(self.chunk_request, op='heartbeat'))
+            except (OSError, ValueError) as e:
+                # The coordinator may be briefly unreachable, the lease is
+                # only lost once it says so
+                print('Exception while sending a heartbeat:', e, file=sys.stderr)
+                continue
+            if not response.get('ok'):
+                self.lost.set()
+                return
+
+    def iter_held(self, batches):
+        '''A generator that yields the batches until the lease is lost
+        '''
+        for batch in batches:
+            if self.lost.is_set():
+                return
+            yield batch
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+def run_worker(address, output_dir, worker_id=None, buffer_size=sink.DEFAULT_BUFFER_SIZE,
+               heartbeat_interval=None):
+    '''Lease chunks from the coordinator at address and write each to its
+    own file in output_dir until every chunk is done. A chunk's file only
+    appears once it is complete.
+
+    return value: the number of chunks written by this worker
+    '''
+    if worker_id is None:
+        worker_id = '{}-{}-{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+    chain = model.Serializable.chain_from_string_dict(send_request(address, {'op': 'chain'})['chain'])
+    compiled_chain = chain.compile_for_output()
+
+    chunk_count = 0
+    while True:
+        lease = send_request(address, {'op': 'lease', 'worker': worker_id})
+        if 'error' in lease:
+            raise ValueError(lease['error'])
+        if lease.get('done'):
+            return chunk_count
+        if 'wait' in lease:
+            time.sleep(lease['wait'])
+            continue
+
+        chunk_request = {'worker': worker_id, 'chunk': lease['chunk']}
+        path = get_chunk_path(output_dir, lease['chunk'])
+        tmp_path = path + '.{}.tmp'.format(os.getpid())
+        # Heartbeats are sent for the whole chunk, including seeking to its
+        # start, and the chunk is given up if another worker has leased it
+        heartbeat = Heartbeat(address, chunk_request,
+                              heartbeat_interval or lease['lease_timeout'] / 4)
+        try:
+            with open(tmp_path, 'wb', buffering=0) as f:
+                with sink.OutputSink(f, buffer_size=buffer_size) as output_sink:
+                    output_sink.write_batches(heartbeat.iter_held(iter_chunk_batches(compiled_chain, lease)))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        finally:
+            heartbeat.stop()
+        if heartbeat.lost.is_set():
+            os.remove(tmp_path)
+            continue
+        os.replace(tmp_path, path)
+
+        response = send_request(address, dict(chunk_request, op='complete',
+                                              word_count=output_sink.word_count))
+        if response.get('ok'):
+            chunk_count += 1
@@ -0,0 +1,209 @@
+'''Removes repeated base words, for base nodes with several lists that share
+words, such as a dictionary and a list of names.
+
+The words seen so far are remembered by their 64-bit fingerprints in an
+open-addressed table of 8 byte slots, kept at most MAX_LOAD full (see
+FingerprintTable), so 12 to 23 bytes per word. Fingerprints are a BLAKE2
+digest of the word's UTF-8 encoding, the same in every process, so a run
+drops the same words as the keyspace count or an interrupted run before it.
+When the base words might not fit in the memory limit that way, a Bloom
+filter is used instead. It takes a fixed amount of memory, but drops a
+fraction of the words that were not seen before, about error_rate of them.
+'''
+
+import array
+import hashlib
+import math
+import random
+
+# Defaults for the memory used to remember words, and the fraction of new
+# words dropped by a Bloom filter
+DEFAULT_MEMORY_LIMIT = 512 << 20
+DEFAULT_ERROR_RATE = 0.001
+
+# The most fingerprints a FingerprintTable holds for each slot before it
+# doubles in size
+MAX_LOAD = 0.7
+
+# BloomFilter sets at most this many bits per fingerprint, with masks chosen
+# by the fingerprint's bits MASK_SHIFT and up
+MAX_HASH_COUNT = 16
+MASK_SHIFT = 48
+MASK_INDEX = (1 << 12) - 1
+
+_masks = {}
+
+def get_fingerprint(word):
+    '''Returns the 64-bit fingerprint of word, a str or its UTF-8 encoding
+    '''
+    if isinstance(word, str):
+        word = word.encode('utf-8', 'surrogateescape')
+    return int.from_bytes(hashlib.blake2b(word, digest_size=8).digest(), 'little')
+
+class FingerprintTable(object):
+    '''A set of 64-bit fingerprints in an array of slots, found by linear
+    probing from the slot given by the fingerprint's low bits. Empty slots
+    are 0, so the fingerprint 0 is stored as 1.
+    '''
+    def __init__(self, expected_count):
+        '''The table is sized for expected_count fingerprints
+        '''
+        self.slots = array.array('Q', bytes(8 * get_table_size(expected_count)))
+        self.count = 0
+
+    def filter(self, words):
+        '''Returns the words in the list words whose fingerprints aren't in
+        the table, and adds them
+        '''
+        new_words = []
+        slots = self.slots
+        mask = len(slots) - 1
+        limit = int(MAX_LOAD * len(slots))
+        for word, fingerprint in zip(words, map(get_fingerprint, words)):
+            fingerprint = fingerprint or 1
+            i = fingerprint & mask
+            while True:
+                slot = slots[i]
+                if slot == fingerprint:
+                    break
+                if slot == 0:
+                    slots[i] = fingerprint
+                    new_words.append(word)
+                    self.count += 1
+                    if self.count > limit:
+                        self.grow()
+                        slots = self.slots
+                        mask = len(slots) - 1
+                        limit = int(MAX_LOAD * len(slots))
+                    break
+                i = (i + 1) & mask
+        return new_words
+
+    def grow(self):
+        '''Doubles the number of slots, for when there are more words than
+        expected
+        '''
+        old_slots = self.slots
+        self.slots = slots = array.array('Q', bytes(16 * len(old_slots)))
+        mask = len(slots) - 1
+        for fingerprint in old_slots:
+            if fingerprint != 0:
+                i = fingerprint & mask
+                while slots[i] != 0:
+                    i = (i + 1) & mask
+                slots[i] = fingerprint
+
+def get_table_size(expected_count):
+    '''Returns the number of slots in a FingerprintTable for expected_count
+    fingerprints, a power of 2
+    '''
+    size = 16
+    while size * MAX_LOAD < expected_count:
+        size *= 2
+    return size
+
+class BloomFilter(object):
+    '''A blocked Bloom filter of fingerprints: each fingerprint sets
+    hash_count bits in one 64-bit block of an array, chosen by the
+    fingerprint modulo the number of blocks, with the bits taken from a
+    table of masks by its high bits. This takes a few operations per word rather than one per bit.
+    '''
+    def __init__(self, expected_count, error_rate, memory_limit):
+        '''The filter is sized for expected_count fingerprints at error_rate,
+        or memory_limit bytes if that is smaller, which increases the error
+        rate
+        '''
+        expected_count = max(expected_count, 1)
+        # Blocks fill unevenly, so they need more bits than a plain Bloom
+        # filter. Grow the size from that of a plain filter until the rate
+        # is low enough.
+        bit_count = -expected_count * math.log(error_rate) / math.log(2) ** 2
+        max_block_count = max(1, memory_limit // 8)
+        while True:
+            block_count = max(1, min(int(bit_count) // 64, max_block_count))
+            rates = [(get_error_rate(expected_count, block_count, hash_count), hash_count)
+                     for hash_count in range(1, MAX_HASH_COUNT + 1)]
+            rate, self.hash_count = min(rates)
+            if rate <= error_rate or block_count == max_block_count:
+                break
+            bit_count *= 1.1
+        self.error_rate = rate
+        self.block_count = block_count
+        self.blocks = array.array('Q', bytes(8 * block_count))
+        self.masks = get_masks(self.hash_count)
+
+    def filter(self, words):
+        '''Returns the words in the list words whose fingerprints haven't
+        been added, and adds them
+        '''
+        new_words = []
+        blocks = self.blocks
+        block_count = self.block_count
+        masks = self.masks
+        for word, fingerprint in zip(words, map(get_fingerprint, words)):
+            i = fingerprint % block_count
+            mask = masks[(fingerprint >> MASK_SHIFT) & MASK_INDEX]
+            block = blocks[i]
+            if block & mask != mask:
+                blocks[i] = block | mask
+                new_words.append(word)
+        return new_words
+
+def get_error_rate(count, block_count, hash_count):
+    '''Returns the false positive rate of a BloomFilter of block_count blocks
+    holding count fingerprints that set hash_count bits each. The number of
+    fingerprints in a block follows a Poisson distribution.
+    '''
+    load = count / block_count
+    term = math.exp(-load) # the probability of j fingerprints in a block
+    rate = 0.
+    j = 0
+    while True:
+        rate += term * (1 - (1 - hash_count / 64) ** j) ** hash_count
+        j += 1
+        term *= load / j
+        if (j > load and term < 1e-12) or term == 0:
+            return rate
+
+def get_masks(hash_count):
+    '''Returns the table of 64-bit masks with hash_count bits set used by
+    BloomFilter, the same in every run
+    '''
+    if hash_count not in _masks:
+        rng = random.Random(hash_count)
+        _masks[hash_count] = [sum(1 << bit for bit in rng.sample(range(64), hash_count))
+                              for i in range(MASK_INDEX + 1)]
+    return _masks[hash_count]
+
+class WordFilter(object):
+    '''Passes on only the first occurrence of each word
+    '''
+    def __init__(self, expected_count, memory_limit=DEFAULT_MEMORY_LIMIT,
+                 error_rate=DEFAULT_ERROR_RATE):
+        '''
+        expected_count: the number of words that will be filtered, including
+                        repeated ones
+        memory_limit: the bytes of memory to use for remembering words
+        error_rate: the fraction of new words dropped if a Bloom filter is
+                    needed to stay within memory_limit
+        '''
+        if 8 * get_table_size(expected_count) <= memory_limit:
+            self.table = FingerprintTable(expected_count)
+            self.bloom_filter = None
+        else:
+            self.table = None
+            self.bloom_filter = BloomFilter(expected_count, error_rate, memory_limit)
+
+    def is_exact(self):
+        '''Whether only repeated words are dropped, rather than some new
+        words as well
+        '''
+        return self.bloom_filter is None
+
+    def filter(self, words):
+        '''Returns the words in the list words that have not been seen
+        before, and remembers them
+        '''
+        if self.bloom_filter is not None:
+            return self.bloom_filter.filter(words)
+        return self.table.filter(words)
@@ -0,0 +1,167 @@
+'''A persistent cache of metadata about wordlist files, such as their word
+counts, so that files are only scanned again when they change.
+
+Entries are kept in a JSON file in the user's cache directory and are keyed
+by a file's absolute path, size, modification time and inode, so a file that
+is modified or replaced no longer matches its entry. The directory can be
+changed with the MENTALIST_CACHE_DIR environment variable, and setting it to
+an empty string turns the cache off.
+
+The files bundled in the data directory never change, so their metadata is
+shipped in data/file_metadata.json and keyed by file name and size instead.
+Run this module to regenerate it after changing a bundled file.
+
+Line index files, and the character indexes used to count the words of
+Substitution and Case nodes, are kept in the index directory next to the
+cache file.
+'''
+
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+
+CACHE_FILE_NAME = 'file_metadata.json'
+
+# The number of entries kept in the cache. The least recently used entries
+# are dropped when there are more.
+MAX_ENTRIES = 1000
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+data_dir = os.path.join(script_dir, 'data')
+bundled_metadata_path = os.path.join(data_dir, CACHE_FILE_NAME)
+
+# Serializes reading and writing the cache file between counting threads
+_lock = threading.Lock()
+_bundled_metadata = None
+
+def get_cache_path():
+    '''Returns the path of the cache file, or None if the cache is turned off
+    '''
+    cache_dir = os.environ.get('MENTALIST_CACHE_DIR')
+    if cache_dir is None:
+        if sys.platform == 'win32':
+            base_dir = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+        else:
+            base_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        cache_dir = os.path.join(base_dir, 'mentalist')
+    elif cache_dir == '':
+        return None
+    return os.path.join(cache_dir, CACHE_FILE_NAME)
+
+def get_key(path, file_stat):
+    return '{}|{}|{}|{}'.format(os.path.abspath(path), file_stat.st_size,
+                                file_stat.st_mtime_ns, file_stat.st_ino)
+
+def get_index_path(path, file_stat, extension='.idx'):
+    '''Returns the path of the line index file (see lineindex.py) for this
+    version of the file at path, or None if the cache is turned off. Other
+    indexes of the file use another extension.
+    '''
+    cache_path = get_cache_path()
+    if cache_path is None:
+        return None
+    name = hashlib.sha1(get_key(path, file_stat).encode('utf-8', 'surrogateescape')).hexdigest()
+    return os.path.join(os.path.dirname(cache_path), 'index', name + extension)
+
+def load_entries(cache_path):
+    try:
+        with open(cache_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def from_json(entry):
+    '''Returns the metadata in a cache entry, without the cache's own keys
+    '''
+    metadata = dict(entry)
+    metadata.pop('last_used', None)
+    metadata.pop('size', None)
+    return metadata
+
+def get_bundled_metadata(name, size):
+    '''Returns the shipped metadata of a file in the data directory, or None
+    '''
+    global _bundled_metadata
+    if _bundled_metadata is None:
+        _bundled_metadata = load_entries(bundled_metadata_path)
+    entry = _bundled_metadata.get(name)
+    if entry is None or entry['size'] != size:
+        return None
+    return from_json(entry)
+
+def get_metadata(path, file_stat):
+    '''Returns the cached metadata of the file at path as a dict, or None if
+    there is none for this version of the file
+
+    file_stat: the os.stat() result of the file, taken before reading it
+    '''
+    data_prefix = data_dir + os.sep
+    if os.path.abspath(path).startswith(data_prefix):
+        metadata = get_bundled_metadata(os.path.abspath(path)[len(data_prefix):], file_stat.st_size)
+        if metadata is not None:
+            return metadata
+    cache_path = get_cache_path()
+    if cache_path is None:
+        return None
+    with _lock:
+        entry = load_entries(cache_path).get(get_key(path, file_stat))
+    if entry is None:
+        return None
+    return from_json(entry)
+
+def save_metadata(path, file_stat, metadata):
+    '''Adds the metadata of the file at path to the cache. Any metadata
+    already cached for this version of the file is kept unless it is
+    replaced. Errors writing the cache are ignored, it is only an
+    optimization.
+
+    file_stat: the os.stat() result of the file, taken before reading it
+    '''
+    cache_path = get_cache_path()
+    if cache_path is None:
+        return
+    with _lock:
+        entries = load_entries(cache_path)
+        key = get_key(path, file_stat)
+        entry = entries.pop(key, {})
+        entry.update(metadata)
+        entry['last_used'] = time.time()
+        entries[key] = entry
+        if len(entries) > MAX_ENTRIES:
+            keys = sorted(entries, key=lambda k: entries[k].get('last_used', 0))
+            for old_key in keys[:len(entries) - MAX_ENTRIES]:
+                del entries[old_key]
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+            with open(tmp_path, 'w') as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            pass
+
+def build_bundled_metadata():
+    '''Scans every wordlist in the data directory and writes their metadata
+    to data/file_metadata.json
+    '''
+    from . import model
+    entries = {}
+    for name in sorted(os.listdir(data_dir)):
+        if not name.endswith('.txt') or name == 'Letter_Stats.txt':
+            continue
+        attr = model.FileAttr.__new__(model.FileAttr)
+        attr.absolute_path = os.path.join(data_dir, name)
+        attr.compression = None
+        attr.controller = None
+        attr.kill_flag = False
+        entry = {'size': os.stat(attr.absolute_path).st_size}
+        entry.update(attr.scan_file())
+        entries[name] = entry
+    with open(bundled_metadata_path, 'w') as f:
+        json.dump(entries, f, indent=1, sort_keys=True)
+
+if __name__ == '__main__':
+    build_bundled_metadata()
@@ -0,0 +1,161 @@
+'''Line-offset index files, which give the byte offset of any line of a
+wordlist file without reading the lines before it.
+
+An index file starts with a header of the magic bytes, the size in bytes of
+each offset and the number of lines, followed by the offset of the start of
+every line and finally the file size, as little-endian unsigned integers.
+Offsets take 4 bytes each in files under 4 GiB and 8 bytes otherwise. The
+offsets are memory mapped when the index is loaded, so only the pages that
+are looked up are read.
+
+Index files are built with 'mentalist index' and kept next to the metadata
+cache (see filecache.get_index_path()). Packed wordlists (see packed.py)
+contain an index in the same format.
+'''
+
+import array
+import bisect
+import itertools
+import mmap
+import os
+import struct
+import sys
+
+from . import model
+
+MAGIC = b'MNTLIDX1'
+
+# magic, offset size, line count
+HEADER = struct.Struct('<8sQQ')
+
+class LineIndex(object):
+    '''A loaded index file
+    '''
+    def __init__(self, path, offset=0):
+        '''offset: where the index starts in the file
+        '''
+        self.mm = None
+        self.offsets = None
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if len(self.mm) < offset + HEADER.size:
+                raise ValueError('{} is truncated'.format(path))
+            magic, offset_size, self.line_count = HEADER.unpack_from(self.mm, offset)
+            if magic != MAGIC or offset_size not in (4, 8):
+                raise ValueError('{} is not a line index file'.format(path))
+            typecode = 'I' if offset_size == 4 else 'Q'
+            start = offset + HEADER.size
+            stop = start + (self.line_count + 1) * offset_size
+            if len(self.mm) < stop or (offset == 0 and len(self.mm) != stop):
+                raise ValueError('{} is truncated'.format(path))
+            data = memoryview(self.mm)[start:stop]
+            if sys.byteorder == 'little':
+                self.offsets = data.cast(typecode)
+            else:
+                self.offsets = array.array(typecode, data.tobytes())
+                self.offsets.byteswap()
+                data.release()
+        except Exception:
+            self.close()
+            raise
+
+    def get_offset(self, line):
+        '''Returns the byte offset of the start of line number line, or the
+        file size if there are not that many lines
+        '''
+        return self.offsets[min(line, self.line_count)]
+
+    def get_line_number(self, offset):
+        '''Returns the number of the line that starts at the byte offset
+        offset, or None if no line starts there
+        '''
+        line = bisect.bisect_left(self.offsets, offset)
+        if line > self.line_count or self.offsets[line] != offset:
+            return None
+        return line
+
+    def close(self):
+        if isinstance(self.offsets, memoryview):
+            self.offsets.release()
+        self.offsets = None
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+def iter_line_starts(blocks):
+    '''A generator that yields the offsets of the starts of the lines in the
+    (bytes, end offset) blocks of whole lines from FileAttr.iter_line_blocks()
+    '''
+    # lengths of the lines and their '\n', added up from the block's offset
+    next_line = (1).__add__
+    for block, block_end in blocks:
+        pos = block_end - len(block)
+        if b'\r' in block:
+            ends = [pos + match.end() for match in model.NEWLINE_RE.finditer(block)]
+            starts = [pos] + ends
+        else:
+            starts = list(itertools.accumulate(map(next_line, map(len, block.split(b'\n'))),
+                                               initial=pos))
+            starts.pop() # the end of the last piece is past the block
+        if starts[-1] == block_end:
+            starts.pop() # the block ends with a line ending
+        yield from starts
+
+def write_index(path, blocks, file_size=None):
+    '''Writes the index file for the lines in blocks, as yielded by
+    FileAttr.iter_line_blocks(0, None) for a file of file_size bytes. The
+    file appears in a single step once it is complete.
+
+    file_size: None if the size is not known in advance, as for compressed
+               files, in which case 8 byte offsets are used
+
+    return value: the number of lines
+    '''
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(tmp_path, 'wb') as f:
+            line_count = write_offsets(f, blocks, file_size)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return line_count
+
+def write_offsets(f, blocks, file_size=None):
+    '''Writes an index for the lines in blocks, as for write_index(), at the
+    current position of the binary file f, which must be seekable
+
+    return value: the number of lines
+    '''
+    offset_size = 4 if file_size is not None and file_size < 1 << 32 else 8
+    typecode = 'I' if offset_size == 4 else 'Q'
+    end_offset = 0
+    def track_end(blocks):
+        nonlocal end_offset
+        for block, block_end in blocks:
+            end_offset = block_end
+            yield block, block_end
+
+    header_pos = f.tell()
+    line_count = 0
+    f.write(HEADER.pack(MAGIC, offset_size, 0))
+    starts = iter_line_starts(track_end(blocks))
+    while True:
+        offsets = array.array(typecode, itertools.islice(starts, 1 << 16))
+        if len(offsets) == 0:
+            break
+        line_count += len(offsets)
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+        offsets.tofile(f)
+    end = array.array(typecode, [end_offset if file_size is None else file_size])
+    if sys.byteorder != 'little':
+        end.byteswap()
+    end.tofile(f)
+    end_pos = f.tell()
+    f.seek(header_pos)
+    f.write(HEADER.pack(MAGIC, offset_size, line_count))
+    f.seek(end_pos)
+    return line_count
@@ -8,11 +8,207 @@ import calendar
 import datetime
 import inspect
 import copy
+import functools
 import sys
+import itertools
+import time
+import locale
+import re
+import codecs
+import mmap
+import stat
+import collections
+import pickle
+import tempfile
+import queue
+import gzip
+import bz2
+import lzma
+import glob
+import concurrent.futures
+
+from . import charcount
+from . import dedupe
+from . import filecache
+from . import lineindex
+from . import packed
+from . import sink
 
 script_dir = os.path.dirname(os.path.realpath(__file__))
 data_dir = os.path.join(script_dir, 'data')
 
+# Words are passed between nodes and attributes in lists of about this many
+# words, which avoids resuming a generator for every word at every node
+BATCH_SIZE = 4096
+
+# Number of bytes read from a FileAttr's file at a time
+FILE_BLOCK_SIZE = 1 << 20
+
+# Number of bytes scanned at a time when counting a file's lines
+COUNT_BLOCK_SIZE = 1 << 22
+
+# The words of an AddNode's attributes are kept in memory up to about this
+# many bytes, see AddWordTable
+ADD_WORDS_MEMORY_LIMIT = 256 << 20
+
+# Approximate bytes used by each word in a list besides its characters
+WORD_OVERHEAD = sys.getsizeof('') + 8
+
+# Number of blocks that a background thread reads, and decodes, ahead of the
+# words being generated, see iter_in_background()
+READ_AHEAD_BLOCKS = 4
+
+# File objects that decompress wordlists by the format of their extension,
+# given the compressed binary file
+DECOMPRESSORS = {'gz': lambda f: gzip.GzipFile(fileobj=f, mode='rb'),
+                 'bz2': lambda f: bz2.BZ2File(f, 'rb'),
+                 'xz': lambda f: lzma.LZMAFile(f, 'rb')}
+
+# Threads used by DirectoryAttr to count and read its files
+DIRECTORY_THREADS = 4
+
+# The number of files that DirectoryAttr reads ahead, and the memory their
+# words may take in total. Files whose words take more are read as they are
+# used instead.
+PREFETCH_FILES = 4
+PREFETCH_MEMORY = 256 << 20
+
+# The memory a decoded word takes beyond its characters, as a str in a list
+WORD_OVERHEAD = 57
+
+# Line endings recognized when reading files, as in text mode
+NEWLINE_RE = re.compile(rb'\r\n?|\n')
+
+# Encodings in which the encoding of joined strings is the same as the joined
+# encoded strings, so chains can run on the undecoded bytes of files
+BYTES_ENCODINGS = ['utf-8', 'ascii', 'iso8859-1']
+
+# MutateNode de-duplicates up to this many words from one input word by
+# comparing them directly, which is faster than hashing them
+SMALL_DEDUPE_SIZE = 16
+
+# The characters hashcat rules use for positions 0 to 35 in a word
+HASHCAT_POSITIONS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+def iter_batches(words, batch_size=BATCH_SIZE):
+    '''A generator that groups the iterable words into lists of at most
+    batch_size words
+    '''
+    if isinstance(words, list):
+        for i in range(0, len(words), batch_size):
+            yield words[i:i + batch_size]
+    else:
+        words = iter(words)
+        while True:
+            batch = list(itertools.islice(words, batch_size))
+            if len(batch) == 0:
+                break
+            yield batch
+
+def slice_batches(batches, start, stop=None):
+    '''A generator that yields the words start to stop (None for all the
+    remaining words) of the sequence of word lists batches, in lists. No
+    more lists are taken from batches once stop is reached.
+    '''
+    for batch in batches:
+        if stop is None:
+            batch_stop = len(batch)
+        else:
+            if stop <= 0:
+                return
+            batch_stop = min(stop, len(batch))
+            stop -= len(batch)
+        if start < batch_stop:
+            if start == 0 and batch_stop == len(batch):
+                yield batch
+            else:
+                yield batch[start:batch_stop]
+        start = max(0, start - len(batch))
+
+def decode_lines(data, encoding):
+    '''Decodes the bytes data and splits them into lines the same way as
+    iterating over a file opened in text mode. A final newline does not
+    start another line.
+    '''
+    text = data.decode(encoding, 'surrogateescape')
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    lines = text.split('\n')
+    if lines[-1] == '':
+        lines.pop()
+    return lines
+
+def split_lines(data):
+    '''Splits the bytes data into lines like decode_lines(), without
+    decoding them
+    '''
+    if b'\r' in data:
+        data = data.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+    lines = data.split(b'\n')
+    if lines[-1] == b'':
+        lines.pop()
+    return lines
+
+def iter_in_background(items, max_pending=READ_AHEAD_BLOCKS):
+    '''A generator that yields the items of the iterable items, which are
+    produced by a background thread up to max_pending items ahead. Reading
+    and decoding files in the thread overlaps waiting for the disk with
+    processing the words. Exceptions in the thread are raised here.
+    '''
+    pending = queue.Queue(max_pending)
+    stopped = threading.Event()
+    done = object()
+    
+    def put(item):
+        while not stopped.is_set():
+            try:
+                pending.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+    
+    def produce():
+        try:
+            for item in items:
+                put(item)
+                if stopped.is_set():
+                    return
+            put(done)
+        except BaseException as e:
+            put(e)
+        finally:
+            # a generator has to be closed by the thread running it
+            if hasattr(items, 'close'):
+                items.close()
+    
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = pending.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+        thread.join()
+
+def iter_read_ahead(f, block_size=FILE_BLOCK_SIZE, max_pending=READ_AHEAD_BLOCKS):
+    '''A generator that yields the blocks of up to block_size bytes read from
+    the binary file f until its end. A background thread reads up to
+    max_pending blocks ahead, so reading and decompressing the file overlap
+    with processing the blocks.
+    '''
+    return iter_in_background(iter(lambda: f.read(block_size), b''), max_pending)
+
+def encode_batches(batches, encoding):
+    '''A generator that encodes each word in the lists batches
+    '''
+    for batch in batches:
+        yield [word.encode(encoding, 'surrogateescape') for word in batch]
+
 class Serializable(object):
     '''
     Helper class for serializing chains. Only subclasses and allowed_typenames
@@ -31,6 +227,8 @@ class Serializable(object):
             class_name = node.__class__.__name__
             if class_name == 'BaseNode':
                 node_dict['type_'] = 'base'
+                if node.dedupe:
+                    node_dict['dedupe'] = True
             elif class_name == 'MutateNode':
                 if node.is_case:
                     node_dict['type_'] = 'Case'
@@ -65,23 +263,29 @@ class Serializable(object):
 
         return chain_dict
     
-    def load_string_dict(d, controller):
-        '''Re-creates the chain from a dictionary of strings by calling
-        add_node() and add_attr() on the controller
+    def get_allowed_classes():
+        '''Gets the names of all subclasses of Serializable
         '''
-        # Get the names of all subclasses of Serializable
         def get_subclasses(class_):
             sub = {class_.__name__}
             for subclass in class_.__subclasses__():
                 sub.update(get_subclasses(subclass))
             return sub
-        allowed_classes = get_subclasses(Serializable)
+        return get_subclasses(Serializable)
+
+    def load_string_dict(d, controller):
+        '''Re-creates the chain from a dictionary of strings by calling
+        add_node() and add_attr() on the controller
+        '''
+        allowed_classes = Serializable.get_allowed_classes()
         
         if len(d['nodes']) == 0 or d['nodes'][0]['type_'] != 'base':
             raise Exception('The chain must start with a BaseNode')
         
         for node_dict in d['nodes']:
             controller.add_node(type_=node_dict['type_'])
+            if node_dict.get('dedupe', False):
+                controller.set_dedupe(True)
 
             for attr_dict in node_dict['attributes']:
                 class_name = attr_dict['class_name']
@@ -95,6 +299,42 @@ class Serializable(object):
 
         controller.update_counts()
 
+    def chain_from_string_dict(d):
+        '''Re-creates the chain from a dictionary of strings without a
+        controller or view, for running chains headless. Word counting in
+        ThreadingAttrs happens in the calling thread.
+        
+        return value: a Chain instance
+        '''
+        allowed_classes = Serializable.get_allowed_classes()
+        
+        if len(d['nodes']) == 0 or d['nodes'][0]['type_'] != 'base':
+            raise Exception('The chain must start with a BaseNode')
+        
+        chain = Chain()
+        for node_dict in d['nodes']:
+            type_ = node_dict['type_']
+            if type_ == 'base':
+                node = BaseNode(is_root=True)
+                node.dedupe = node_dict.get('dedupe', False)
+            elif type_ in ['Case', 'Substitution']:
+                node = MutateNode(is_case=type_=='Case')
+            elif type_ in ['Append', 'Prepend']:
+                node = AddNode(prepend=type_=='Prepend')
+            else:
+                raise Exception('Unexpected node type: {}'.format(type_))
+            
+            for attr_dict in node_dict['attributes']:
+                class_name = attr_dict['class_name']
+                if class_name not in allowed_classes:
+                    raise Exception('Cannot deserialize attr of class: {}'.format(class_name))
+                attr_class = globals()[class_name]
+                node.add_attr(attr_class(**attr_dict['kwargs']))
+            
+            chain.add_node(node)
+        
+        return chain
+
 class Chain(Serializable):
     '''A chain is a sequence of nodes that produces output words
     '''
@@ -109,31 +349,183 @@ class Chain(Serializable):
     def remove_node(self, idx):
         for attr in self.nodes[idx].attrs:
             attr.stop_calculating() # Stop counting words in FileAttr
+        self.nodes[idx].stop_counting_unique()
         del self.nodes[idx]
         self.baseword_count_ = None
     
+    def compile(self, batch_size=BATCH_SIZE, basewords_only=False, as_bytes=False):
+        '''Turns the nodes and attributes into a flat pipeline of functions
+        on lists of words, deciding everything that depends only on the
+        chain's configuration once rather than once per word.
+        
+        as_bytes: whether the words are bytes in the locale's encoding rather
+            than strings, which avoids decoding files and encoding the output.
+            Only possible when can_compile_bytes() is True.
+        
+        return value: a CompiledChain instance
+        '''
+        return CompiledChain(self, batch_size, basewords_only, as_bytes)
+
+    def compile_for_output(self, batch_size=BATCH_SIZE, basewords_only=False):
+        '''Compiles the chain for writing to an OutputSink, running on bytes
+        when possible
+        '''
+        as_bytes = self.can_compile_bytes(basewords_only)
+        return CompiledChain(self, batch_size, basewords_only, as_bytes)
+
+    def iter_batches(self, batch_size=BATCH_SIZE, basewords_only=False):
+        '''A generator that yields the chain's words in lists of roughly
+        batch_size words. Mutate and Add nodes may yield larger lists.
+        '''
+        yield from self.compile(batch_size, basewords_only).iter_batches()
+
     def get_words(self, basewords_only=False):
         '''A generator that yields the chain's words
         '''
+        for batch in self.iter_batches(basewords_only=basewords_only):
+            yield from batch
+
+    def can_compile_bytes(self, basewords_only=False):
+        '''Whether the chain can run on words encoded in the locale's
+        encoding, see compile(). Nodes that change letters need the decoded
+        words, so only Add nodes and nodes with no effect are supported.
+        '''
+        encoding = codecs.lookup(locale.getpreferredencoding(False)).name
+        if encoding not in BYTES_ENCODINGS:
+            return False
+        for node in ([] if basewords_only else self.nodes[1:]):
+            if node.compile_batch() == []:
+                continue
+            if isinstance(node, AddNode):
+                continue
+            return False
+        return True
+
+    def iter_base_batches(self, batch_size=BATCH_SIZE, encoding=None):
+        '''A generator that yields lists of the base words, encoded as bytes
+        if encoding isn't None
+        '''
         for attr in self.nodes[0].attrs:
-            attr.words_read = 0
+            yield from attr.get_encoded_slice_batches(0, None, batch_size, encoding)
+
+    def get_fanout(self, basewords_only=False):
+        '''Returns the exact number of words the chain generates from each
+        base word, or None if it depends on the base word (Substitution nodes
+        and Case nodes with several attributes)
+        '''
+        fanout = 1
+        for node in ([] if basewords_only else self.nodes[1:]):
+            node_fanout = node.get_fanout()
+            if node_fanout is None:
+                return None
+            fanout *= node_fanout
+        return fanout
+
+    def iter_base_range_batches(self, start, stop=None, batch_size=BATCH_SIZE, encoding=None):
+        '''A generator that yields lists of the base words start to stop
+        (None for the end) without reading the words before start
+        '''
+        for attr in self.nodes[0].attrs:
+            word_count = attr.count_words(0)
+            if stop is not None and stop <= 0:
+                return
+            if start < word_count:
+                if stop is None or stop >= word_count:
+                    attr_stop = None
+                else:
+                    attr_stop = stop
+                slice_start, slice_stop = attr.get_word_range(start, attr_stop)
+                yield from attr.get_encoded_slice_batches(slice_start, slice_stop, batch_size, encoding)
+            start = max(0, start - word_count)
+            if stop is not None:
+                stop -= word_count
+
+    def iter_positioned_base_batches(self, position=None, batch_size=BATCH_SIZE, encoding=None):
+        '''A generator that yields (list of base words, position) pairs. The
+        position is a dictionary of integers that can be passed back to
+        continue after that list, see CompiledChain.iter_positioned_batches().
         
-        if basewords_only:
-            for word in self.nodes[0].get_words([]):
-                yield word
-        else:
-            words = []
-            for node in self.nodes:
-                words = node.get_words(words)
-            for word in words:
-                yield word
+        position: where to start, or None for the first base word
+        '''
+        if position is None:
+            position = {'attr': 0, 'word': 0, 'anchor_word': 0, 'anchor': 0}
+        
+        attrs = self.nodes[0].attrs
+        for attr_idx in range(position['attr'], len(attrs)):
+            attr = attrs[attr_idx]
+            if attr_idx == position['attr']:
+                word = position['word']
+                start = attr.get_word_position(word, position['anchor_word'], position['anchor'])
+            else:
+                word = 0
+                start = attr.get_word_range(0, None)[0]
+            
+            for batch in attr.get_encoded_slice_batches(start, None, batch_size, encoding):
+                word += len(batch)
+                # The position is stored as a recent point reached by the
+                # attribute, such as a byte offset in a file, and the number
+                # of words after it
+                anchor = attr.get_slice_anchor()
+                if anchor is None:
+                    anchor_word, anchor = word, word
+                else:
+                    anchor_word = word - attr.words_read + anchor[0]
+                    anchor = anchor[1]
+                yield batch, {'attr': attr_idx, 'word': word,
+                              'anchor_word': anchor_word, 'anchor': anchor}
+
+    def get_shards(self, count):
+        '''Splits the base words into about count shards that can be
+        processed independently, see CompiledChain.iter_shard_batches().
+        Attributes get a number of shards proportional to their word counts.
+        
+        return value: a list of (attr index, start, stop) tuples in output order
+        '''
+        if self.nodes[0].dedupe:
+            raise ValueError('The base words cannot be split into shards when duplicates are removed')
+        attrs = self.nodes[0].attrs
+        word_counts = [attr.count_words(0) for attr in attrs]
+        total = sum(word_counts)
+        shards = []
+        for i, attr in enumerate(attrs):
+            if total == 0:
+                attr_count = 1
+            else:
+                attr_count = max(1, round(count * word_counts[i] / total))
+            for start, stop in attr.get_shards(attr_count):
+                shards.append((i, start, stop))
+        return shards
+
+    def get_character_counts(self, idx):
+        '''Returns the character counts of the words going into the Mutate
+        node at index idx (see MutateNode.count_characters()), if its word
+        count depends on the input words and can be worked out from them,
+        otherwise None. Only the base words are counted, so the nodes in
+        between must have no effect.
+        '''
+        node = self.nodes[idx]
+        if idx == 0 or not isinstance(node, MutateNode) or node.get_fanout() is not None:
+            return None
+        if any(prev_node.compile_batch() != [] for prev_node in self.nodes[1:idx]):
+            return None
+        if node.is_case:
+            if node.get_case_indexes() is None and node.get_case_toggles() is None:
+                return None
+            return self.nodes[0].count_cases()
+        originals = node.get_originals()
+        if originals is None:
+            return None
+        return self.nodes[0].count_characters(originals)
 
     def count_words(self):
         '''Returns the total number of words produced by this chain
         '''
         count = 0
-        for node in self.nodes:
-            count = node.count_words(count)
+        for idx, node in enumerate(self.nodes):
+            if isinstance(node, MutateNode):
+                count = node.count_words(count, self.get_character_counts(idx))
+            else:
+                count = node.count_words(count)
         return count
 
     def count_bytes(self):
@@ -141,13 +533,32 @@ class Chain(Serializable):
         '''
         word_count = 0
         byte_count = 0
-        for node in self.nodes:
-            byte_count = node.count_bytes(byte_count, word_count)
-            word_count = node.count_words(word_count)
+        for idx, node in enumerate(self.nodes):
+            if isinstance(node, MutateNode):
+                character_counts = self.get_character_counts(idx)
+                byte_count = node.count_bytes(byte_count, word_count, character_counts)
+                word_count = node.count_words(word_count, character_counts)
+            else:
+                byte_count = node.count_bytes(byte_count, word_count)
+                word_count = node.count_words(word_count)
         if byte_count > 0:
             byte_count += word_count # count the newline characters
         return byte_count
 
+    def has_exact_counts(self):
+        '''Whether count_words() is exact rather than an estimate. Nodes
+        whose number of words depends on the input word are only counted
+        exactly when they are Substitution nodes counted from the base
+        words' characters, see get_character_counts().
+        '''
+        for idx, node in enumerate(self.nodes[1:], 1):
+            if node.get_fanout() is not None:
+                continue
+            if not (isinstance(node, MutateNode) and node.has_exact_counts()
+                    and self.get_character_counts(idx) is not None):
+                return False
+        return True
+
     def check_hashcat_compatible(self):
         '''Returns True if all nodes and their attributes can be turned into
         hashcat rules
@@ -190,6 +601,181 @@ class Chain(Serializable):
                 progress_count += attr.words_read
             return int(100. * progress_count / self.baseword_count_)
 
+class CompiledChain(object):
+    '''The execution plan of a chain, created by Chain.compile()
+    
+    The base node produces lists of words, with repeated words removed if
+    its dedupe flag is set. Each following node either maps a list of words
+    to a new list (Mutate nodes), in which case consecutive nodes are fused
+    into one stage, or is a generator stage that may produce any number of
+    lists (Add nodes). Nodes with no effect are left out.
+    '''
+    def __init__(self, chain, batch_size=BATCH_SIZE, basewords_only=False, as_bytes=False):
+        self.chain = chain
+        self.batch_size = batch_size
+        if chain.nodes[0].dedupe:
+            # The number of words from each base word is still fixed, but
+            # the removed base words are only known by reading them all
+            self.fanout = None
+            self.dedupe_stage = chain.nodes[0].compile_dedupe()
+        else:
+            self.fanout = chain.get_fanout(basewords_only)
+            self.dedupe_stage = None
+        if as_bytes:
+            if not chain.can_compile_bytes(basewords_only):
+                raise ValueError('The chain cannot run on bytes')
+            self.encoding = locale.getpreferredencoding(False)
+            self.source = lambda prev_batches: chain.iter_base_batches(batch_size, self.encoding)
+        else:
+            self.encoding = None
+            self.source = chain.nodes[0].compile(batch_size)
+        
+        # Each stage is a function taking and returning an iterable of lists
+        self.stages = []
+        batch_functions = []
+        for node in ([] if basewords_only else chain.nodes[1:]):
+            functions = node.compile_batch()
+            if functions is not None:
+                batch_functions.extend(functions)
+            else:
+                if len(batch_functions) > 0:
+                    self.stages.append(map_stage(batch_functions))
+                    batch_functions = []
+                self.stages.append(node.compile(batch_size, self.encoding))
+        if len(batch_functions) > 0:
+            self.stages.append(map_stage(batch_functions))
+
+    def iter_batches(self, source_batches=None):
+        '''A generator that yields the chain's words in non-empty lists
+        
+        source_batches: lists of base words to use instead of the base node's
+        '''
+        for attr in self.chain.nodes[0].attrs:
+            attr.words_read = 0
+        
+        if source_batches is None:
+            batches = self.source([])
+        else:
+            batches = source_batches
+        if self.dedupe_stage is not None:
+            batches = self.dedupe_stage(batches)
+        for stage in self.stages:
+            batches = stage(batches)
+        for batch in batches:
+            if len(batch) > 0:
+                yield batch
+
+    def iter_positioned_batches(self, position=None):
+        '''A generator that yields (list of words, position) pairs. Each list
+        of base words is run through the whole chain before the next one is
+        read, and then ([], position) is yielded, where position records the
+        base words read so far. Otherwise position is None. Passing a position
+        back continues the output right after that point.
+        
+        When duplicates are removed, the base words before the position are
+        read again to find the words seen before it.
+        '''
+        for attr in self.chain.nodes[0].attrs:
+            attr.words_read = 0
+        
+        if self.dedupe_stage is None:
+            positioned_base_batches = self.chain.iter_positioned_base_batches(position, self.batch_size,
+                                                                              self.encoding)
+        else:
+            positioned_base_batches = self.iter_deduped_positioned_base_batches(position)
+        for base_batch, base_position in positioned_base_batches:
+            batches = [base_batch]
+            for stage in self.stages:
+                batches = stage(batches)
+            for batch in batches:
+                if len(batch) > 0:
+                    yield batch, None
+            yield [], base_position
+
+    def iter_deduped_positioned_base_batches(self, position):
+        '''Like Chain.iter_positioned_base_batches(), but with repeated base
+        words removed, reading from the first base word
+        '''
+        positioned_base_batches = self.chain.iter_positioned_base_batches(None, self.batch_size,
+                                                                          self.encoding)
+        word_filter = self.chain.nodes[0].get_word_filter()
+        skipping = position is not None
+        for base_batch, base_position in positioned_base_batches:
+            base_batch = word_filter.filter(base_batch)
+            if not skipping:
+                yield base_batch, base_position
+            elif (base_position['attr'], base_position['word']) >= (position['attr'], position['word']):
+                skipping = False
+
+    def can_write_blocks(self):
+        '''Whether iter_blocks() can be used: the chain outputs its base words
+        unchanged, as bytes
+        '''
+        return self.encoding is not None and len(self.stages) == 0 and self.dedupe_stage is None
+
+    def iter_blocks(self):
+        '''A generator that yields (bytes, word count) for blocks of the
+        output, with a newline after each word. Files are copied in large
+        blocks without splitting them into lines.
+        '''
+        for attr in self.chain.nodes[0].attrs:
+            attr.words_read = 0
+        for attr in self.chain.nodes[0].attrs:
+            yield from attr.iter_word_blocks(0, None, self.batch_size, self.encoding)
+
+    def iter_shard_batches(self, shard):
+        '''A generator that yields the words produced from one shard of the
+        base words, given one of the tuples returned by Chain.get_shards()
+        '''
+        attr_idx, start, stop = shard
+        attr = self.chain.nodes[0].attrs[attr_idx]
+        yield from self.iter_batches(attr.get_encoded_slice_batches(start, stop, self.batch_size,
+                                                                    self.encoding))
+
+    def iter_range_batches(self, start, stop=None):
+        '''A generator that yields the chain's words start to stop (None for
+        the end) in lists. When every base word generates the same number of
+        words, generation starts at the base word containing word start, so
+        the words before it are not generated. Otherwise they are generated
+        and dropped.
+        '''
+        if self.fanout is None:
+            yield from slice_batches(self.iter_batches(), start, stop)
+            return
+        if self.fanout == 0:
+            return
+        
+        base_start = start // self.fanout
+        base_stop = None if stop is None else -(-stop // self.fanout)
+        source_batches = self.chain.iter_base_range_batches(base_start, base_stop, self.batch_size,
+                                                            self.encoding)
+        offset = base_start * self.fanout
+        yield from slice_batches(self.iter_batches(source_batches), start - offset,
+                                 None if stop is None else stop - offset)
+
+    def get_words(self):
+        '''A generator that yields the chain's words
+        '''
+        for batch in self.iter_batches():
+            yield from batch
+
+def map_stage(functions):
+    '''Returns a pipeline stage that applies each of the functions in turn to
+    every list of words
+    '''
+    if len(functions) == 1:
+        function = functions[0]
+        def stage(prev_batches):
+            for batch in prev_batches:
+                yield function(batch)
+    else:
+        def stage(prev_batches):
+            for batch in prev_batches:
+                for function in functions:
+                    batch = function(batch)
+                yield batch
+    return stage
+
 class DuplicateAttrException(Exception):
     '''Raised in a node's add_attr to indicate that an identical attribute is
     already present
@@ -201,11 +787,40 @@ class BaseNode(Serializable):
     modify and then output them.
     '''
 
-    def __init__(self, is_root=True):
+    def __init__(self, is_root=True, controller=None):
         '''is_root: bool, whether this is the first attr in the chain
+        controller: the GUI's controller, if any, for a root node. With a
+                    controller, the counts without repeated words are worked
+                    out in a background thread, see count_unique_in_background().
         '''
         self.is_root = is_root
+        self.controller = controller
         self.attrs = []
+        # Whether words repeated in the base words are left out, see
+        # dedupe.py. Only used in the root node.
+        self.dedupe = False
+        self.dedupe_memory_limit = dedupe.DEFAULT_MEMORY_LIMIT
+        self.dedupe_error_rate = dedupe.DEFAULT_ERROR_RATE
+        # (key, word count, byte count) and (key, charcount.CharacterIndex) of
+        # the words without repeated words, see get_unique_key()
+        self.unique_counts_ = None
+        self.unique_index_ = None
+        # the thread counting them with a controller, and its key
+        self.unique_thread = None
+        self.unique_thread_key = None
+        self.unique_kill_flag = False
+        # originals -> (key, character counts), see get_character_counts()
+        self.character_counts_ = {}
+
+    def __getstate__(self):
+        '''The controller and counting thread are left out when pickling, for
+        sending the chain to worker processes
+        '''
+        state = self.__dict__.copy()
+        state['controller'] = None
+        state['unique_thread'] = None
+        state['unique_kill_flag'] = False
+        return state
 
     def add_attr(self, attr):
         '''Add an attribute to the node. May raise DuplicateAttrException.
@@ -215,22 +830,278 @@ class BaseNode(Serializable):
         else:
             self.attrs.append(attr)
 
+    def get_batches(self, prev_batches, batch_size=BATCH_SIZE):
+        '''Returns an iterator over lists of the node's words, given the
+        sequence of input word lists prev_batches
+        '''
+        return self.compile(batch_size)(prev_batches)
+
+    def compile_batch(self):
+        '''If this node maps each list of input words to one list of output
+        words, returns a list of functions that are applied in turn to do it
+        (an empty list if the node has no effect). Otherwise returns None and
+        compile() must be used.
+        '''
+        return None
+
+    def compile(self, batch_size=BATCH_SIZE, encoding=None):
+        '''Returns a function that takes the sequence of input word lists and
+        returns an iterator over lists of the node's words
+        
+        encoding: if not None, the words are bytes in this encoding, see
+            Chain.can_compile_bytes()
+        '''
+        functions = self.compile_batch()
+        if functions is not None:
+            return map_stage(functions)
+        
+        attrs = list(self.attrs)
+        is_root = self.is_root
+        def stage(prev_batches):
+            if is_root:
+                prev_batches = list(prev_batches)
+                assert sum(map(len, prev_batches)) == 0 # there cannot be any previous words
+            for attr in attrs:
+                yield from attr.get_batches(prev_batches, batch_size)
+        return stage
+
+    def get_word_filter(self):
+        '''Returns a new dedupe.WordFilter sized for the node's words
+        '''
+        word_count = sum(attr.count_words(0) for attr in self.attrs)
+        return dedupe.WordFilter(word_count, self.dedupe_memory_limit, self.dedupe_error_rate)
+
+    def compile_dedupe(self):
+        '''Returns a pipeline stage that removes the words seen before from
+        the lists of base words. Each run of the stage starts with no words
+        seen.
+        '''
+        def stage(prev_batches):
+            word_filter = self.get_word_filter()
+            for batch in prev_batches:
+                yield word_filter.filter(batch)
+        return stage
+
+    def get_unique_key(self):
+        '''Returns the key of the counts without repeated words, which
+        changes with the attributes and their word counts
+        '''
+        return ([id(attr) for attr in self.attrs], [attr.count_words(0) for attr in self.attrs],
+                self.dedupe_memory_limit, self.dedupe_error_rate)
+
+    def has_unique_counts(self):
+        '''Whether count_unique() has the counts for the current attributes
+        '''
+        return self.unique_counts_ is not None and self.unique_counts_[0] == self.get_unique_key()
+
+    def count_unique(self):
+        '''Returns (word count, byte count) of the node's words without
+        repeated words. The words are read once, and the counts kept until
+        the attributes change.
+        '''
+        if not self.has_unique_counts():
+            key = self.get_unique_key()
+            self.unique_counts_ = (key,) + self.scan_unique()
+        return self.unique_counts_[1:]
+
+    def scan_unique(self):
+        '''Reads the node's words to count them without repeated words
+        
+        return value: (word count, byte count), or None if
+                      stop_counting_unique() was called
+        '''
+        encoding = codecs.lookup(locale.getpreferredencoding(False)).name
+        if encoding not in BYTES_ENCODINGS:
+            encoding = None
+        word_filter = self.get_word_filter()
+        word_count = byte_count = 0
+        for attr in list(self.attrs):
+            for batch in attr.get_encoded_slice_batches(0, None, BATCH_SIZE, encoding):
+                if self.unique_kill_flag:
+                    return None
+                batch = word_filter.filter(batch)
+                word_count += len(batch)
+                byte_count += sum(map(len, batch))
+        return word_count, byte_count
+
+    def get_unique_index(self):
+        '''Returns the charcount.CharacterIndex of the node's words without
+        repeated words for the current attributes, or None if it hasn't been
+        built by count_unique_in_background()
+        '''
+        if self.unique_index_ is None or self.unique_index_[0] != self.get_unique_key():
+            return None
+        return self.unique_index_[1]
+
+    def count_unique_in_background(self):
+        '''With a controller, starts a thread that works out the counts
+        without repeated words and then their character index, unless it is
+        already running or they are known. It runs once the attributes have
+        counted their words, and asks the controller to update the counts
+        when it is done.
+        
+        return value: whether the thread is running
+        '''
+        if not (self.is_root and self.dedupe) or self.controller is None:
+            return False
+        if any(attr.calculating or getattr(attr, 'file_error', None) is not None
+               for attr in self.attrs):
+            return False
+        key = self.get_unique_key()
+        if self.unique_thread is not None and self.unique_thread.is_alive():
+            if self.unique_thread_key == key:
+                return True
+            self.stop_counting_unique()
+        if self.has_unique_counts() and self.get_unique_index() is not None:
+            return False
+        self.unique_kill_flag = False
+        self.unique_thread_key = key
+        self.unique_thread = threading.Thread(target=self.threaded_unique_counter, args=(key,))
+        self.unique_thread.start()
+        return True
+
+    def threaded_unique_counter(self, key):
+        '''Counts the words without repeated words in a background thread,
+        see count_unique_in_background()
+        '''
+        try:
+            if not self.has_unique_counts():
+                counts = self.scan_unique()
+                if counts is None:
+                    return
+                self.unique_counts_ = (key,) + counts
+                self.controller.update_counts()
+            
+            character_index = charcount.CharacterIndex(CASE_INDEX_FUNCTIONS)
+            word_filter = self.get_word_filter()
+            for attr in list(self.attrs):
+                for batch in attr.get_slice_batches(0, None):
+                    if self.unique_kill_flag:
+                        return
+                    character_index.add(word_filter.filter(batch))
+            self.unique_index_ = (key, character_index)
+            self.controller.update_counts()
+        except Exception as e:
+            print("Exception while counting words:", e)
+
+    def is_counting_unique(self):
+        '''Whether the background thread of count_unique_in_background() is
+        running
+        '''
+        return self.unique_thread is not None and self.unique_thread.is_alive()
+
+    def stop_counting_unique(self):
+        '''Stops the background thread of count_unique_in_background()
+        '''
+        if self.unique_thread is not None:
+            self.unique_kill_flag = True
+            self.unique_thread.join()
+            self.unique_thread = None
+
+    def count_characters(self, originals):
+        '''Returns a charcount.CharacterCounts of the node's words for
+        substitutions that match the characters originals, or None if it
+        isn't available yet, see get_character_counts()
+        '''
+        return self.get_character_counts(originals)
+
+    def count_cases(self):
+        '''Returns a charcount.CaseCounts of the node's words, or None if it
+        isn't available yet, see get_character_counts()
+        '''
+        return self.get_character_counts(None)
+
+    def get_character_counts(self, originals):
+        '''Returns the character counts of the node's words: the
+        charcount.CharacterCounts for originals, or the charcount.CaseCounts
+        if originals is None. They are None while attributes are still
+        counting their words, files are missing or the attributes' character
+        indexes aren't built yet.
+        
+        The counts are added up from the attributes' character indexes, and
+        kept until the attributes or characters change. When repeated words
+        are left out, the words are read instead.
+        '''
+        if any(attr.calculating or getattr(attr, 'file_error', None) is not None
+               for attr in self.attrs):
+            return None
+        if originals is not None:
+            originals = frozenset(originals)
+        deduping = self.is_deduping()
+        if deduping and self.controller is not None:
+            # The words are only read in the background, see
+            # count_unique_in_background()
+            unique_index = self.get_unique_index()
+            if unique_index is None:
+                return None
+            if originals is None:
+                return unique_index.cases
+            if not originals <= charcount.INDEXED_CHARACTERS:
+                return None
+        def get_key():
+            return ([id(attr) for attr in self.attrs], [attr.count_words(0) for attr in self.attrs],
+                    [attr.character_index for attr in self.attrs], deduping,
+                    self.unique_index_, self.dedupe_memory_limit, self.dedupe_error_rate)
+        cached = self.character_counts_.get(originals)
+        if cached is not None and cached[0] == get_key():
+            return cached[1]
+        
+        if originals is None:
+            character_counts = charcount.CaseCounts(CASE_INDEX_FUNCTIONS)
+        else:
+            character_counts = charcount.CharacterCounts(originals)
+        if deduping and self.controller is not None:
+            character_counts = self.get_unique_index().characters.project(originals)
+        elif deduping:
+            word_filter = self.get_word_filter()
+            for attr in self.attrs:
+                for batch in attr.get_slice_batches(0, None):
+                    character_counts.add(word_filter.filter(batch))
+        else:
+            for attr in self.attrs:
+                if originals is None:
+                    character_index = attr.get_character_index()
+                    attr_counts = None if character_index is None else character_index.cases
+                else:
+                    attr_counts = attr.count_characters(originals)
+                if attr_counts is None:
+                    return None
+                character_counts.merge(attr_counts)
+        self.character_counts_[originals] = (get_key(), character_counts)
+        return character_counts
+
+    def is_deduping(self):
+        '''Whether the word counts leave out repeated base words. They can't
+        while attributes are still counting their words or files are missing,
+        or with a controller until the background thread has counted them.
+        '''
+        if not (self.is_root and self.dedupe):
+            return False
+        if any(attr.calculating or getattr(attr, 'file_error', None) is not None
+               for attr in self.attrs):
+            return False
+        return self.controller is None or self.has_unique_counts()
+
+    def get_fanout(self):
+        '''Returns the exact number of words generated for each input word,
+        or None if it depends on the word
+        '''
+        return None
+
     def get_words(self, prev_words):
         '''A generator that yields the node's words, given the sequence of
         input words prev_words
         '''
-        if self.is_root:
-            assert len(list(prev_words)) == 0 # there cannot be any previous words
-        
-        for attr in self.attrs:
-            for word in attr.get_words(prev_words):
-                yield word
+        for batch in self.get_batches(iter_batches(prev_words)):
+            yield from batch
 
     def count_words(self, prev_word_count):
         '''Estimates the number of words generated by this node
         '''
         if self.is_root:
             assert prev_word_count == 0
+        if self.is_deduping():
+            return self.count_unique()[0]
 
         if len(self.attrs) == 0:
             return prev_word_count
@@ -245,6 +1116,8 @@ class BaseNode(Serializable):
         '''
         if self.is_root:
             assert prev_byte_count == 0
+        if self.is_deduping():
+            return self.count_unique()[1]
         
         byte_count = prev_byte_count
         for attr in self.attrs:
@@ -267,32 +1140,190 @@ class MutateNode(BaseNode):
     def __init__(self, is_case=False):
         self.is_case = is_case
         BaseNode.__init__(self, is_root=False)
+        self.exact_counts_ = None
 
-    def get_words(self, prev_words):
+    def compile_batch(self):
         if len(self.attrs) == 0:
-            for word in prev_words:
-                yield word
-        else:
-            dedupe = True
-            if dedupe and len(self.attrs) > 1:
-                for prev_word in prev_words:
-                    new_words = set()
-                    for attr in self.attrs:
-                        for word in attr.get_words([prev_word]):
-                            new_words.update([word])
-                    for word in new_words:
-                        yield word
-            else:
-                for prev_word in prev_words:
-                    for attr in self.attrs:
-                        for word in attr.get_words([prev_word]):
-                            yield word
+            return []
+        elif len(self.attrs) == 1:
+            if isinstance(self.attrs[0], NothingMutatorAttr):
+                return []
+            return [self.attrs[0].compile()]
+        
+        # Several attributes may produce the same word, so de-duplicate the
+        # output for each input word, keeping the first of each word. If the
+        # attributes can't collide, only the input word can be repeated.
+        word_list_functions = [attr.compile_word_lists() for attr in self.attrs]
+        if not any(self.get_colliding_attrs()):
+            def mutate(words):
+                # one list of output words per input word, for each attr
+                attr_word_lists = [function(words) for function in word_list_functions]
+                new_words = []
+                for word, word_lists in zip(words, zip(*attr_word_lists)):
+                    has_word = False
+                    for word_list in word_lists:
+                        if word in word_list:
+                            if has_word:
+                                word_list = [new_word for new_word in word_list if new_word != word]
+                            elif word_list.count(word) > 1:
+                                i = word_list.index(word) + 1
+                                word_list = word_list[:i] + [new_word for new_word in word_list[i:]
+                                                             if new_word != word]
+                            has_word = True
+                        new_words.extend(word_list)
+                return new_words
+            return [mutate]
+        
+        def mutate(words):
+            attr_word_lists = [function(words) for function in word_list_functions]
+            new_words = []
+            for word_lists in zip(*attr_word_lists):
+                if sum(map(len, word_lists)) > SMALL_DEDUPE_SIZE:
+                    new_words.extend(dict.fromkeys(itertools.chain.from_iterable(word_lists)))
+                    continue
+                seen = []
+                for word_list in word_lists:
+                    for new_word in word_list:
+                        if new_word not in seen:
+                            seen.append(new_word)
+                new_words.extend(seen)
+            return new_words
+        return [mutate]
+
+    def get_colliding_attrs(self):
+        '''Returns a list of whether each attribute can make the same word as
+        another attribute, or itself, other than the input word (see
+        BaseAttr.can_collide())
+        '''
+        return [any(attr.can_collide(other) and other.can_collide(attr) for other in self.attrs)
+                for attr in self.attrs]
 
-    def count_words(self, prev_word_count):
+    def get_fanout(self):
+        if len(self.attrs) == 0:
+            return 1
+        if len(self.attrs) == 1 and isinstance(self.attrs[0], NothingMutatorAttr):
+            return 1
+        if len(self.attrs) == 1 and isinstance(self.attrs[0], CaseAttr):
+            return 1 if self.attrs[0].type_ != 'Combinations' else None
+        return None
+
+    def get_originals(self):
+        '''Returns the set of characters the node's substitutions match if
+        its word counts can be worked out from character counts of the input
+        words (see charcount.py), otherwise None
+        '''
+        if self.is_case:
+            return None
+        originals = set()
+        for attr in self.attrs:
+            if isinstance(attr, SubstitutionAttr):
+                originals.update(original for original, _ in attr.replacements)
+            elif not isinstance(attr, NothingMutatorAttr):
+                return None
+        if not any(isinstance(attr, SubstitutionAttr) for attr in self.attrs):
+            return None
+        return originals
+
+    def get_case_indexes(self):
+        '''Returns the indexes in CASE_INDEX_KEYS of the node's case changes
+        if its word counts can be worked out from a charcount.CaseCounts of
+        the input words, otherwise None
+        '''
+        if not self.is_case:
+            return None
+        indexes = []
+        for attr in self.attrs:
+            if isinstance(attr, NothingMutatorAttr):
+                key = ('Nothing', None)
+            elif isinstance(attr, CaseAttr):
+                key = attr.get_index_key()
+            else:
+                return None
+            if key not in CASE_INDEX_KEYS:
+                return None
+            indexes.append(CASE_INDEX_KEYS.index(key))
+        return indexes
+
+    def get_case_toggles(self):
+        '''Returns (length, max_variants) of the node's 'Combinations' case
+        change if its word counts can be worked out from a
+        charcount.CaseCounts of the input words (see
+        CaseCounts.count_toggles()), otherwise None. The other attributes can
+        only keep the input word, which is always the first combination.
+        '''
+        if not self.is_case:
+            return None
+        toggles = None
+        for attr in self.attrs:
+            if isinstance(attr, NothingMutatorAttr):
+                continue
+            if (toggles is not None or not isinstance(attr, CaseAttr) or attr.type_ != 'Combinations'
+                    or attr.idx > charcount.TOGGLE_LENGTH):
+                return None
+            toggles = (attr.idx, attr.max_variants)
+        return toggles
+
+    def has_exact_counts(self):
+        '''Whether count_characters() gives the exact counts. Different
+        substitutions can make the same word, which is only written once, so
+        it is only exact when there is one substitution attribute or the
+        attributes can't collide (see get_colliding_attrs()). Case changes
+        that make the same word are always counted once.
+        '''
+        if self.is_case:
+            return self.get_case_indexes() is not None or self.get_case_toggles() is not None
+        if len(self.attrs) == 1:
+            return isinstance(self.attrs[0], SubstitutionAttr)
+        return (any(isinstance(attr, SubstitutionAttr) for attr in self.attrs)
+                and not any(self.get_colliding_attrs()))
+
+    def count_characters(self, character_counts):
+        '''Returns (word count, byte count) of the node's words, given the
+        charcount.CaseCounts of the input words for Case nodes, or their
+        charcount.CharacterCounts for get_originals(). The input word is only
+        counted once when several attributes output it, but other words made
+        by more than one substitution are counted each time. The counts are
+        kept until the input words or attributes change.
+        '''
+        key = (character_counts, [id(attr) for attr in self.attrs])
+        if self.exact_counts_ is not None and self.exact_counts_[0] == key:
+            return self.exact_counts_[1]
+        if self.is_case:
+            toggles = self.get_case_toggles()
+            if toggles is not None:
+                self.exact_counts_ = (key, character_counts.count_toggles(*toggles))
+            else:
+                self.exact_counts_ = (key, character_counts.count(self.get_case_indexes()))
+        else:
+            keeps_word = any(isinstance(attr, NothingMutatorAttr) for attr in self.attrs)
+            count_functions = [attr.compile_count_profile() for attr in self.attrs
+                               if isinstance(attr, SubstitutionAttr)]
+            def count_profile(profile):
+                word_count = 1 if keeps_word else 0
+                byte_count = 0
+                has_word = keeps_word
+                for count_attr_profile in count_functions:
+                    attr_word_count, attr_byte_count, attr_has_word = count_attr_profile(profile)
+                    word_count += attr_word_count
+                    byte_count += attr_byte_count
+                    if attr_has_word and has_word:
+                        word_count -= 1 # the input word again
+                    has_word = has_word or attr_has_word
+                return word_count, byte_count
+            self.exact_counts_ = (key, character_counts.count(count_profile))
+        return self.exact_counts_[1]
+
+    def count_words(self, prev_word_count, character_counts=None):
+        '''character_counts: the character counts of the input words from
+                          Chain.get_character_counts(), if known, which
+                          give the exact counts, see count_characters()
+        '''
         if len(self.attrs) == 0:
             return prev_word_count
     
-        if self.is_case:
+        if character_counts is not None:
+            return self.count_characters(character_counts)[0]
+        elif self.is_case:
             return BaseNode.count_words(self, prev_word_count)
         else:
             # Use heuristics to estimate Substitution word count
@@ -313,11 +1344,13 @@ class MutateNode(BaseNode):
 
             return count
 
-    def count_bytes(self, prev_byte_count, prev_word_count):
+    def count_bytes(self, prev_byte_count, prev_word_count, character_counts=None):
         if len(self.attrs) == 0:
             return prev_byte_count
 
-        if self.is_case:
+        if character_counts is not None:
+            return self.count_characters(character_counts)[1]
+        elif self.is_case:
             byte_count = 0
             for attr in self.attrs:
                 byte_count += attr.count_bytes(prev_byte_count, prev_word_count)
@@ -356,6 +1389,53 @@ class MutateNode(BaseNode):
     
         return new_lines
 
+class AddWordTable(object):
+    '''The words of an AddNode's attributes, read once per run. They are held
+    in memory in a single list up to about memory_limit bytes. Beyond that
+    they are moved to a temporary file of pickled lists of words, which is
+    read from the start for every input word.
+    '''
+    def __init__(self, attrs, batch_size=BATCH_SIZE, encoding=None, memory_limit=None):
+        '''
+        encoding: if not None, the words are bytes in this encoding
+        memory_limit: the default is ADD_WORDS_MEMORY_LIMIT
+        '''
+        if memory_limit is None:
+            memory_limit = ADD_WORDS_MEMORY_LIMIT
+        self.words = []
+        self.file = None
+        self.word_count = 0
+        
+        memory_used = 0
+        for attr in attrs:
+            for batch in attr.get_encoded_slice_batches(0, None, batch_size, encoding):
+                self.word_count += len(batch)
+                if self.file is not None:
+                    pickle.dump(batch, self.file, pickle.HIGHEST_PROTOCOL)
+                    continue
+                self.words.extend(batch)
+                memory_used += sum(map(len, batch)) + WORD_OVERHEAD * len(batch)
+                if memory_used > memory_limit:
+                    self.file = tempfile.TemporaryFile(prefix='mentalist-')
+                    for words in iter_batches(self.words, batch_size):
+                        pickle.dump(words, self.file, pickle.HIGHEST_PROTOCOL)
+                    self.words = None
+        if self.file is not None:
+            self.file.flush()
+    
+    def iter_batches(self):
+        '''A generator that yields lists of all of the words
+        '''
+        if self.file is None:
+            yield self.words
+            return
+        self.file.seek(0)
+        while True:
+            try:
+                yield pickle.load(self.file)
+            except EOFError:
+                return
+
 class AddNode(BaseNode):
     '''Append or prepend a string to the word
     '''
@@ -363,18 +1443,59 @@ class AddNode(BaseNode):
         BaseNode.__init__(self, is_root=False)
         self.prepend = prepend
 
-    def get_words(self, prev_words):
+    def compile_batch(self):
         if len(self.attrs) == 0:
-            for word in prev_words:
-                yield word
-    
-        for word in prev_words:
-            for attr in self.attrs:
-                for other_word in attr.get_words([]):
-                    if self.prepend:
-                        yield other_word + word
-                    else:
-                        yield word + other_word
+            return []
+        if len(self.attrs) == 1 and isinstance(self.attrs[0], NothingAdderAttr):
+            return [] # adding "" has no effect
+        return None
+
+    def compile(self, batch_size=BATCH_SIZE, encoding=None):
+        functions = self.compile_batch()
+        if functions is not None:
+            return map_stage(functions)
+        
+        prepend = self.prepend
+        # The attributes' words are read once, rather than once for every
+        # input word
+        table = AddWordTable(self.attrs, batch_size, encoding)
+        
+        if table.file is None:
+            # The words are held in memory, so combine them with several
+            # input words at a time
+            other_words = table.words
+            step = max(1, batch_size // max(1, len(other_words)))
+            
+            def stage(prev_batches):
+                if len(other_words) == 0:
+                    return
+                for batch in prev_batches:
+                    for i in range(0, len(batch), step):
+                        words = batch[i:i + step]
+                        if prepend:
+                            yield [other_word + word for word in words for other_word in other_words]
+                        else:
+                            yield [word + other_word for word in words for other_word in other_words]
+            return stage
+        
+        def stage(prev_batches):
+            new_batch = []
+            for batch in prev_batches:
+                for word in batch:
+                    for other_words in table.iter_batches():
+                        if prepend:
+                            new_batch.extend([other_word + word for other_word in other_words])
+                        else:
+                            new_batch.extend(map(word.__add__, other_words))
+                        if len(new_batch) >= batch_size:
+                            yield new_batch
+                            new_batch = []
+            if len(new_batch) > 0:
+                yield new_batch
+        return stage
+
+    def get_fanout(self):
+        return self.count_words(1)
 
     def count_words(self, prev_word_count):
         if len(self.attrs) == 0:
@@ -429,24 +1550,150 @@ class BaseAttr(Serializable):
     def __init__(self, label=""):
         self.label = label
         self.calculating = False
+        # the charcount.CharacterIndex of the attribute's own words, once
+        # it has been built
+        self.character_index = None
+
+    def get_words(self, prev_words=[]):
+        '''A generator that yields the attribute's words, given the sequence
+        of input words prev_words
+        '''
+        for batch in self.get_batches(iter_batches(prev_words)):
+            yield from batch
 
     @abstractmethod
-    def get_words(self, prev_words):
-        pass
-    
-    @abstractmethod
-    def count_words(self, prev_word_count):
+    def get_batches(self, prev_batches, batch_size=BATCH_SIZE):
+        '''A generator that yields lists of the attribute's words, given the
+        sequence of input word lists prev_batches
+        '''
         pass
 
     @abstractmethod
-    def count_bytes(self, prev_byte_count, prev_word_count):
-        pass
-    
-    def check_hashcat_compatible(self):
-        return True
-    
-    def __eq__(self, other):
-        '''This is used to avoid duplicate attributes within a node
+    def compile(self):
+        '''Mutator attributes return a function that maps a list of input
+        words to the list of output words
+        '''
+        pass
+
+    def get_shards(self, count):
+        '''Splits the attribute's own words into about count contiguous
+        ranges. The units of the ranges depend on the attribute, by default
+        they are word indexes.
+        
+        return value: a list of (start, stop) tuples for get_slice_batches()
+        '''
+        word_count = self.count_words(0)
+        bounds = sorted(set(word_count * k // count for k in range(count + 1)))
+        if len(bounds) == 1:
+            return [(0, 0)]
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def get_word_range(self, start, stop):
+        '''Converts the range of word indexes start to stop (None for the end)
+        into the units of get_slice_batches()
+        '''
+        return start, stop
+
+    def get_word_position(self, word, anchor_word, anchor):
+        '''Returns the get_slice_batches() start value for the word index word,
+        given the start value anchor of the earlier word index anchor_word
+        '''
+        return self.get_word_range(word, None)[0]
+
+    def get_slice_anchor(self):
+        '''While get_slice_batches() is running, returns (number of words,
+        start value) for a recent point reached by it where the number of
+        words counts from the beginning of the slice, or None if the words
+        are numbered by their index
+        '''
+        return None
+
+    def get_slice_batches(self, start, stop, batch_size=BATCH_SIZE):
+        '''A generator that yields lists of the attribute's own words in the
+        range start to stop, as returned by get_shards() or get_word_range()
+        '''
+        words = itertools.islice(self.get_words([]), start, stop)
+        yield from iter_batches(words, batch_size)
+
+    def get_encoded_slice_batches(self, start, stop, batch_size=BATCH_SIZE, encoding=None):
+        '''Like get_slice_batches(), but if encoding isn't None the words are
+        encoded as bytes
+        '''
+        batches = self.get_slice_batches(start, stop, batch_size)
+        if encoding is None:
+            return batches
+        return encode_batches(batches, encoding)
+
+    def iter_word_blocks(self, start, stop, batch_size, encoding):
+        '''A generator that yields (bytes, word count) for the words in the
+        range start to stop encoded in encoding, each followed by a newline
+        '''
+        for batch in self.get_encoded_slice_batches(start, stop, batch_size, encoding):
+            if len(batch) > 0:
+                yield b'\n'.join(batch) + b'\n', len(batch)
+
+    def get_character_index(self):
+        '''Returns the charcount.CharacterIndex of the attribute's own words,
+        or None if it isn't available yet. By default the words are read
+        the first time.
+        '''
+        if self.character_index is None:
+            character_index = charcount.CharacterIndex(CASE_INDEX_FUNCTIONS)
+            for batch in self.get_slice_batches(*self.get_word_range(0, None)):
+                character_index.add(batch)
+            self.character_index = character_index
+        return self.character_index
+
+    def count_characters(self, originals):
+        '''Returns a charcount.CharacterCounts of the attribute's own words
+        for substitutions that match the characters originals, or None if it
+        isn't available yet
+        '''
+        if originals <= charcount.INDEXED_CHARACTERS:
+            character_index = self.get_character_index()
+            if character_index is None:
+                return None
+            return character_index.characters.project(originals)
+        return self.scan_characters(originals)
+
+    def scan_characters(self, originals):
+        '''Reads the attribute's own words to count characters that aren't
+        in the character index, see count_characters()
+        '''
+        character_counts = charcount.CharacterCounts(originals)
+        for batch in self.get_slice_batches(*self.get_word_range(0, None)):
+            character_counts.add(batch)
+        return character_counts
+
+    def compile_word_lists(self):
+        '''Returns a function that maps a list of input words to one list of
+        output words for each input word. This is used by MutateNode to
+        de-duplicate the output of several attributes.
+        '''
+        return lambda words: [list(self.get_words([word])) for word in words]
+
+    def can_collide(self, other):
+        '''Whether the attribute and other, which may be the attribute
+        itself, can make the same word from an input word, other than the
+        input word itself. MutateNode only de-duplicates the words of
+        attributes that can, see MutateNode.get_colliding_attrs(). Two
+        attributes only collide if both can.
+        '''
+        return True
+    
+    @abstractmethod
+    def count_words(self, prev_word_count):
+        pass
+
+    @abstractmethod
+    def count_bytes(self, prev_byte_count, prev_word_count):
+        pass
+    
+    def check_hashcat_compatible(self):
+        return True
+    
+    def __eq__(self, other):
+        '''This is used to avoid duplicate attributes within a node
         '''
         if self.__class__ != other.__class__:
             return False
@@ -477,13 +1724,15 @@ class StringListAttr(BaseAttr):
     
         self.words_read = None # used for the progress indicator
 
-    def get_words(self, prev_words=[]):
+    def get_batches(self, prev_batches, batch_size=BATCH_SIZE):
+        yield from prev_batches
+        yield from self.get_slice_batches(0, len(self.strings), batch_size)
+
+    def get_slice_batches(self, start, stop, batch_size=BATCH_SIZE):
         self.words_read = 0
-        for word in prev_words:
-            yield word
-        for s in self.strings:
-            self.words_read += 1
-            yield s
+        for batch in iter_batches(self.strings[start:stop], batch_size):
+            self.words_read += len(batch)
+            yield batch
 
     def count_words(self, prev_word_count):
         return prev_word_count + len(self.strings)
@@ -500,6 +1749,16 @@ class ThreadingAttr(BaseAttr):
     def stop_calculating(self):
         self.kill_flag = True
         self.worker_thread.join()
+
+    def __getstate__(self):
+        '''The controller and counting thread are left out when pickling, for
+        sending the chain to worker processes
+        '''
+        state = self.__dict__.copy()
+        state['controller'] = None
+        state.pop('worker_thread', None)
+        state['character_index'] = None
+        return state
     '''
     def __del__(self):
         # note that __del__ is not always called immediately with 'del'
@@ -525,11 +1784,45 @@ class FileAttr(ThreadingAttr):
                   ]
     
     def __init__(self, path, controller=None, label=""):
+        self.init_file(path, controller, label)
+    
+        self.calculating = True
+        if self.controller is not None:
+            self.controller.word_calculator_count += 1
+            self.controller.update_counts() # update word counts to 'Calculating...'
+            self.worker_thread = threading.Thread(target=self.threaded_word_counter)
+            self.kill_flag = False
+        else:
+            # When there is no controller (in model tests), run the word counter
+            # in the main thread
+            self.kill_flag = False
+            self.threaded_word_counter()
+        
+        if self.controller is not None:
+            self.worker_thread.start()
+    
+    @classmethod
+    def uncounted(cls, path):
+        '''Returns a FileAttr for path whose words have not been counted, for
+        attributes that count several files at once with count_file()
+        '''
+        attr = cls.__new__(cls)
+        attr.init_file(path)
+        attr.calculating = True
+        attr.kill_flag = False
+        return attr
+    
+    def init_file(self, path, controller=None, label=""):
         BaseAttr.__init__(self, label)
         self.path = path
         self.controller = controller
         
         self.absolute_path = path.replace('$DATA_DIR', data_dir)
+        # 'gz', 'bz2' or 'xz' if the file is decompressed as it's read
+        self.compression = sink.get_compression(self.absolute_path)
+        # whether the file is a packed wordlist (see packed.py), in which
+        # case offsets are in its data section
+        self.packed = packed.is_packed(self.absolute_path)
         
         self.file_error = None
         
@@ -548,23 +1841,16 @@ class FileAttr(ThreadingAttr):
         # This is used by the progress bar to keep track of how many lines
         # have been read in get_words(). It is reset when the file is done.
         self.words_read = None
+        self.slice_anchor = None
         
-        self.word_count = 1
-    
-        self.calculating = True
-        if self.controller is not None:
-            self.controller.word_calculator_count += 1
-            self.controller.update_counts() # update word counts to 'Calculating...'
-            self.worker_thread = threading.Thread(target=self.threaded_word_counter)
-            self.kill_flag = False
-        else:
-            # When there is no controller (in model tests), run the word counter
-            # in the main thread
-            self.kill_flag = False
-            self.threaded_word_counter()
+        # fraction of the file scanned by the word counter
+        self.count_progress = 0.
         
-        if self.controller is not None:
-            self.worker_thread.start()
+        # the file's lineindex.LineIndex, loaded when first needed
+        self.line_index = None
+        self.line_index_loaded = False
+        
+        self.word_count = 1
             
     def check_file(self):
         '''Check whether the file is present
@@ -574,48 +1860,484 @@ class FileAttr(ThreadingAttr):
         except Exception as e:
             self.file_error = str(e)
 
+    def open_file(self):
+        '''Opens the file for reading its lines as a binary file object,
+        which decompresses compressed files. Offsets in the file are offsets
+        in the decompressed data.
+        '''
+        f = open(self.absolute_path, 'rb')
+        if self.compression is None:
+            return f
+        try:
+            return DECOMPRESSORS[self.compression](f)
+        except BaseException:
+            f.close()
+            raise
+
+    def __getstate__(self):
+        '''The memory mapped line index is loaded again after unpickling
+        '''
+        state = ThreadingAttr.__getstate__(self)
+        state['line_index'] = None
+        state['line_index_loaded'] = False
+        return state
+
+    def get_index_path(self):
+        '''Returns the path of the file's line index for its current
+        version, or None if it can't have one
+        '''
+        if self.packed:
+            return None # the index is in the file
+        file_stat = os.stat(self.absolute_path)
+        if not stat.S_ISREG(file_stat.st_mode):
+            return None
+        return filecache.get_index_path(self.absolute_path, file_stat)
+
+    def get_line_index(self):
+        '''Returns the file's line index if it has been built (see
+        build_line_index()), otherwise None
+        '''
+        if not self.line_index_loaded:
+            if self.packed:
+                # packed wordlists are always read through their index
+                header = packed.read_header(self.absolute_path)
+                self.line_index = lineindex.LineIndex(self.absolute_path, header['index_offset'])
+            else:
+                try:
+                    index_path = self.get_index_path()
+                    if index_path is not None and os.path.exists(index_path):
+                        self.line_index = lineindex.LineIndex(index_path)
+                except (OSError, ValueError):
+                    self.line_index = None
+            self.line_index_loaded = True
+        return self.line_index
+
+    def build_line_index(self):
+        '''Writes the file's line index, which lets any line be found without
+        reading the lines before it, and starts using it. The index is kept
+        with the metadata cache and is used by later runs until the file
+        changes.
+        
+        return value: the index, or None if the metadata cache is turned off
+        '''
+        if self.packed:
+            return self.get_line_index()
+        index_path = self.get_index_path()
+        if index_path is None:
+            return None
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        if self.compression is None:
+            size = os.stat(self.absolute_path).st_size
+        else:
+            size = None # the decompressed size
+        lineindex.write_index(index_path, self.iter_line_blocks(0, None), size)
+        if self.line_index is not None:
+            self.line_index.close()
+        self.line_index = lineindex.LineIndex(index_path)
+        self.line_index_loaded = True
+        return self.line_index
+
+    def get_line(self, index):
+        '''Returns line number index of the file, decoded like get_words()
+        '''
+        start, stop = self.get_word_range(index, index + 1)
+        if start >= stop:
+            raise IndexError('{} has fewer than {} lines'.format(self.path, index + 1))
+        for batch in self.get_slice_batches(start, stop):
+            return batch[0]
+
     def threaded_word_counter(self):
-        '''In order to estimate the number of words, this method is run in a
-        background thread and reads the number of lines in the input file.
+        '''In order to count the words, this method is run in a background
+        thread and counts the lines in the input file.
         '''
         if self.file_error is not None:
-            self.controller.word_calculator_count -= 1
+            if self.controller is not None:
+                self.controller.word_calculator_count -= 1
             return
     
         try:
-            i = 0
             try:
-                with open(self.absolute_path, errors='ignore') as f:
-                    for i, line in enumerate(f):
-                        if self.kill_flag:
-                            break
+                if not self.count_file():
+                    return # stopped by stop_calculating()
             except Exception as e:
                 self.file_error = str(e)
-                self.controller.file_attr_error(self)
+                if self.controller is not None:
+                    self.controller.file_attr_error(self)
                 return
-            i += 1
-            self.word_count = i
-            self.byte_count -= self.word_count - 1 # don't count newlines
-            self.calculating = False
             if self.controller is not None:
                 self.controller.word_calculator_count -= 1
                 self.controller.update_counts()
+                # The character index makes the counts of later nodes exact,
+                # it's built once the word counts are shown
+                if self.build_character_index() is not None:
+                    self.controller.update_counts()
         except Exception as e:
             print("Exception while counting words:", e)
 
-    def get_words(self, prev_words=[]):
-        self.words_read = 0
+    def get_character_index_path(self):
+        '''Returns the path of the file's character index for its current
+        version, or None if it can't be cached
+        '''
+        file_stat = os.stat(self.absolute_path)
+        if not stat.S_ISREG(file_stat.st_mode):
+            return None
+        return filecache.get_index_path(self.absolute_path, file_stat, CHARACTER_INDEX_EXTENSION)
+
+    def build_character_index(self):
+        '''Loads the file's character index (see charcount.py) from the
+        cache, or builds it by reading the file and adds it to the cache.
+        The file is read by another FileAttr, so the words can be used at
+        the same time.
+        
+        return value: the index, or None if stop_calculating() was called
+        '''
+        if self.character_index is not None:
+            return self.character_index
+        index_path = self.get_character_index_path()
+        character_index = None
+        if index_path is not None:
+            character_index = charcount.load_index(index_path, CASE_INDEX_FUNCTIONS)
+        if character_index is None:
+            character_index = charcount.CharacterIndex(CASE_INDEX_FUNCTIONS)
+            reader = FileAttr.uncounted(self.path)
+            batches = reader.get_slice_batches(0, None)
+            try:
+                for batch in batches:
+                    if self.kill_flag:
+                        return None
+                    character_index.add(batch)
+            finally:
+                batches.close()
+            if index_path is not None:
+                charcount.save_index(index_path, character_index)
+        self.character_index = character_index
+        return character_index
+
+    def get_character_index(self):
+        '''With a controller, the index is built in the background after the
+        words are counted, and is None until then. Otherwise it's built when
+        it's first needed.
+        '''
+        if self.character_index is None and self.controller is None and not self.calculating:
+            self.build_character_index()
+        return self.character_index
+
+    def scan_characters(self, originals):
+        '''Files are only read for characters that aren't indexed without a
+        controller, to avoid holding up the GUI
+        '''
+        if self.controller is not None:
+            return None
+        return ThreadingAttr.scan_characters(self, originals)
+
+    def count_file(self):
+        '''Sets the word and byte counts from the metadata cache, or by
+        scanning the file and adding it to the cache
+        
+        return value: False if stop_calculating() was called
+        '''
+        file_stat = os.stat(self.absolute_path)
+        # only regular files can be identified in the cache
+        cacheable = stat.S_ISREG(file_stat.st_mode)
+        if self.packed:
+            metadata = packed.read_header(self.absolute_path)
+            cacheable = False
+        elif cacheable:
+            metadata = filecache.get_metadata(self.absolute_path, file_stat)
+        else:
+            metadata = None
+        if metadata is None:
+            metadata = self.scan_file()
+            if metadata is None:
+                return False
+            if cacheable:
+                filecache.save_metadata(self.absolute_path, file_stat, metadata)
+        self.count_progress = 1.
+        self.word_count = metadata['word_count']
+        self.byte_count = metadata['byte_count']
+        self.calculating = False
+        return True
+
+    def scan_file(self):
+        '''Counts the lines in the file and the bytes in them, not counting
+        line endings, by scanning large binary blocks for line endings. The
+        lines are the same as those read by get_words(). count_progress is
+        updated as the file is scanned, and the controller is asked to show
+        it about twice a second.
+        
+        return value: a dict with the 'word_count' and 'byte_count' of the
+        file, or None if stop_calculating() was called
+        '''
+        with open(self.absolute_path, 'rb') as raw_file:
+            size = os.fstat(raw_file.fileno()).st_size
+            f = raw_file
+            if self.compression is not None:
+                f = DECOMPRESSORS[self.compression](raw_file)
+            # the file is read, and decompressed, in a background thread
+            blocks = iter_read_ahead(f, COUNT_BLOCK_SIZE)
+            scanned = 0
+            newline_count = 0 # number of line endings
+            newline_bytes = 0
+            last_byte = None
+            last_update_time = time.monotonic()
+            try:
+                for block in blocks:
+                    if self.kill_flag:
+                        return None
+                    lf_count = block.count(b'\n')
+                    newline_count += lf_count
+                    newline_bytes += lf_count
+                    if b'\r' in block:
+                        # '\r\n' is one line ending and a lone '\r' is another
+                        cr_count = block.count(b'\r')
+                        newline_count += cr_count - block.count(b'\r\n')
+                        newline_bytes += cr_count
+                    if last_byte == 13 and block[0] == 10:
+                        newline_count -= 1 # a '\r\n' split between blocks
+                    last_byte = block[-1]
+                    
+                    scanned += len(block)
+                    if self.compression is None:
+                        self.count_progress = scanned / max(size, scanned)
+                    else:
+                        # measured in compressed bytes
+                        self.count_progress = min(1., raw_file.tell() / max(size, 1))
+                    now = time.monotonic()
+                    if self.controller is not None and now - last_update_time >= 0.5:
+                        last_update_time = now
+                        self.controller.update_counts()
+            finally:
+                blocks.close()
+        
+        self.count_progress = 1.
+        word_count = newline_count
+        if last_byte is not None and last_byte not in (10, 13):
+            word_count += 1 # the last line has no line ending
+        return {'word_count': word_count, 'byte_count': scanned - newline_bytes}
+
+    def get_batches(self, prev_batches, batch_size=BATCH_SIZE):
+        yield from prev_batches
+        yield from self.get_slice_batches(0, None, batch_size)
+
+    def get_shards(self, count):
+        '''Splits the file into about count byte ranges of whole lines. With
+        a line index, the ranges have the same number of lines.
+        '''
+        line_index = self.get_line_index()
+        if line_index is not None:
+            bounds = sorted(set(line_index.get_offset(line_index.line_count * k // count)
+                                for k in range(count + 1)))
+            if len(bounds) == 1:
+                return [(0, 0)]
+            return list(zip(bounds[:-1], bounds[1:]))
+        
+        if self.compression is not None:
+            # reaching an offset means decompressing everything before it
+            return [(0, None)]
+        
+        size = os.stat(self.absolute_path).st_size
+        bounds = [0]
+        with open(self.absolute_path, 'rb') as f:
+            for k in range(1, count):
+                pos = size * k // count
+                if pos <= bounds[-1]:
+                    continue
+                # move to the start of the next line
+                f.seek(pos - 1)
+                f.readline()
+                pos = f.tell()
+                if bounds[-1] < pos < size:
+                    bounds.append(pos)
+        bounds.append(size)
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def get_word_range(self, start, stop):
+        start_offset = self.get_line_offset(start)
+        if stop is None:
+            return start_offset, None
+        return start_offset, self.get_line_offset(stop - start, start_offset)
+
+    def get_word_position(self, word, anchor_word, anchor):
+        return self.get_line_offset(word - anchor_word, anchor)
+
+    def get_slice_anchor(self):
+        return self.slice_anchor
+
+    def get_line_offset(self, index, start_offset=0):
+        '''Returns the byte offset of the line index lines after the line at
+        start_offset, or the file size if the file ends first. The offset is
+        looked up in the line index if there is one, otherwise the line
+        endings are scanned without decoding the lines.
+        '''
+        line_index = self.get_line_index()
+        if line_index is not None:
+            start_line = line_index.get_line_number(start_offset)
+            if start_line is not None:
+                return line_index.get_offset(start_line + index)
+        
+        pos = start_offset
+        with self.open_file() as f:
+            f.seek(start_offset)
+            while index > 0:
+                block = f.read(FILE_BLOCK_SIZE)
+                if len(block) == 0:
+                    break
+                if block.endswith(b'\r'):
+                    block += f.read(1) # keep a \r\n pair in one block
+                if b'\r' not in block:
+                    newline_count = block.count(b'\n')
+                    if newline_count < index:
+                        index -= newline_count
+                        pos += len(block)
+                        continue
+                for match in NEWLINE_RE.finditer(block):
+                    index -= 1
+                    if index == 0:
+                        return pos + match.end()
+                pos += len(block)
+        return pos
+
+    def iter_line_blocks(self, start, stop):
+        '''A generator that yields (bytes, end offset) for blocks of whole
+        lines in the file between byte offsets start and stop (None for the
+        end of the file). start must be at the beginning of a line. Regular
+        files are memory mapped and split at the last newline in each
+        FILE_BLOCK_SIZE bytes, so lines are never copied or searched one at
+        a time. Compressed files are decompressed in a background thread and
+        the offsets are in the decompressed data. The offsets in packed
+        wordlists are in their data section.
+        '''
+        if self.compression is not None:
+            with self.open_file() as f:
+                f.seek(start)
+                yield from self.iter_read_line_blocks(f, start, stop)
+            return
+        
+        with open(self.absolute_path, 'rb') as f:
+            file_stat = os.fstat(f.fileno())
+            if self.packed:
+                header = packed.read_header(self.absolute_path)
+                base, size = header['data_offset'], header['data_size']
+            elif not stat.S_ISREG(file_stat.st_mode):
+                yield from self.iter_read_line_blocks(f, start, stop)
+                return
+            else:
+                base, size = 0, file_stat.st_size
+            if stop is None or stop > size:
+                stop = size
+            if start >= stop:
+                return
             
-        for word in prev_words:
-            yield word
-    
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                will_need = hasattr(mm, 'madvise') and hasattr(mmap, 'MADV_WILLNEED')
+                if hasattr(mm, 'madvise'):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                pos = start
+                while pos < stop:
+                    if will_need:
+                        # Ask the kernel to read the next blocks while this
+                        # one is used, so copying them doesn't wait for the
+                        # disk while holding the GIL
+                        ahead = base + pos - (base + pos) % mmap.PAGESIZE
+                        ahead_stop = min(base + pos + (READ_AHEAD_BLOCKS + 1) * FILE_BLOCK_SIZE, base + stop)
+                        mm.madvise(mmap.MADV_WILLNEED, ahead, ahead_stop - ahead)
+                    end = min(pos + FILE_BLOCK_SIZE, stop)
+                    if end < stop:
+                        newline = mm.rfind(b'\n', base + pos, base + end)
+                        if newline == -1:
+                            # a line longer than the block
+                            newline = mm.find(b'\n', base + end, base + stop)
+                        end = stop if newline == -1 else newline + 1 - base
+                    yield mm[base + pos:base + end], end
+                    pos = end
+
+    def iter_read_line_blocks(self, f, start, stop):
+        '''iter_line_blocks() for files that can't be memory mapped, such as
+        named pipes and compressed files. The file object f is read from its
+        current position by a background thread.
+        '''
+        pos = start
+        remaining = None if stop is None else stop - start
+        if remaining is not None and remaining <= 0:
+            return
+        leftover = b''
+        blocks = iter_read_ahead(f, FILE_BLOCK_SIZE)
+        try:
+            for block in blocks:
+                if remaining is not None:
+                    if len(block) >= remaining:
+                        block = block[:remaining]
+                        blocks.close()
+                    remaining -= len(block)
+                pos += len(block)
+                data = leftover + block
+                end = data.rfind(b'\n') + 1
+                leftover = data[end:]
+                if end > 0:
+                    yield data[:end], pos - len(leftover)
+        finally:
+            blocks.close()
+        if leftover != b'':
+            yield leftover, pos
+
+    def get_slice_batches(self, start, stop, batch_size=BATCH_SIZE):
+        '''A generator that yields lists of the lines in the file between byte
+        offsets start and stop (None for the end of the file). start must be
+        at the beginning of a line.
+        '''
+        return self.get_encoded_slice_batches(start, stop, batch_size)
+
+    def iter_word_blocks(self, start, stop, batch_size, encoding):
+        '''The file's blocks are passed on whole, with only line endings
+        changed to '\\n' where needed. The blocks are prepared by a
+        background thread while the previous ones are written.
+        '''
+        def iter_blocks():
+            for block, block_end in self.iter_line_blocks(start, stop):
+                if b'\r' in block:
+                    block = block.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+                if not block.endswith(b'\n'):
+                    block += b'\n'
+                yield block, block.count(b'\n')
+        
+        self.words_read = 0
+        try:
+            for block, word_count in iter_in_background(iter_blocks()):
+                self.words_read += word_count
+                yield block, word_count
+        except Exception as e:
+            self.file_error = str(e)
+            if self.controller:
+                self.controller.file_attr_error(self)
+                raise FileException()
+            else:
+                raise
+
+    def get_encoded_slice_batches(self, start, stop, batch_size=BATCH_SIZE, encoding=None):
+        '''With an encoding, the lines are the file's bytes and are not
+        decoded. Bytes that are invalid in the encoding are kept either way,
+        the decoded lines hold them as surrogates. A background thread reads
+        and splits up to READ_AHEAD_BLOCKS blocks of lines ahead of the
+        words being used.
+        '''
+        decode_encoding = locale.getpreferredencoding(False)
+        def iter_lines():
+            for block, block_end in self.iter_line_blocks(start, stop):
+                if encoding is None:
+                    yield decode_lines(block, decode_encoding), block_end
+                else:
+                    yield split_lines(block), block_end
+        
+        self.words_read = 0
+        # (lines read, byte offset) at the end of the last complete block
+        self.slice_anchor = (0, start)
+        
         try:
-            with open(self.absolute_path, errors='surrogateescape') as f:
-                for line in f:
-                    if line[-1] == '\n':
-                        line = line[:-1]
-                    self.words_read += 1
-                    yield line
+            for lines, block_end in iter_in_background(iter_lines()):
+                for batch in iter_batches(lines, batch_size):
+                    self.words_read += len(batch)
+                    yield batch
+                self.slice_anchor = (self.words_read, block_end)
 
         except Exception as e:
             self.file_error = str(e)
@@ -631,6 +2353,254 @@ class FileAttr(ThreadingAttr):
     def count_bytes(self, prev_byte_count, prev_word_count):
         return prev_byte_count + self.byte_count
 
+class DirectoryAttr(ThreadingAttr):
+    '''Generates one word for each line in every file in a directory, or in
+    every file matching a glob pattern, as if they were a single file. The
+    files are read in the sorted order of their paths.
+    
+    The files are counted together in a thread pool, and while one file's
+    words are generated the next few files are read and decoded in the pool.
+    '''
+    def __init__(self, pattern, controller=None, label=""):
+        '''
+        pattern: a directory, or a glob pattern such as 'leaks/*.txt' or
+                 'leaks/**/*.gz', which may start with $DATA_DIR
+        '''
+        BaseAttr.__init__(self, label)
+        self.pattern = pattern
+        self.controller = controller
+        
+        self.absolute_pattern = pattern.replace('$DATA_DIR', data_dir)
+        self.file_error = None
+        self.files = []
+        try:
+            self.files = [FileAttr.uncounted(path) for path in self.get_paths()]
+        except Exception as e:
+            self.file_error = str(e)
+        
+        self.words_read = None # used for the progress indicator
+        self.count_progress = 0.
+        self.word_count = 0
+        self.byte_count = 0
+        
+        self.calculating = True
+        self.kill_flag = False
+        if self.controller is not None:
+            self.controller.word_calculator_count += 1
+            self.controller.update_counts() # update word counts to 'Calculating...'
+            self.worker_thread = threading.Thread(target=self.threaded_word_counter)
+            self.worker_thread.start()
+        else:
+            self.threaded_word_counter()
+    
+    def get_paths(self):
+        '''Returns the sorted paths of the files matching the pattern
+        '''
+        if os.path.isdir(self.absolute_pattern):
+            paths = [os.path.join(self.absolute_pattern, name)
+                     for name in os.listdir(self.absolute_pattern)]
+        else:
+            paths = glob.glob(self.absolute_pattern, recursive=True)
+        paths = sorted(path for path in paths if os.path.isfile(path))
+        if len(paths) == 0:
+            raise FileNotFoundError('No files match {}'.format(self.pattern))
+        return paths
+    
+    def check_file(self):
+        '''Check whether the files are present
+        '''
+        for attr in self.files:
+            attr.check_file()
+            if attr.file_error is not None:
+                self.file_error = attr.file_error
+    
+    def stop_calculating(self):
+        for attr in self.files:
+            attr.kill_flag = True
+        ThreadingAttr.stop_calculating(self)
+    
+    def threaded_word_counter(self):
+        '''Counts the lines of all of the files in a thread pool, asking the
+        controller to show the progress about twice a second
+        '''
+        if self.file_error is not None:
+            if self.controller is not None:
+                self.controller.word_calculator_count -= 1
+            return
+        
+        try:
+            sizes = [os.stat(attr.absolute_path).st_size for attr in self.files]
+            with concurrent.futures.ThreadPoolExecutor(DIRECTORY_THREADS) as executor:
+                futures = {executor.submit(attr.count_file): attr for attr in self.files}
+                pending = set(futures)
+                while len(pending) > 0:
+                    done, pending = concurrent.futures.wait(pending, timeout=0.5)
+                    scanned = sum(attr.count_progress * size for attr, size in zip(self.files, sizes))
+                    self.count_progress = scanned / max(sum(sizes), 1)
+                    if self.controller is not None:
+                        self.controller.update_counts()
+                for future, attr in futures.items():
+                    try:
+                        if not future.result():
+                            return # stopped by stop_calculating()
+                    except Exception as e:
+                        self.file_error = '{}: {}'.format(attr.path, e)
+                        if self.controller is not None:
+                            self.controller.file_attr_error(self)
+                        return
+        except Exception as e:
+            self.file_error = str(e)
+            if self.controller is not None:
+                self.controller.file_attr_error(self)
+            return
+        
+        self.word_count = sum(attr.word_count for attr in self.files)
+        self.byte_count = sum(attr.byte_count for attr in self.files)
+        self.count_progress = 1.
+        self.calculating = False
+        if self.controller is not None:
+            self.controller.word_calculator_count -= 1
+            self.controller.update_counts()
+            try:
+                if self.build_character_index() is not None:
+                    self.controller.update_counts()
+            except Exception as e:
+                print("Exception while counting words:", e)
+    
+    def build_character_index(self):
+        '''Adds up the character indexes of the files, which are cached for
+        each file (see FileAttr.build_character_index())
+        
+        return value: the index, or None if stop_calculating() was called
+        '''
+        if self.character_index is None:
+            character_index = charcount.CharacterIndex(CASE_INDEX_FUNCTIONS)
+            for attr in self.files:
+                file_index = attr.build_character_index()
+                if file_index is None:
+                    return None
+                character_index.merge(file_index)
+            self.character_index = character_index
+        return self.character_index
+    
+    def get_character_index(self):
+        if self.character_index is None and self.controller is None and not self.calculating:
+            self.build_character_index()
+        return self.character_index
+    
+    def scan_characters(self, originals):
+        if self.controller is not None:
+            return None
+        return ThreadingAttr.scan_characters(self, originals)
+    
+    def get_file_ranges(self, start, stop):
+        '''Converts the range of word indexes start to stop (None for the end)
+        into a list of (FileAttr, start offset, stop offset) for the parts of
+        the files in the range
+        '''
+        ranges = []
+        first = 0 # index of the file's first word
+        for attr in self.files:
+            end = first + attr.word_count
+            range_start = max(start, first)
+            range_stop = end if stop is None else min(stop, end)
+            if range_start < range_stop:
+                start_offset, stop_offset = attr.get_word_range(range_start - first, None)
+                if range_stop < end:
+                    stop_offset = attr.get_line_offset(range_stop - range_start, start_offset)
+                ranges.append((attr, start_offset, stop_offset))
+            first = end
+        return ranges
+    
+    def iter_file_items(self, start, stop, read):
+        '''A generator that yields the items of read(attr, start offset, stop
+        offset) for each part of a file in the range start to stop. Up to
+        PREFETCH_FILES parts are read ahead in a thread pool while their
+        words take less than PREFETCH_MEMORY in total, see get_memory_size().
+        '''
+        try:
+            ranges = collections.deque(self.get_file_ranges(start, stop))
+            with concurrent.futures.ThreadPoolExecutor(DIRECTORY_THREADS) as executor:
+                # (file range, future or None if it is read when used, memory size)
+                pending = collections.deque()
+                def prefetch():
+                    prefetched = sum(size for file_range, future, size in pending)
+                    while len(ranges) > 0 and len(pending) < PREFETCH_FILES:
+                        file_range = ranges[0]
+                        size = self.get_memory_size(*file_range)
+                        if size > PREFETCH_MEMORY:
+                            future = None
+                            size = 0
+                        elif prefetched + size <= PREFETCH_MEMORY:
+                            future = executor.submit(lambda file_range=file_range: list(read(*file_range)))
+                        else:
+                            return # wait for earlier parts to be used
+                        ranges.popleft()
+                        pending.append((file_range, future, size))
+                        prefetched += size
+                
+                try:
+                    prefetch()
+                    while len(pending) > 0:
+                        file_range, future, size = pending.popleft()
+                        if future is None:
+                            prefetch()
+                            yield from read(*file_range)
+                        else:
+                            items = future.result()
+                            prefetch()
+                            yield from items
+                finally:
+                    for file_range, future, size in pending:
+                        if future is not None:
+                            future.cancel()
+        
+        except Exception as e:
+            self.file_error = str(e)
+            if self.controller:
+                self.controller.file_attr_error(self)
+                raise FileException()
+            else:
+                raise
+    
+    def get_memory_size(self, attr, start_offset, stop_offset):
+        '''Estimates the memory taken by the decoded words of the part of
+        attr's file from start_offset to stop_offset (None for the end)
+        '''
+        if attr.compression is None and attr.byte_count > 0:
+            stop = attr.byte_count + attr.word_count if stop_offset is None else stop_offset
+            fraction = max(0, stop - start_offset) / (attr.byte_count + attr.word_count)
+        else:
+            fraction = 1.
+        return int(fraction * (attr.byte_count + WORD_OVERHEAD * attr.word_count))
+    
+    def get_batches(self, prev_batches, batch_size=BATCH_SIZE):
+        yield from prev_batches
+        yield from self.get_slice_batches(0, None, batch_size)
+    
+    def get_slice_batches(self, start, stop, batch_size=BATCH_SIZE):
+        return self.get_encoded_slice_batches(start, stop, batch_size)
+    
+    def get_encoded_slice_batches(self, start, stop, batch_size=BATCH_SIZE, encoding=None):
+        self.words_read = 0
+        read = lambda attr, start, stop: attr.get_encoded_slice_batches(start, stop, batch_size, encoding)
+        for batch in self.iter_file_items(start, stop, read):
+            self.words_read += len(batch)
+            yield batch
+    
+    def iter_word_blocks(self, start, stop, batch_size, encoding):
+        self.words_read = 0
+        read = lambda attr, start, stop: attr.iter_word_blocks(start, stop, batch_size, encoding)
+        for block, word_count in self.iter_file_items(start, stop, read):
+            self.words_read += word_count
+            yield block, word_count
+    
+    def count_words(self, prev_word_count):
+        return prev_word_count + self.word_count
+        
+    def count_bytes(self, prev_byte_count, prev_word_count):
+        return prev_byte_count + self.byte_count
+
 class RangeAttr(BaseAttr):
     '''Generates each number in an integer range
     '''
@@ -648,12 +2618,18 @@ class RangeAttr(BaseAttr):
         for i in range(self.start, self.end):
             self.byte_count += len(str(i).zfill(zfill))
     
-    def get_words(self, prev_words):
-        for word in prev_words:
-            yield word
-
-        for i in range(self.start, self.end):
-            yield str(i).zfill(self.zfill)
+    def get_batches(self, prev_batches, batch_size=BATCH_SIZE):
+        yield from prev_batches
+        yield from self.get_slice_batches(0, self.end - self.start, batch_size)
+
+    def get_slice_batches(self, start, stop, batch_size=BATCH_SIZE):
+        end = self.end if stop is None else min(self.start + stop, self.end)
+        for first in range(self.start + start, end, batch_size):
+            numbers = range(first, min(first + batch_size, end))
+            if self.zfill:
+                yield [str(i).zfill(self.zfill) for i in numbers]
+            else:
+                yield list(map(str, numbers))
 
     def count_words(self, prev_word_count):
         return prev_word_count + (self.end - self.start)
@@ -753,12 +2729,12 @@ class DateRangeAttr(ThreadingAttr):
             if not self.kill_flag:
                 self.controller.update_counts()
         
-    def get_words(self, prev_words):
-        for word in prev_words:
-            yield word
+    def get_batches(self, prev_batches, batch_size=BATCH_SIZE):
+        yield from prev_batches
+        yield from iter_batches(self.dates, batch_size)
 
-        for date in self.dates:
-            yield date
+    def get_slice_batches(self, start, stop, batch_size=BATCH_SIZE):
+        return iter_batches(self.dates[start:stop], batch_size)
 
     def count_words(self, prev_word_count):
         return prev_word_count + len(self.dates)
@@ -817,12 +2793,12 @@ class LocationCodeAttr(BaseAttr):
         self.codes = codes_dict[self.location]
         self.byte_count = sum(map(len, self.codes))
 
-    def get_words(self, prev_words):
-        for word in prev_words:
-            yield word
+    def get_batches(self, prev_batches, batch_size=BATCH_SIZE):
+        yield from prev_batches
+        yield from iter_batches(self.codes, batch_size)
 
-        for code in self.codes:
-            yield code
+    def get_slice_batches(self, start, stop, batch_size=BATCH_SIZE):
+        return iter_batches(self.codes[start:stop], batch_size)
 
     def count_words(self, prev_word_count):
         return prev_word_count + len(self.codes)
@@ -836,6 +2812,18 @@ class NothingMutatorAttr(BaseAttr):
     def get_words(self, prev_words):
         return prev_words
 
+    def get_batches(self, prev_batches, batch_size=BATCH_SIZE):
+        return prev_batches
+
+    def compile(self):
+        return lambda words: words
+
+    def compile_word_lists(self):
+        return lambda words: [[word] for word in words]
+
+    def can_collide(self, other):
+        return False # only the input word
+
     def count_words(self, prev_word_count):
         return prev_word_count
         
@@ -851,6 +2839,9 @@ class NothingAdderAttr(BaseAttr):
     def get_words(self, prev_words):
         return [""]
 
+    def get_batches(self, prev_batches, batch_size=BATCH_SIZE):
+        return [[""]]
+
     def count_words(self, prev_word_count):
         return prev_word_count + 1
         
@@ -860,61 +2851,131 @@ class NothingAdderAttr(BaseAttr):
 class CaseAttr(BaseAttr):
     '''Modifies the case of letters in the word
     '''
-    def __init__(self, type_, case=None, idx=None, label=""):
+    def __init__(self, type_, case=None, idx=None, max_variants=None, label=""):
         '''
-        type_: 'First' (just the first letter), 'All' (all letters), or 'Toggle'
-               (switch upper case to lower case, and vice versa)
+        type_: 'First' (just the first letter), 'All' (all letters), 'Toggle'
+               (switch upper case to lower case, and vice versa), or
+               'Combinations' (toggle every combination of the letters in
+               the first idx characters, starting with the input word and
+               then the fewest toggles)
         case: 'Uppercase', 'Lowercase' (change letters to this case), or None
-              (for Toggle)
-        idx: Modify the character at this index
+              (for Toggle and Combinations)
+        idx: Modify the character at this index, or the first idx characters
+             for Combinations
+        max_variants: the most words made from each input word for
+                      Combinations, or None for every combination
         '''
         BaseAttr.__init__(self, label=label)
         self.type_ = type_
         self.case = case
         self.idx = idx
+        self.max_variants = max_variants
 
-    def get_words(self, prev_words):
-        for word in prev_words:
-            if word == "":
-                yield word
-                continue
+    def get_batches(self, prev_batches, batch_size=BATCH_SIZE):
+        change_case = self.compile()
+        for batch in prev_batches:
+            yield change_case(batch)
+
+    def compile(self):
+        if self.type_ == 'First':
+            if self.case == 'Lowercase':
+                change_word = lower_first
+            else:
+                change_word = upper_first
         
-            if self.type_ == 'First':
-                string_list = list(word)
-                if self.case == 'Lowercase':
-                    string_list[0] = string_list[0].lower()
-                    for i in range(1, len(string_list)):
-                        string_list[i] = string_list[i].upper()
-                else:
-                    string_list[0] = string_list[0].upper()
-                    for i in range(1, len(string_list)):
-                        string_list[i] = string_list[i].lower()
-                yield ''.join(string_list)
-            
-            elif self.type_ == 'All':
-                if self.case == 'Lowercase':
-                    yield word.lower()
-                else:
-                    yield word.upper()
-            
-            elif self.type_ == 'Toggle':
-                if len(word) > self.idx:
-                    string_list = list(word)
-                    if string_list[self.idx].isupper():
-                        string_list[self.idx] = string_list[self.idx].lower()
-                    else:
-                        string_list[self.idx] = string_list[self.idx].upper()
-                    yield ''.join(string_list)
-                else:
-                    yield word
+        elif self.type_ == 'All':
+            if self.case == 'Lowercase':
+                change_word = str.lower
+            else:
+                change_word = str.upper
+        
+        elif self.type_ == 'Toggle':
+            change_word = functools.partial(toggle_case, idx=self.idx)
+        
+        elif self.type_ == 'Combinations':
+            toggle_word = self.compile_word_combinations()
+            return lambda words: list(itertools.chain.from_iterable(map(toggle_word, words)))
+        
+        return lambda words: list(map(change_word, words))
+
+    def compile_word_combinations(self):
+        '''Returns the function that gives the list of output words for a
+        single input word for the 'Combinations' type. Characters whose case
+        can't be switched are left out, so each word is made once.
+        '''
+        length = self.idx
+        max_variants = self.max_variants
+        
+        def toggle_word(word):
+            toggles = charcount.get_toggles(word, length)
+            if max_variants is not None and max_variants <= 1 or len(toggles) == 0:
+                return [word]
+            new_words = [word]
+            chars = list(word)
+            for size in range(1, len(toggles) + 1):
+                for combination in itertools.combinations(toggles, size):
+                    for i, new in combination:
+                        chars[i] = new
+                    new_words.append(''.join(chars))
+                    for i, new in combination:
+                        chars[i] = word[i]
+                    if len(new_words) == max_variants:
+                        return new_words
+            return new_words
+        return toggle_word
+
+    def get_index_key(self):
+        '''Returns the attribute's key in CASE_INDEX_KEYS
+        '''
+        if self.type_ in ['Toggle', 'Combinations']:
+            return (self.type_, self.idx)
+        return (self.type_, self.case)
+
+    def compile_word_lists(self):
+        if self.type_ == 'Combinations':
+            toggle_word = self.compile_word_combinations()
+            return lambda words: list(map(toggle_word, words))
+        change_case = self.compile()
+        return lambda words: [[word] for word in change_case(words)]
+
+    def can_collide(self, other):
+        # Different case changes can make the same word, but each makes
+        # different words
+        return other is not self
+
+    def get_max_variants(self):
+        '''Returns the most words made from one input word
+        '''
+        if self.type_ != 'Combinations':
+            return 1
+        if self.max_variants is None:
+            return 2 ** self.idx
+        return min(self.max_variants, 2 ** self.idx)
 
     def count_words(self, prev_word_count):
-        return prev_word_count
+        # Combinations are estimated as if the first idx characters are
+        # letters
+        return prev_word_count * self.get_max_variants()
 
     def count_bytes(self, prev_byte_count, prev_word_count):
-        return prev_byte_count
+        return prev_byte_count * self.get_max_variants()
+
+    def check_hashcat_compatible(self):
+        if self.type_ == 'Combinations':
+            # hashcat makes every combination, and can't skip the positions
+            # that aren't letters
+            return (self.max_variants is None or self.max_variants >= 2 ** self.idx) \
+                and self.idx <= len(HASHCAT_POSITIONS)
+        return True
     
     def get_rules(self):
+        if self.type_ == 'Combinations':
+            rules = []
+            for size in range(self.idx + 1):
+                for combination in itertools.combinations(HASHCAT_POSITIONS[:self.idx], size):
+                    rules.append(''.join('T' + position for position in combination) or ':')
+            return rules
+        
         if self.type_ in ['First', 'All']:
             rule = {'First': {'Uppercase': 'c',
                               'Lowercase': 'C'},
@@ -926,6 +2987,46 @@ class CaseAttr(BaseAttr):
 
         return [rule]
 
+def toggle_case(word, idx):
+    '''Switches the case of the character of word at idx, if there is one
+    '''
+    if len(word) > idx:
+        c = word[idx]
+        if c.isupper():
+            c = c.lower()
+        else:
+            c = c.upper()
+        return word[:idx] + c + word[idx + 1:]
+    return word
+
+def upper_first(word):
+    '''Uppercase the first letter of word and lowercase the rest
+    '''
+    if word.isascii():
+        return word[:1].upper() + word[1:].lower()
+    # str.lower() treats a final capital sigma differently than lowercasing
+    # each character on its own, so do it one character at a time
+    return ''.join([word[0].upper()] + [c.lower() for c in word[1:]])
+
+def lower_first(word):
+    '''Lowercase the first letter of word and uppercase the rest
+    '''
+    if word.isascii():
+        return word[:1].lower() + word[1:].upper()
+    return ''.join([word[0].lower()] + [c.upper() for c in word[1:]])
+
+# The case changes counted by character indexes (see charcount.py), as the
+# CaseAttr.get_index_key() of the attributes that make them, and 'Nothing'
+# for NothingMutatorAttr
+CASE_INDEX_KEYS = ([('Nothing', None)]
+                   + [(type_, case) for type_ in ['All', 'First'] for case in ['Uppercase', 'Lowercase']]
+                   + [('Toggle', idx) for idx in range(8)])
+CASE_INDEX_FUNCTIONS = [str.__str__, str.upper, str.lower, upper_first, lower_first]
+CASE_INDEX_FUNCTIONS += [functools.partial(toggle_case, idx=idx) for idx in range(8)]
+
+# The extension of character index files in the cache's index directory
+CHARACTER_INDEX_EXTENSION = '.chars.gz'
+
 # This file contains the percent of English dictionary words containing at least
 # one instance of each letter.
 character_freq = {}
@@ -934,13 +3035,34 @@ with open(os.path.join(data_dir, 'Letter_Stats.txt')) as f:
         letter, percent = line.split(',')
         character_freq[letter] = float(percent[:-1]) / 100.
 
+class CharacterTable(dict):
+    '''A str.translate() table for a sequence of (original, replacement)
+    substitutions applied in turn, as SubstitutionAttr applies them to each
+    character. A character's replacement is worked out when it is first
+    translated.
+    '''
+    def __init__(self, replacements):
+        dict.__init__(self)
+        self.replacements = replacements
+
+    def __missing__(self, code):
+        new = chr(code)
+        for original, replacement in self.replacements:
+            if new.lower() == original:
+                new = replacement
+        self[code] = new
+        return new
+
 class SubstitutionAttr(BaseAttr):
     '''Substitutes one character for another
     '''
-    def __init__(self, type_, checked_vals, all_together, label=""):
+    def __init__(self, type_, checked_vals, all_together, max_combination_size=None, label=""):
         '''
         type_: 'First' (substitute the first instance), 'All' (substitute all
-               instances), or 'Nth' (substitute the Nth instance)
+               instances), 'Nth' (substitute the Nth instance), or
+               'Combinations' (every combination of substituted and
+               unsubstituted instances, starting with the input word and
+               then the fewest substitutions)
                
         checked_vals: a list of substitution strings of the form 'old -> new'
         
@@ -949,11 +3071,20 @@ class SubstitutionAttr(BaseAttr):
                       input word, with the substitutions applied one at a time.
                       If False, just one output word will be generated for each
                       input word, with all substitutions applied together.
+        
+        max_combination_size: for 'Combinations', the size of the largest
+                              combinations, i.e. the most instances
+                              substituted together in one word, or None for
+                              no limit. It limits the size of the
+                              combinations, not the number of words made
+                              from each word, which grows with the number of
+                              instances.
         '''
         BaseAttr.__init__(self, label=label)
         self.type_ = type_
         self.checked_vals = checked_vals
         self.all_together = all_together
+        self.max_combination_size = max_combination_size
         
         self.replacements = []
         for check in checked_vals:
@@ -970,20 +3101,299 @@ class SubstitutionAttr(BaseAttr):
             else:
                 self.character_freqs.append(freq)
 
-    def get_words(self, prev_words):
-        for word in prev_words:
+    def get_batches(self, prev_batches, batch_size=BATCH_SIZE):
+        substitute = self.compile()
+        for batch in prev_batches:
+            yield substitute(batch)
+
+    def compile(self):
+        substitute_word = self.compile_word()
+        def substitute(words):
+            new_words = []
+            for word in words:
+                new_words.extend(substitute_word(word))
+            return new_words
+        return substitute
+
+    def compile_word_lists(self):
+        substitute_word = self.compile_word()
+        return lambda words: list(map(substitute_word, words))
+
+    def can_collide(self, other):
+        '''Single character substitutions only change the characters they
+        match, and only to their replacements. So a word changed by one
+        attribute differs from the other's word at a changed character,
+        unless the two share both a character they match and a replacement.
+        Within one attribute, only a repeated substitution makes the same
+        word twice.
+        '''
+        if isinstance(other, NothingMutatorAttr):
+            return False
+        if not isinstance(other, SubstitutionAttr):
+            return True
+        if any(len(original) != 1 or len(replacement) != 1
+               for original, replacement in self.replacements + other.replacements):
+            return True
+        if len(self.replacements) == 0 or len(other.replacements) == 0:
+            return False
+        if other is self:
+            return len(set(map(tuple, self.replacements))) < len(self.replacements)
+        originals, replacements = map(set, zip(*self.replacements))
+        other_originals, other_replacements = map(set, zip(*other.replacements))
+        return not (originals.isdisjoint(other_originals) or replacements.isdisjoint(other_replacements))
+
+    def compile_word(self):
+        '''Returns a function that gives the list of output words for a
+        single input word. The substitutions are turned into translation
+        tables and character searches once, and words without any of the
+        characters being replaced are passed on after one search. Words that
+        the fast paths can't handle exactly use compile_word_generic().
+        '''
+        replacements = [tuple(r) for r in self.replacements]
+        all_together = self.all_together
+        
+        if self.type_ == 'Combinations':
+            return self.compile_word_combinations()
+        
+        if self.type_ in ['All', 'Nth']:
+            if all_together:
+                # Each character is replaced independently of the others,
+                # by each substitution in turn, so that's one translation
+                table = CharacterTable(replacements)
+                return lambda word: [word.translate(table)]
+            
+            # One word for each substitution that matches. A substitution
+            # that can replace a character with itself still counts as a
+            # match. In ASCII words, only ASCII characters can match, so
+            # substitutions whose character isn't in the lowercased word are
+            # skipped.
+            tables = [(original, CharacterTable([(original, replacement)]),
+                       replacement if len(replacement) == 1 and replacement.lower() == original else None)
+                      for original, replacement in replacements]
+            originals = {original for original, replacement in replacements}
+            nth = self.type_ == 'Nth'
+            def substitute_word(word):
+                lower_word = word.lower() if word.isascii() else None
+                if lower_word is not None and originals.isdisjoint(lower_word):
+                    return [word]
+                new_words = []
+                for original, table, same in tables:
+                    if lower_word is not None and original not in lower_word:
+                        continue
+                    new_word = word.translate(table)
+                    if new_word != word or (same is not None and same in word):
+                        if nth:
+                            return [] # 'Nth' without all_together has no output
+                        new_words.append(new_word)
+                return new_words or [word]
+            return substitute_word
+        
+        substitute_word_generic = self.compile_word_generic()
+        if not all(len(original) == 1 and len(replacement) == 1 and len(replacement.lower()) == 1
+                   for original, replacement in replacements):
+            return substitute_word_generic
+        
+        # In ASCII words, and with replacements that stay one character when
+        # lowercased, the characters a substitution matches are found by
+        # searching the lowercased word for the original character
+        originals = {original for original, replacement in replacements}
+        lower_replacements = [(original, replacement, replacement.lower())
+                              for original, replacement in replacements]
+        backwards = self.type_ == 'Last'
+        
+        def substitute_word(word):
+            if not word.isascii():
+                return substitute_word_generic(word)
+            lower_word = word.lower()
+            if originals.isdisjoint(lower_word):
+                return [word]
+            if all_together:
+                for original, replacement, lower_replacement in lower_replacements:
+                    i = lower_word.rfind(original) if backwards else lower_word.find(original)
+                    if i >= 0:
+                        word = word[:i] + replacement + word[i + 1:]
+                        lower_word = lower_word[:i] + lower_replacement + lower_word[i + 1:]
+                return [word]
+            new_words = []
+            for original, replacement, lower_replacement in lower_replacements:
+                i = lower_word.rfind(original) if backwards else lower_word.find(original)
+                if i >= 0:
+                    new_words.append(word[:i] + replacement + word[i + 1:])
+            return new_words or [word]
+        return substitute_word
+
+    def compile_word_combinations(self):
+        '''Returns the function that gives the list of output words for a
+        single input word for the 'Combinations' type. The instances each
+        substitution changes are listed, and each combination of up to
+        max_combination_size of them is substituted in turn.
+        '''
+        replacements = [tuple(r) for r in self.replacements]
+        max_combination_size = self.max_combination_size
+        if self.all_together:
+            # Every character is replaced as with 'All' together, so the
+            # instances are the characters that translation changes
+            tables = [CharacterTable(replacements)]
+        else:
+            tables = [CharacterTable([replacement]) for replacement in replacements]
+        originals = {original for original, replacement in replacements}
+        
+        def substitute_word(word):
+            if word.isascii() and originals.isdisjoint(word.lower()):
+                return [word]
+            new_words = [word]
+            chars = list(word)
+            for table in tables:
+                changes = [(i, new) for i, new in enumerate(map(table.__getitem__, map(ord, word)))
+                           if new != chars[i]]
+                if max_combination_size is None:
+                    stop = len(changes)
+                else:
+                    stop = min(len(changes), max_combination_size)
+                for size in range(1, stop + 1):
+                    for combination in itertools.combinations(changes, size):
+                        for i, new in combination:
+                            chars[i] = new
+                        new_words.append(''.join(chars))
+                        for i, new in combination:
+                            chars[i] = word[i]
+            return new_words
+        return substitute_word
+
+    def compile_count_profile(self):
+        '''Returns a function that gives (number of output words, bytes
+        added to the input word's length over all of them, whether the input
+        word is one of them) for an input word whose characters that the
+        substitutions match are those in the given profile, see charcount.py
+        '''
+        replacements = [tuple(r) for r in self.replacements]
+        max_combination_size = self.max_combination_size
+        get_byte_count = charcount.get_byte_count
+        count_combinations = charcount.count_combinations
+        
+        # the substitutions that match each lowercase character, and each
+        # character once it has been seen, as (index, replacement)
+        substitutions = collections.defaultdict(list)
+        for i, (original, replacement) in enumerate(replacements):
+            substitutions[original].append((i, replacement))
+        char_substitutions = {}
+        
+        def get_matches(profile):
+            # (replacement, [(character, number of instances)]) for each
+            # substitution that matches, in order
+            matches = {}
+            for c in sorted(set(profile)):
+                c_substitutions = char_substitutions.get(c)
+                if c_substitutions is None:
+                    c_substitutions = char_substitutions[c] = substitutions.get(c.lower(), [])
+                if len(c_substitutions) > 0:
+                    instances = (c, profile.count(c))
+                    for i, replacement in c_substitutions:
+                        if i in matches:
+                            matches[i][1].append(instances)
+                        else:
+                            matches[i] = (replacement, [instances])
+            return [matches[i] for i in sorted(matches)]
+        
+        def count_changes(profile, table):
+            # the number of characters the table changes, and the bytes added
+            change_count = byte_count = 0
+            for c, group in itertools.groupby(profile):
+                new = table[ord(c)]
+                if new != c:
+                    n = len(list(group))
+                    change_count += n
+                    byte_count += n * (get_byte_count(new) - get_byte_count(c))
+            return change_count, byte_count
+        
+        if self.type_ == 'Combinations':
+            if self.all_together:
+                table = CharacterTable(replacements)
+                def count_profile(profile):
+                    change_count, byte_count = count_changes(profile, table)
+                    return count_combinations(change_count, byte_count, max_combination_size) + (True,)
+            else:
+                def count_profile(profile):
+                    word_count = 1
+                    byte_count = 0
+                    for replacement, instances in get_matches(profile):
+                        change_count = added_byte_count = 0
+                        for c, n in instances:
+                            if c != replacement:
+                                change_count += n
+                                added_byte_count += n * (get_byte_count(replacement) - get_byte_count(c))
+                        counts = count_combinations(change_count, added_byte_count, max_combination_size,
+                                                    include_empty=False)
+                        word_count += counts[0]
+                        byte_count += counts[1]
+                    return word_count, byte_count, True
+            return count_profile
+        
+        if self.all_together:
+            if self.type_ in ['All', 'Nth']:
+                table = CharacterTable(replacements)
+                def count_profile(profile):
+                    change_count, byte_count = count_changes(profile, table)
+                    return 1, byte_count, change_count == 0
+                return count_profile
+            
+            def count_profile(profile):
+                # Each substitution replaces one instance, which may be the
+                # replacement of an earlier one
+                new_chars = list(profile)
+                for original, replacement in replacements:
+                    for i, c in enumerate(new_chars):
+                        if c.lower() == original:
+                            new_chars[i] = replacement
+                            break
+                byte_count = sum(map(get_byte_count, new_chars)) - get_byte_count(profile)
+                return 1, byte_count, new_chars == list(profile)
+            return count_profile
+        
+        every_instance = self.type_ == 'All'
+        nth = self.type_ == 'Nth'
+        def count_profile(profile):
+            matches = get_matches(profile)
+            if len(matches) == 0:
+                return 1, 0, True
+            if nth:
+                return 0, 0, False # 'Nth' without all_together has no output
+            byte_count = 0
+            keeps_word = False
+            for replacement, instances in matches:
+                keeps_word = keeps_word or all(c == replacement for c, n in instances)
+                if not every_instance:
+                    # the first or last instance, which is taken to be the
+                    # same size as the others
+                    instances = [(instances[0][0], 1)]
+                for c, n in instances:
+                    byte_count += n * (get_byte_count(replacement) - get_byte_count(c))
+            return len(matches), byte_count, keeps_word
+        return count_profile
+
+    def compile_word_generic(self):
+        '''Returns a function that gives the list of output words for a
+        single input word, one character at a time
+        '''
+        replacements = [tuple(r) for r in self.replacements]
+        all_together = self.all_together
+        backwards = self.type_ not in ["First", "All", "Nth"]
+        first_only = self.type_ in ['First', 'Last']
+        yield_each = self.type_ == 'All' and not all_together
+        
+        def substitute_word(word):
             if word == "":
-                yield word
-                continue
+                return [word]
             
             string_list = list(word)
-            if self.type_ in ["First", "All", "Nth"]:
-                idx_range = range(len(string_list))
-            else:
+            if backwards:
                 idx_range = range(len(string_list) - 1, -1, -1)
+            else:
+                idx_range = range(len(string_list))
             
+            new_words = []
             found_replacement_word = False
-            for original, replacement in self.replacements:
+            for original, replacement in replacements:
                 found_replacement_sub = False
 
                 for i in idx_range:
@@ -992,23 +3402,25 @@ class SubstitutionAttr(BaseAttr):
                         found_replacement_word = True
                         found_replacement_sub = True
                         
-                        if self.type_ in ['First', 'Last']:
-                            if not self.all_together:
-                                yield ''.join(string_list)
+                        if first_only:
+                            if not all_together:
+                                new_words.append(''.join(string_list))
                                 string_list = list(word)
                             break
                     
-                if self.type_ == 'All' and found_replacement_sub and not self.all_together:
-                    yield ''.join(string_list)
+                if yield_each and found_replacement_sub:
+                    new_words.append(''.join(string_list))
                     string_list = list(word)
 
-            if self.all_together:
-                yield ''.join(string_list)
+            if all_together:
+                new_words.append(''.join(string_list))
             elif not found_replacement_word:
-                yield word
+                new_words.append(word)
+            return new_words
+        return substitute_word
 
     def check_hashcat_compatible(self):
-        if self.type_ in ['First', 'Last']:
+        if self.type_ in ['First', 'Last', 'Combinations']:
             return False
         else:
             return True
@@ -0,0 +1,210 @@
+'''Packed wordlists, a binary format made by 'mentalist pack' that FileAttr
+reads without counting or indexing the words first.
+
+A packed wordlist starts with a header of little-endian unsigned integers:
+the magic bytes, flags (FLAG_DEDUPED, FLAG_SORTED), the word count, the byte
+count of the words without line endings, and the offsets and sizes of its
+three sections:
+
+    data       every word followed by '\\n', so blocks of it are copied to
+               the output unchanged
+    histogram  (length, word count) pairs for each word length in bytes
+    index      a line index of the data (see lineindex.py), with offsets
+               relative to the start of the data
+
+Offsets of words in a packed wordlist, as used by FileAttr's slices, are
+offsets in the data section.
+'''
+
+import collections
+import itertools
+import os
+import stat
+import struct
+import tempfile
+
+from . import dedupe
+from . import lineindex
+from . import model
+
+EXTENSION = '.mwl'
+
+MAGIC = b'MNTLPAK1'
+
+# magic, flags, word count, byte count, data offset, data size, histogram
+# offset, histogram entry count, index offset
+HEADER = struct.Struct('<8s8Q')
+HISTOGRAM_ENTRY = struct.Struct('<QQ')
+
+# Whether repeated words were left out, and whether the words are sorted by
+# length (in their original order within each length)
+FLAG_DEDUPED = 1
+FLAG_SORTED = 2
+
+# Bytes of sorted words collected before they are written to their places
+SORT_BUFFER_SIZE = 64 << 20
+
+def is_packed(path):
+    return path.lower().endswith(EXTENSION)
+
+def read_header(path):
+    '''Returns the header of the packed wordlist at path as a dict with the
+    'flags', 'word_count', 'byte_count', 'length_histogram', 'data_offset',
+    'data_size' and 'index_offset'
+    '''
+    with open(path, 'rb') as f:
+        data = f.read(HEADER.size)
+        if len(data) < HEADER.size:
+            raise ValueError('{} is not a packed wordlist'.format(path))
+        (magic, flags, word_count, byte_count, data_offset, data_size,
+         histogram_offset, histogram_count, index_offset) = HEADER.unpack(data)
+        if magic != MAGIC:
+            raise ValueError('{} is not a packed wordlist'.format(path))
+        f.seek(histogram_offset)
+        data = f.read(histogram_count * HISTOGRAM_ENTRY.size)
+        if len(data) < histogram_count * HISTOGRAM_ENTRY.size:
+            raise ValueError('{} is truncated'.format(path))
+    return {'flags': flags, 'word_count': word_count, 'byte_count': byte_count,
+            'length_histogram': dict(HISTOGRAM_ENTRY.iter_unpack(data)),
+            'data_offset': data_offset, 'data_size': data_size, 'index_offset': index_offset}
+
+def iter_data_blocks(f, start, size):
+    '''A generator that yields (bytes, end offset) for blocks of whole lines
+    in the size bytes from offset start of the binary file f, which end with
+    a newline. The offsets are relative to start.
+    '''
+    f.seek(start)
+    pos = 0
+    leftover = b''
+    while pos < size:
+        block = f.read(min(model.FILE_BLOCK_SIZE, size - pos))
+        if len(block) == 0:
+            raise ValueError('Unexpected end of file')
+        pos += len(block)
+        data = leftover + block
+        end = data.rfind(b'\n') + 1
+        leftover = data[end:]
+        if end > 0:
+            yield data[:end], pos - len(leftover)
+
+def write_words(out, batches):
+    '''Writes each word in the lists batches followed by a newline to the
+    binary file out
+
+    return value: the number of words of each length
+    '''
+    histogram = collections.Counter()
+    for batch in batches:
+        if len(batch) > 0:
+            histogram.update(map(len, batch))
+            out.write(b'\n'.join(batch) + b'\n')
+    return histogram
+
+def write_sorted(out, data_file, data_size, histogram):
+    '''Writes the words in the first data_size bytes of the binary file
+    data_file to the binary file out from its current position, sorted by
+    length. Each length's place in the output is known from the histogram,
+    so the words are collected by length and written to their places.
+    '''
+    positions = {}
+    pos = out.tell()
+    for length in sorted(histogram):
+        positions[length] = pos
+        pos += histogram[length] * (length + 1)
+
+    buffers = collections.defaultdict(list)
+    buffered = 0
+    def flush():
+        for length, words in buffers.items():
+            data = b'\n'.join(words) + b'\n'
+            out.seek(positions[length])
+            out.write(data)
+            positions[length] += len(data)
+        buffers.clear()
+
+    for block, block_end in iter_data_blocks(data_file, 0, data_size):
+        words = block.split(b'\n')
+        words.pop() # after the last newline
+        for length, group in itertools.groupby(sorted(words, key=len), len):
+            buffers[length].extend(group)
+        buffered += len(block)
+        if buffered >= SORT_BUFFER_SIZE:
+            flush()
+            buffered = 0
+    flush()
+    out.seek(pos)
+
+def pack(input_path, output_path, dedupe_words=False, sort_by_length=False,
+         memory_limit=dedupe.DEFAULT_MEMORY_LIMIT, error_rate=dedupe.DEFAULT_ERROR_RATE):
+    '''Converts the wordlist at input_path, which may be compressed or
+    packed, into a packed wordlist at output_path. The output file appears in
+    a single step once it is complete. The input is read twice, so it must be
+    a regular file.
+
+    dedupe_words: whether to leave out words seen before
+    sort_by_length: whether to sort the words by length, keeping their order
+                    within each length
+    memory_limit, error_rate: the memory used to remember words with
+                  dedupe_words, and the fraction of new words left out if
+                  they don't fit, see dedupe.WordFilter
+
+    return value: the header of the output, see read_header()
+    '''
+    source = model.FileAttr.uncounted(input_path)
+    if source.file_error is not None:
+        raise OSError(source.file_error)
+    if not stat.S_ISREG(os.stat(source.absolute_path).st_mode):
+        raise ValueError('{} is not a regular file'.format(input_path))
+    source.count_file()
+
+    flags = (FLAG_DEDUPED if dedupe_words else 0) | (FLAG_SORTED if sort_by_length else 0)
+    tmp_path = '{}.{}.tmp'.format(output_path, os.getpid())
+    try:
+        with open(tmp_path, 'w+b') as out:
+            out.write(HEADER.pack(MAGIC, 0, 0, 0, 0, 0, 0, 0, 0))
+            data_offset = out.tell()
+
+            # Write the words in their order, to a temporary file first if
+            # they are sorted afterwards
+            data_file = tempfile.TemporaryFile() if sort_by_length else out
+            try:
+                if dedupe_words:
+                    word_filter = dedupe.WordFilter(source.word_count, memory_limit, error_rate)
+                    batches = map(word_filter.filter,
+                                  source.get_encoded_slice_batches(0, None, encoding='utf-8'))
+                    histogram = write_words(data_file, batches)
+                else:
+                    # The words are unchanged, so the blocks are copied
+                    histogram = collections.Counter()
+                    for block, word_count in source.iter_word_blocks(0, None, model.BATCH_SIZE, 'utf-8'):
+                        data_file.write(block)
+                        histogram.update(map(len, block.split(b'\n')[:-1]))
+
+                data_size = sum((length + 1) * count for length, count in histogram.items())
+                if sort_by_length:
+                    data_file.flush()
+                    write_sorted(out, data_file, data_size, histogram)
+            finally:
+                if data_file is not out:
+                    data_file.close()
+
+            histogram_offset = out.tell()
+            for length in sorted(histogram):
+                out.write(HISTOGRAM_ENTRY.pack(length, histogram[length]))
+
+            index_offset = out.tell()
+            out.flush()
+            with open(tmp_path, 'rb') as data:
+                lineindex.write_offsets(out, iter_data_blocks(data, data_offset, data_size), data_size)
+
+            word_count = sum(histogram.values())
+            byte_count = data_size - word_count
+            out.seek(0)
+            out.write(HEADER.pack(MAGIC, flags, word_count, byte_count, data_offset, data_size,
+                                  histogram_offset, len(histogram), index_offset))
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return read_header(output_path)
@@ -0,0 +1,122 @@
+'''Generates a chain's wordlist in several processes at once.
+
+The base words are split into shards with Chain.get_shards() and a pool of
+worker processes runs the rest of the chain on each shard, writing it to its
+own file. The shard files are then either concatenated in order, so the
+output is identical to a single process run, or kept as separate files.
+'''
+
+import concurrent.futures
+import os
+import shutil
+
+from . import sink
+
+# Each worker gets about this many shards, so that workers that finish early
+# can pick up more work
+SHARDS_PER_JOB = 4
+
+# The chain being processed by this worker process
+_worker_chain = None
+_worker_basewords_only = False
+
+def _init_worker(chain, basewords_only):
+    global _worker_chain, _worker_basewords_only
+    _worker_chain = chain
+    _worker_basewords_only = basewords_only
+
+def _write_shard(shard, path, buffer_size, compression, compress_threads):
+    compiled_chain = _worker_chain.compile_for_output(basewords_only=_worker_basewords_only)
+    return write_shard(compiled_chain, shard, path, buffer_size, compression, compress_threads)
+
+def write_shard(compiled_chain, shard, path, buffer_size=sink.DEFAULT_BUFFER_SIZE,
+                compression=None, compress_threads=1):
+    '''Write the words of one shard of a compiled chain to the file at path,
+    compressed in the format compression if it isn't None, using
+    compress_threads threads
+
+    return value: (word count, byte count)
+    '''
+    with open(path, 'wb', buffering=0) as f:
+        if compression is None:
+            out = f
+        else:
+            out = sink.CompressedWriter(f, compression, threads=compress_threads)
+        with sink.OutputSink(out, buffer_size=buffer_size) as output_sink:
+            output_sink.write_batches(compiled_chain.iter_shard_batches(shard))
+        if compression is not None:
+            out.close()
+    return output_sink.word_count, output_sink.byte_count
+
+def get_shard_paths(path, shard_count, split, compression=None):
+    '''Returns the file paths for each shard's words. Split output is kept in
+    numbered files next to path, otherwise temporary files are used. Files
+    compressed in the format compression end with its extension after the
+    number, so that the files of out.txt.gz are out.txt.0.gz,
+    out.txt.1.gz, ... and are read back with the right decompressor.
+    '''
+    width = len(str(max(shard_count - 1, 0)))
+    extension = ''
+    if compression is not None:
+        extension = '.' + compression
+        if sink.get_compression(path) == compression:
+            path = path[:-len(extension)]
+    suffix = '' if split else '.tmp'
+    return ['{}.{}{}{}'.format(path, str(i).zfill(width), extension, suffix)
+            for i in range(shard_count)]
+
+def write_parallel(chain, path, jobs, basewords_only=False, split=False,
+                   buffer_size=sink.DEFAULT_BUFFER_SIZE, compression=None, compress_threads=1):
+    '''Write the chain's words using jobs worker processes
+
+    path: the output path. With split, the shards are written to the files
+          path.0, path.1, ... instead and path itself is not created, see
+          get_shard_paths().
+    split: whether to keep each shard in its own file rather than
+           concatenating them in order
+    compression: 'gz', 'bz2' or 'xz' to compress each shard in its worker.
+                 Concatenated compressed shards decompress to the whole
+                 wordlist.
+    compress_threads: the number of threads compressing in each worker
+
+    return value: (word count, byte count, list of files written)
+    '''
+    shards = chain.get_shards(jobs * SHARDS_PER_JOB)
+    shard_paths = get_shard_paths(path, len(shards), split, compression)
+    word_count = byte_count = 0
+
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs,
+                                                    initializer=_init_worker,
+                                                    initargs=(chain, basewords_only)) as executor:
+            futures = [executor.submit(_write_shard, shard, shard_path, buffer_size, compression,
+                                       compress_threads)
+                       for shard, shard_path in zip(shards, shard_paths)]
+            try:
+                if split:
+                    for future in futures:
+                        shard_words, shard_bytes = future.result()
+                        word_count += shard_words
+                        byte_count += shard_bytes
+                    return word_count, byte_count, shard_paths
+
+                # Append each shard to the output as soon as it's done, in order
+                with open(path, 'wb') as out:
+                    for future, shard_path in zip(futures, shard_paths):
+                        shard_words, shard_bytes = future.result()
+                        word_count += shard_words
+                        byte_count += shard_bytes
+                        with open(shard_path, 'rb') as f:
+                            shutil.copyfileobj(f, out, buffer_size)
+                        os.remove(shard_path)
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+    finally:
+        if not split:
+            for shard_path in shard_paths:
+                if os.path.exists(shard_path):
+                    os.remove(shard_path)
+
+    return word_count, byte_count, [path]
@@ -0,0 +1,239 @@
+'''Output sinks that write the chain's lists of words to a binary file
+'''
+
+import bz2
+import collections
+import concurrent.futures
+import gzip
+import locale
+import lzma
+import time
+import zlib
+
+# Encoded words are collected until there are this many bytes, then written
+# with a single call
+DEFAULT_BUFFER_SIZE = 1 << 20
+
+# Compression formats by file extension, with their default levels
+COMPRESSION_FORMATS = {'gz': 6, 'bz2': 9, 'xz': 6}
+
+class OutputSink(object):
+    '''Writes lists of words to a binary file object, one word per line.
+
+    Each list of words is joined and encoded with one call, and the encoded
+    lists are buffered until buffer_size bytes are waiting, so the file is
+    written in large blocks. Open files with buffering=0 to avoid copying
+    the data into a second buffer.
+    '''
+    def __init__(self, f, buffer_size=DEFAULT_BUFFER_SIZE, encoding=None,
+                 progress_callback=None, progress_interval=0.1):
+        '''
+        f: a binary file object
+        buffer_size: the number of bytes to collect before writing to f
+        encoding: the output encoding. The default is the locale's encoding,
+                  which is also used to decode FileAttr's files, and bytes that
+                  could not be decoded are written back unchanged.
+        progress_callback: called with this sink after a list of words is
+                           written, at most once every progress_interval
+                           seconds
+        '''
+        self.f = f
+        self.buffer_size = buffer_size
+        if encoding is None:
+            encoding = locale.getpreferredencoding(False)
+        self.encoding = encoding
+        self.progress_callback = progress_callback
+        self.progress_interval = progress_interval
+        self.last_progress_time = time.monotonic()
+
+        self.buffer = []
+        self.buffered_bytes = 0
+
+        # totals of the words passed to write_batch()
+        self.word_count = 0
+        self.byte_count = 0
+
+    def write_batch(self, words):
+        '''Write a list of words, either strings or bytes in the sink's
+        encoding
+        '''
+        if len(words) == 0:
+            return
+        if isinstance(words[0], bytes):
+            # already encoded, see Chain.compile()
+            data = b'\n'.join(words) + b'\n'
+        else:
+            data = ('\n'.join(words) + '\n').encode(self.encoding, 'surrogateescape')
+        self.write_block(data, len(words))
+
+    def write_block(self, data, word_count):
+        '''Write bytes that hold word_count encoded words, each followed by a
+        newline
+        '''
+        self.word_count += word_count
+        self.byte_count += len(data)
+        self.buffer.append(data)
+        self.buffered_bytes += len(data)
+        if self.buffered_bytes >= self.buffer_size:
+            self.flush()
+
+        if self.progress_callback is not None:
+            now = time.monotonic()
+            if now - self.last_progress_time >= self.progress_interval:
+                self.last_progress_time = now
+                self.progress_callback(self)
+
+    def write_batches(self, batches):
+        '''Write each list of words in the iterable batches
+        '''
+        for words in batches:
+            self.write_batch(words)
+
+    def write_blocks(self, blocks):
+        '''Write each (bytes, word count) pair in the iterable blocks
+        '''
+        for data, word_count in blocks:
+            self.write_block(data, word_count)
+
+    def flush(self):
+        '''Write all buffered words to the file
+        '''
+        if len(self.buffer) > 0:
+            if len(self.buffer) == 1:
+                write_all(self.f, self.buffer[0])
+            else:
+                write_all(self.f, b''.join(self.buffer))
+            self.buffer = []
+            self.buffered_bytes = 0
+
+    def close(self):
+        '''Write any remaining words. The file itself is not closed.
+        '''
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+def write_all(f, data):
+    '''Write all of data to f. Unbuffered files may write only part of the
+    data in one call.
+    '''
+    written = f.write(data)
+    if written is not None and written < len(data):
+        view = memoryview(data)[written:]
+        while len(view) > 0:
+            view = view[f.write(view):]
+
+def get_compression(path):
+    '''Returns the compression format for the file extension of path, or None
+    '''
+    extension = path.rpartition('.')[2].lower()
+    if extension in COMPRESSION_FORMATS:
+        return extension
+    return None
+
+class CompressedWriter(object):
+    '''A binary file object that compresses the data written to it in
+    background threads and writes the result to another binary file.
+
+    With one thread the output is a single compressed stream. With several
+    threads each write() is compressed on its own into a complete gzip
+    member, bzip2 stream or xz stream, and the results are written in order.
+    gzip, bzip2 and xz all decompress concatenated streams as one file. The
+    compressors release the GIL, so the threads run in parallel with each
+    other and with word generation.
+
+    At most max_pending writes wait to be compressed, after which write()
+    blocks, so memory use stays bounded when compression is the bottleneck.
+    Writes should be large, such as the blocks written by OutputSink.
+    '''
+    def __init__(self, f, format, level=None, threads=1, max_pending=None):
+        '''
+        f: the binary file object for the compressed data
+        format: 'gz', 'bz2' or 'xz'
+        level: the compression level, or None for the format's default
+        '''
+        if format not in COMPRESSION_FORMATS:
+            raise ValueError('Unknown compression format: {}'.format(format))
+        if level is None:
+            level = COMPRESSION_FORMATS[format]
+        self.f = f
+        self.threads = threads
+        self.max_pending = max_pending or 2 * threads + 2
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+        self.pending = collections.deque()
+
+        if threads == 1:
+            # a single executor thread runs the compressor calls in order
+            if format == 'gz':
+                compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            elif format == 'bz2':
+                compressor = bz2.BZ2Compressor(level)
+            else:
+                compressor = lzma.LZMACompressor(preset=level)
+            self.compress = compressor.compress
+            self.compress_end = compressor.flush
+        else:
+            if format == 'gz':
+                self.compress = lambda data: gzip.compress(data, level)
+            elif format == 'bz2':
+                self.compress = lambda data: bz2.compress(data, level)
+            else:
+                self.compress = lambda data: lzma.compress(data, preset=level)
+            self.compress_end = None
+
+    def write(self, data):
+        self.pending.append(self.executor.submit(self.compress, bytes(data)))
+        while len(self.pending) > self.max_pending:
+            self.write_result(self.pending.popleft())
+        # write any results that are ready without waiting
+        while len(self.pending) > 0 and self.pending[0].done():
+            self.write_result(self.pending.popleft())
+        return len(data)
+
+    def write_result(self, future):
+        data = future.result()
+        if len(data) > 0:
+            write_all(self.f, data)
+
+    def flush(self):
+        '''Wait for all written data to be compressed and written. The
+        compressed stream is only complete after close().
+        '''
+        while len(self.pending) > 0:
+            self.write_result(self.pending.popleft())
+
+    def close(self):
+        '''Finish the compressed stream. The underlying file is not closed.
+        '''
+        if self.executor is None:
+            return
+        if self.compress_end is not None:
+            self.pending.append(self.executor.submit(self.compress_end))
+        self.flush()
+        self.executor.shutdown()
+        self.executor = None
+
+    def abort(self):
+        '''Stop compressing without writing the data still pending
+        '''
+        if self.executor is None:
+            return
+        for future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.executor.shutdown()
+        self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -41,6 +41,15 @@ class BaseWordsNode(BaseNode):
         BaseNode.__init__(self, controller, master=master, main=main, title=title, allow_remove=allow_remove, **kwargs)
         self.file_error_frames = {} # key: attr, value: FileErrorFrame instance
 
+    def add_dedupe_button(self):
+        '''Creates the checkbutton for leaving out repeated words, which only
+        the first node of the chain has
+        '''
+        self.dedupe_var = Tk.BooleanVar(value=False)
+        cb = Tk.Checkbutton(self.upper_frame, text='Remove duplicates', variable=self.dedupe_var,
+                            command=lambda: self.controller.set_dedupe(self.dedupe_var.get()))
+        cb.pack(side="left", padx=10, pady=5)
+
     def add_file_menu(self, menu_button, menu):
         '''Adds items representing the built-in files to the given menu_button
         and menu
@@ -65,6 +74,8 @@ class BaseWordsNode(BaseNode):
         
         mb.menu.add_command(label="Custom File...", command=partial(self.open_file_dlg, partial(self.controller.add_attr, label='File:', right_label_text='Calculating...', node_view=self, attr_class=model.FileAttr, controller=self.controller)))
         
+        mb.menu.add_command(label="Custom Directory...", command=partial(self.open_directory_dlg, partial(self.controller.add_attr, label='Directory:', right_label_text='Calculating...', node_view=self, attr_class=model.DirectoryAttr, controller=self.controller)))
+        
         mb.menu.add_command(label="Custom String...", command=partial(self.open_string_popup, 'String'))
         
         self.add_file_menu(mb, mb.menu)
@@ -153,6 +164,17 @@ class BaseWordsNode(BaseNode):
         else:
             return False
 
+    def open_directory_dlg(self, callback, *args):
+        '''Displays the Custom Directory dialog, for adding every file in a
+        directory. Returns a bool indicating whether a directory was chosen.
+        '''
+        dir_path = tkinter.filedialog.askdirectory(parent=self.main, mustexist=True)
+        if dir_path:
+            callback(label='Directory: %s' % dir_path, pattern=dir_path, controller=self.controller)
+            return True
+        else:
+            return False
+
     def set_file_error(self, attr, message):
         if not attr in self.file_error_frames:
             attr.config(highlightbackground="red", highlightcolor="red", highlightthickness=1)
@@ -5,7 +5,9 @@ from functools import partial
 
 from .base import BaseNode
 from .main import center_window
+from .const import VARIANT_LIMITS, DEFAULT_VARIANT_LIMIT
 from .. import model
+from .. import charcount
 
 class CaseNode(BaseNode):
     '''Change the case of letters in a word
@@ -39,6 +41,7 @@ class CaseNode(BaseNode):
                 label = '{} {}{}'.format(case, type_, suffix)
                 m_cases[i].add_command(label=label, command=partial(self.controller.add_attr, label=label, node_view=self, attr_class=model.CaseAttr, type_=type_, case=case))
         mb.menu.add_command(label='Toggle Nth...', command=partial(self.open_case_popup, 'Toggle'))
+        mb.menu.add_command(label='Toggle Every Combination...', command=self.open_combinations_popup)
 
         mb.pack(side='left', fill='x', padx=10, pady=5)
 
@@ -98,3 +101,72 @@ class CaseNode(BaseNode):
         label = '{}: {}'.format(case, ordinal)
         self.controller.add_attr(label=label, node_view=self, attr_class=model.CaseAttr, type_='Toggle', case=case, idx=val_case-1)
         self.cancel_case_popup()
+
+    def open_combinations_popup(self):
+        '''Open popup for defining the characters to toggle in every
+        combination
+        '''
+        self.case_popup = Tk.Toplevel()
+        self.case_popup.transient(self.main.master)
+        self.case_popup.withdraw()
+        self.case_popup.title('Toggle: Every Combination')
+        self.case_popup.resizable(width=False, height=False)
+        self.case_popup.grab_set()
+        frame = Tk.Frame(self.case_popup)
+        lb = Tk.Label(frame, text='Toggle the Letters in the First N Characters')
+        lb.pack(fill='both', side='top')
+
+        sp_box = Tk.Frame(frame)
+        lb1 = Tk.Label(sp_box, text='Number: ')
+        lb1.pack(side='left', padx=5)
+        self.sp_case = Tk.Spinbox(sp_box, width=12, from_=1, to=charcount.TOGGLE_LENGTH)
+        self.sp_case.delete(0, 'end')
+        self.sp_case.insert(0, '8')
+        self.sp_case.pack(side='left')
+        sp_box.pack(fill='both', side='top', padx=30, pady=20)
+
+        # Every combination of many letters is a lot of words
+        box_max = Tk.Frame(frame)
+        lb_max = Tk.Label(box_max, text='Most words per word:')
+        lb_max.pack(side='left')
+        self.case_max = Tk.StringVar()
+        sb_max = Tk.Spinbox(box_max, values=VARIANT_LIMITS, textvariable=self.case_max,
+                            width=8, state='readonly')
+        sb_max.pack(side='left', padx=10)
+        self.case_max.set(DEFAULT_VARIANT_LIMIT)
+        box_max.pack(fill='both', side='top', padx=30, pady=(0, 20))
+
+        # Ok and Cancel buttons
+        btn_box = Tk.Frame(frame)
+        btn_cancel = Tk.Button(btn_box, text='Cancel', command=self.cancel_case_popup)
+        btn_cancel.pack(side='right', padx=10, pady=20)
+        btn_ok = Tk.Button(btn_box, text='Ok', command=self.on_ok_combinations_popup, default='active')
+        btn_ok.pack(side='left', padx=10, pady=20)
+        btn_box.pack()
+        frame.pack(fill='both', padx=10, pady=10)
+        
+        center_window(self.case_popup, self.main.master)
+        self.case_popup.bind('<Return>', lambda e: self.on_ok_combinations_popup())
+        btn_ok.focus_set()
+
+    def on_ok_combinations_popup(self, *args):
+        '''OK in the every combination popup was selected, create the
+        attribute
+        '''
+        try:
+            length = int(self.sp_case.get())
+        except ValueError:
+            tkinter.messagebox.showerror('Invalid Value', 'Invalid Value: N must be an integer', parent=self.main)
+            return
+
+        if length < 1:
+            tkinter.messagebox.showerror('Invalid Value', 'Invalid Value: N must be greater than 0', parent=self.main)
+            return
+
+        max_variants = None
+        label = 'Toggle Every Combination: First {}'.format(length)
+        if self.case_max.get().isdigit():
+            max_variants = int(self.case_max.get())
+            label += ', up to {}'.format(max_variants)
+        self.controller.add_attr(label=label, node_view=self, attr_class=model.CaseAttr, type_='Combinations', idx=length, max_variants=max_variants)
+        self.cancel_case_popup()
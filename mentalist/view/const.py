@@ -22,3 +22,13 @@ DATE_FORMATS = ['mmddyy', 'ddmmyy', 'mmddyyyy', 'ddmmyyyy', 'mmyyyy', 'mmyy', 'm
 SPECIAL_CHARACTERS = r'''!@#$%^&*()-=_+`~[]{}\|/:;'"'''
 
 SPECIAL_TYPES = ['One at a time', 'All together']
+
+# The choices for the largest combination size, i.e. the most characters
+# substituted together in one word, when substituting every combination
+COMBINATION_LIMITS = ['1', '2', '3', '4', '5', '6', '8', '10', 'No limit']
+DEFAULT_COMBINATION_LIMIT = '3'
+
+# The choices for the most words made from each word when toggling every
+# combination of letters
+VARIANT_LIMITS = ['2', '4', '8', '16', '32', '64', '128', '256', 'No limit']
+DEFAULT_VARIANT_LIMIT = '16'
@@ -200,7 +200,8 @@ class MainWindow(Tk.Frame):
             default_ext = ".rules"
             initial_file = "wordlist.rules"
         else:
-            filetypes=[("Text files", "*.txt")]
+            filetypes=[("Text files", "*.txt"),
+                       ("Compressed text files", "*.txt.gz *.txt.bz2 *.txt.xz")]
             default_ext = ".txt"
             initial_file = "wordlist.txt"
         
@@ -3,7 +3,7 @@ from functools import partial
 
 from .base import BaseNode
 from .main import center_window
-from .const import SUBSTITUTION_CHECKS, SPECIAL_TYPES
+from .const import SUBSTITUTION_CHECKS, SPECIAL_TYPES, COMBINATION_LIMITS, DEFAULT_COMBINATION_LIMIT
 from .. import model
 
 class SubstitutionNode(BaseNode):
@@ -23,12 +23,13 @@ class SubstitutionNode(BaseNode):
         mb.menu.add_command(label='Replace All Instances...', command=partial(self.open_sub_popup, 'All'))
         mb.menu.add_command(label='Replace First Instance...', command=partial(self.open_sub_popup, 'First'))
         mb.menu.add_command(label='Replace Last Instance...', command=partial(self.open_sub_popup, 'Last'))
+        mb.menu.add_command(label='Replace Every Combination...', command=partial(self.open_sub_popup, 'Combinations'))
 
         mb.pack(side='left', fill='x', padx=10, pady=5)
     
     def open_sub_popup(self, type_):
         '''Opens popup for defining the characters to substitute
-        type_: 'All', 'First', or 'Last'
+        type_: 'All', 'First', 'Last', or 'Combinations'
         '''
         self.sub_popup = Tk.Toplevel()
         self.sub_popup.transient(self.main.master)
@@ -63,6 +64,18 @@ class SubstitutionNode(BaseNode):
             tmp.pack(fill='both', side='left')
         box_type.pack(fill='both', side='top', padx=30, pady=20)
 
+        if type_ == 'Combinations':
+            # Every combination of many instances is a lot of words
+            box_max = Tk.Frame(frame)
+            lb_max = Tk.Label(box_max, text='Most characters substituted together:')
+            lb_max.pack(side='left')
+            self.sub_max = Tk.StringVar()
+            sb_max = Tk.Spinbox(box_max, values=COMBINATION_LIMITS, textvariable=self.sub_max,
+                                width=8, state='readonly')
+            sb_max.pack(side='left', padx=10)
+            self.sub_max.set(DEFAULT_COMBINATION_LIMIT)
+            box_max.pack(fill='both', side='top', padx=30, pady=(0, 20))
+
         btn_box = Tk.Frame(frame)
         btn_cancel = Tk.Button(btn_box, text='Cancel', command=self.cancel_sub_popup)
         btn_cancel.pack(side='right', padx=10, pady=20)
@@ -82,12 +95,17 @@ class SubstitutionNode(BaseNode):
 
     def on_ok_sub_popup(self, type_, *args):
         '''OK in substitution popup was selected, create the attribute
-        type_: 'All', 'First', or 'Last'
+        type_: 'All', 'First', 'Last', or 'Combinations'
         '''
         checked_vals = [SUBSTITUTION_CHECKS[i] for i in range(len(SUBSTITUTION_CHECKS)) if self.chk_subs[i].get() == 1]
         if len(checked_vals) > 0:
             special_type = SPECIAL_TYPES[self.sub_type.get()]
             label = 'Replace {}: {} ({})'.format(type_, ', '.join(checked_vals),
                                                  special_type)
-            self.controller.add_attr(label=label, node_view=self, attr_class=model.SubstitutionAttr, type_=type_, checked_vals=checked_vals, all_together=special_type=='All together')
+            max_combination_size = None
+            if type_ == 'Combinations' and self.sub_max.get().isdigit():
+                max_combination_size = int(self.sub_max.get())
+                label = 'Replace {}: {} ({}, up to {} together)'.format(type_, ', '.join(checked_vals),
+                                                                        special_type, max_combination_size)
+            self.controller.add_attr(label=label, node_view=self, attr_class=model.SubstitutionAttr, type_=type_, checked_vals=checked_vals, all_together=special_type=='All together', max_combination_size=max_combination_size)
         self.cancel_sub_popup()
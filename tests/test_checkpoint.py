@@ -0,0 +1,99 @@
+import unittest
+import tempfile
+import shutil
+import os
+import sys
+
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+from mentalist import model, checkpoint
+
+class Interrupted(Exception):
+    pass
+
+class TestCheckpoint(unittest.TestCase):
+    def write(self, checkpoint_dict, f, interrupt_after=None):
+        '''Write the chain's words with checkpoints, raising Interrupted after
+        interrupt_after lists of words
+        '''
+        compiled_chain = self.chain.compile(batch_size=3)
+        if interrupt_after is not None:
+            iter_positioned_batches = compiled_chain.iter_positioned_batches
+            def interrupted(position=None):
+                for i, item in enumerate(iter_positioned_batches(position)):
+                    if i == interrupt_after:
+                        raise Interrupted()
+                    yield item
+            compiled_chain.iter_positioned_batches = interrupted
+        return checkpoint.write_with_checkpoints(compiled_chain, f, self.checkpoint_path,
+                                                 checkpoint_dict, interval=0)
+    
+    def test_resume(self):
+        expected = ''.join(word + '\n' for word in self.chain.get_words())
+        for interrupt_after in [0, 1, 5, 17, 40]:
+            chain_dict = model.Serializable.chain_as_string_dict(self.chain, '2.0.0')
+            with open(self.out_path, 'wb', buffering=0) as f:
+                with self.assertRaises(Interrupted):
+                    self.write(checkpoint.new_checkpoint(chain_dict), f, interrupt_after)
+            
+            # resume twice, the second time after the output was extended
+            # past the checkpoint
+            for resume_interrupt_after in [7, None]:
+                resume_checkpoint = checkpoint.load_checkpoint(self.checkpoint_path, chain_dict)
+                with open(self.out_path, 'ab') as f:
+                    f.write(b'partial')
+                with checkpoint.open_resumed_output(self.out_path, resume_checkpoint) as f:
+                    try:
+                        self.write(resume_checkpoint, f, resume_interrupt_after)
+                    except Interrupted:
+                        pass
+            
+            self.assertFalse(os.path.exists(self.checkpoint_path))
+            with open(self.out_path) as f:
+                self.assertEqual(expected, f.read())
+    
+    def test_different_chain(self):
+        chain_dict = model.Serializable.chain_as_string_dict(self.chain, '2.0.0')
+        with open(self.out_path, 'wb', buffering=0) as f:
+            with self.assertRaises(Interrupted):
+                self.write(checkpoint.new_checkpoint(chain_dict), f, 3)
+        
+        self.chain.nodes[-1].add_attr(model.StringListAttr(strings=['!']))
+        chain_dict = model.Serializable.chain_as_string_dict(self.chain, '2.0.0')
+        with self.assertRaises(checkpoint.CheckpointException):
+            checkpoint.load_checkpoint(self.checkpoint_path, chain_dict)
+    
+    def setUp(self):
+        '''
+        Create a temporary word file and a chain that uses it. Files are read
+        in small blocks to checkpoint at positions within the file.
+        '''
+        self.file_block_size = model.FILE_BLOCK_SIZE
+        model.FILE_BLOCK_SIZE = 16
+        
+        self.test_dir = tempfile.mkdtemp()
+        self.out_path = os.path.join(self.test_dir, 'out.txt')
+        self.checkpoint_path = checkpoint.get_checkpoint_path(self.out_path)
+        self.test_words_path = os.path.join(self.test_dir, 'test_words.txt')
+        with open(self.test_words_path, 'wb') as f:
+            f.write(b'\n'.join('test{}'.format(i).encode() for i in range(20)))
+            f.write(b'\r\nlie\r\n\rseed\rtree')
+        
+        self.chain = model.Chain()
+        node = model.BaseNode(is_root=True)
+        node.add_attr(model.FileAttr(path=self.test_words_path))
+        node.add_attr(model.StringListAttr(strings=['hello', 'world']))
+        self.chain.add_node(node)
+        node = model.MutateNode()
+        node.add_attr(model.SubstitutionAttr(type_='All', checked_vals=['e -> 3'], all_together=False))
+        node.add_attr(model.NothingMutatorAttr())
+        self.chain.add_node(node)
+        node = model.AddNode(prepend=False)
+        node.add_attr(model.RangeAttr(start=0, end=2))
+        self.chain.add_node(node)
+    
+    def tearDown(self):
+        model.FILE_BLOCK_SIZE = self.file_block_size
+        shutil.rmtree(self.test_dir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+import unittest
+import tempfile
+import shutil
+import json
+import os
+import sys
+import io
+import contextlib
+import subprocess
+import threading
+from unittest import mock
+
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+from mentalist import model, cli
+
+class TestCli(unittest.TestCase):
+    def test_run(self):
+        out_path = os.path.join(self.test_dir, 'out.txt')
+        with self.assertRaises(SystemExit) as cm:
+            cli.main(['run', self.chain_path, '-o', out_path])
+        self.assertEqual(0, cm.exception.code)
+        
+        with open(out_path) as f:
+            result = f.read().split('\n')[:-1]
+        self.assertEqual(list(self.chain.get_words()), result)
+        self.assertEqual(self.chain.count_words(), len(result))
+    
+    def test_run_basewords_only(self):
+        out_path = os.path.join(self.test_dir, 'out.txt')
+        with self.assertRaises(SystemExit) as cm:
+            cli.main(['run', self.chain_path, '-o', out_path, '--basewords-only'])
+        self.assertEqual(0, cm.exception.code)
+        
+        with open(out_path) as f:
+            self.assertEqual(self.test_words + ['hello'], f.read().split('\n')[:-1])
+    
+    def test_run_skip_limit(self):
+        out_path = os.path.join(self.test_dir, 'out.txt')
+        with self.assertRaises(SystemExit) as cm:
+            cli.main(['run', self.chain_path, '-o', out_path, '--skip', '25', '--limit', '30'])
+        self.assertEqual(0, cm.exception.code)
+        
+        with open(out_path) as f:
+            result = f.read().split('\n')[:-1]
+        self.assertEqual(list(self.chain.get_words())[25:55], result)
+    
+    def test_run_stdout(self):
+        root_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+        result = subprocess.run([sys.executable, '-m', 'mentalist', 'run', self.chain_path, '-o', '-'],
+                                cwd=root_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.assertEqual(0, result.returncode)
+        # the order of words from a Case node with several attributes
+        # depends on the subprocess's string hashing
+        self.assertEqual(sorted(self.chain.get_words()), sorted(result.stdout.decode().split('\n')[:-1]))
+    
+    @unittest.skipUnless(hasattr(os, 'mkfifo'), 'requires named pipes')
+    def test_run_named_pipe(self):
+        fifo_path = os.path.join(self.test_dir, 'fifo')
+        os.mkfifo(fifo_path)
+        result = []
+        def read():
+            with open(fifo_path) as f:
+                result.extend(f.read().split('\n')[:-1])
+        reader = threading.Thread(target=read)
+        reader.start()
+        with self.assertRaises(SystemExit) as cm:
+            cli.main(['run', self.chain_path, '-o', fifo_path])
+        reader.join()
+        self.assertEqual(0, cm.exception.code)
+        self.assertEqual(list(self.chain.get_words()), result)
+    
+    def test_keyspace(self):
+        with self.assertRaises(SystemExit) as cm:
+            with contextlib.redirect_stdout(io.StringIO()) as out:
+                cli.main(['keyspace', self.chain_path])
+        self.assertEqual(0, cm.exception.code)
+        self.assertEqual(str(self.chain.count_words()), out.getvalue().strip())
+    
+    def test_dedupe(self):
+        with open(self.test_words_path, 'a') as f:
+            f.write('\nhello\ntest1')
+        out_path = os.path.join(self.test_dir, 'out.txt')
+        with self.assertRaises(SystemExit) as cm:
+            cli.main(['run', self.chain_path, '-o', out_path, '--basewords-only', '--dedupe'])
+        self.assertEqual(0, cm.exception.code)
+        with open(out_path) as f:
+            self.assertEqual(self.test_words + ['hello'], f.read().split('\n')[:-1])
+        
+        with self.assertRaises(SystemExit) as cm:
+            with contextlib.redirect_stdout(io.StringIO()) as out:
+                cli.main(['keyspace', self.chain_path, '--basewords-only', '--dedupe'])
+        self.assertEqual(0, cm.exception.code)
+        self.assertEqual('4', out.getvalue().strip())
+        
+        with self.assertRaises(SystemExit) as cm:
+            with contextlib.redirect_stderr(io.StringIO()):
+                cli.main(['run', self.chain_path, '-o', out_path, '--dedupe', '-j', '2'])
+        self.assertEqual(1, cm.exception.code)
+    
+    def test_index(self):
+        cache_dir = os.path.join(self.test_dir, 'cache')
+        with mock.patch.dict(os.environ, {'MENTALIST_CACHE_DIR': cache_dir}):
+            with self.assertRaises(SystemExit) as cm:
+                with contextlib.redirect_stderr(io.StringIO()):
+                    cli.main(['index', self.chain_path])
+            self.assertEqual(0, cm.exception.code)
+            attr = model.FileAttr(path=self.test_words_path)
+            self.assertEqual(3, attr.get_line_index().line_count)
+            
+            # the skipped words are found in the index
+            out_path = os.path.join(self.test_dir, 'out.txt')
+            with self.assertRaises(SystemExit) as cm:
+                cli.main(['run', self.chain_path, '-o', out_path, '--skip', '25', '--limit', '30'])
+            self.assertEqual(0, cm.exception.code)
+        with open(out_path) as f:
+            self.assertEqual(list(self.chain.get_words())[25:55], f.read().split('\n')[:-1])
+    
+    def test_pack(self):
+        packed_path = os.path.join(self.test_dir, 'test_words.mwl')
+        with self.assertRaises(SystemExit) as cm:
+            with contextlib.redirect_stderr(io.StringIO()):
+                cli.main(['pack', self.test_words_path, '-o', packed_path, '--sort-length'])
+        self.assertEqual(0, cm.exception.code)
+        attr = model.FileAttr(path=packed_path)
+        self.assertEqual(sorted(self.test_words, key=len), list(attr.get_words()))
+        
+        with self.assertRaises(SystemExit) as cm:
+            with contextlib.redirect_stderr(io.StringIO()):
+                cli.main(['pack', self.test_words_path, '-o', packed_path + '.txt'])
+        self.assertEqual(1, cm.exception.code)
+    
+    def test_run_missing_file(self):
+        os.remove(self.test_words_path)
+        out_path = os.path.join(self.test_dir, 'out.txt')
+        with self.assertRaises(SystemExit) as cm:
+            cli.main(['run', self.chain_path, '-o', out_path])
+        self.assertEqual(1, cm.exception.code)
+        self.assertFalse(os.path.exists(out_path))
+    
+    def setUp(self):
+        '''
+        Create a temporary word file and a chain file that uses it
+        '''
+        self.test_dir = tempfile.mkdtemp()
+        self.test_words_path = os.path.join(self.test_dir, 'test_words.txt')
+        self.test_words = ['test1', 'test word 2', 'THIRDTESTWORD']
+        with open(self.test_words_path, 'w') as f:
+            f.write('\n'.join(self.test_words))
+        
+        self.chain = model.Chain()
+        node = model.BaseNode(is_root=True)
+        node.add_attr(model.FileAttr(path=self.test_words_path))
+        node.add_attr(model.StringListAttr(strings=['hello']))
+        self.chain.add_node(node)
+        node = model.MutateNode(is_case=True)
+        node.add_attr(model.CaseAttr(type_='First', case='Uppercase'))
+        node.add_attr(model.NothingMutatorAttr())
+        self.chain.add_node(node)
+        node = model.AddNode(prepend=True)
+        node.add_attr(model.RangeAttr(start=0, end=10))
+        self.chain.add_node(node)
+        
+        self.chain_path = os.path.join(self.test_dir, 'chain.mentalist')
+        with open(self.chain_path, 'w') as f:
+            json.dump(model.Serializable.chain_as_string_dict(self.chain, '2.0.0'), f)
+
+    def tearDown(self):
+        '''
+        Delete all temporary files
+        '''
+        shutil.rmtree(self.test_dir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import unittest
+import tempfile
+import shutil
+import threading
+import time
+import os
+import sys
+
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+from mentalist import model, coordinator
+
+class TestCoordinator(unittest.TestCase):
+    def run_workers(self, chain, chunk_size, worker_count=2, lease_timeout=5.):
+        '''Serve the chain on localhost and run workers in threads until all
+        chunks are done, with one worker that leases a chunk and dies
+        
+        return value: the words in the chunk files, in order
+        '''
+        chain_dict = model.Serializable.chain_as_string_dict(chain, '2.0.0')
+        work_coordinator = coordinator.Coordinator(chain_dict, chunk_size, lease_timeout)
+        address = work_coordinator.start('127.0.0.1:0')
+        try:
+            # a worker that never completes its chunk
+            lease = coordinator.send_request(address, {'op': 'lease', 'worker': 'dead'})
+            self.assertEqual(0, lease['chunk'])
+            
+            threads = [threading.Thread(target=coordinator.run_worker,
+                                        args=(address, self.test_dir, 'worker{}'.format(i)))
+                       for i in range(worker_count)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(30)
+            self.assertTrue(work_coordinator.wait(0))
+        finally:
+            work_coordinator.stop()
+        
+        words = []
+        for i in range(len(work_coordinator.chunks)):
+            with open(coordinator.get_chunk_path(self.test_dir, i)) as f:
+                words.extend(f.read().split('\n')[:-1])
+        return words
+    
+    def test_word_chunks(self):
+        self.assertEqual(30, self.chain.get_fanout())
+        words = self.run_workers(self.chain, 7, lease_timeout=0.3)
+        self.assertEqual(list(self.chain.get_words()), words)
+    
+    def test_baseword_chunks(self):
+        node = model.MutateNode()
+        node.add_attr(model.SubstitutionAttr(type_='All', checked_vals=['e -> 3'], all_together=False))
+        node.add_attr(model.NothingMutatorAttr())
+        self.chain.add_node(node)
+        words = self.run_workers(self.chain, 2, lease_timeout=0.3)
+        self.assertEqual(list(self.chain.get_words()), words)
+    
+    def test_lease(self):
+        chain_dict = model.Serializable.chain_as_string_dict(self.chain, '2.0.0')
+        work_coordinator = coordinator.Coordinator(chain_dict, 60, lease_timeout=0.1)
+        self.assertEqual(2, len(work_coordinator.chunks))
+        
+        self.assertEqual(0, work_coordinator.handle({'op': 'lease', 'worker': 'a'})['chunk'])
+        self.assertEqual(1, work_coordinator.handle({'op': 'lease', 'worker': 'b'})['chunk'])
+        self.assertIn('wait', work_coordinator.handle({'op': 'lease', 'worker': 'c'}))
+        self.assertTrue(work_coordinator.handle({'op': 'complete', 'worker': 'b', 'chunk': 1})['ok'])
+        
+        # worker a's lease expires and chunk 0 goes to worker c
+        time.sleep(0.2)
+        self.assertEqual(0, work_coordinator.handle({'op': 'lease', 'worker': 'c'})['chunk'])
+        self.assertFalse(work_coordinator.handle({'op': 'heartbeat', 'worker': 'a', 'chunk': 0})['ok'])
+        self.assertTrue(work_coordinator.handle({'op': 'heartbeat', 'worker': 'c', 'chunk': 0})['ok'])
+        self.assertFalse(work_coordinator.handle({'op': 'complete', 'worker': 'a', 'chunk': 0})['ok'])
+        self.assertFalse(work_coordinator.wait(0))
+        self.assertTrue(work_coordinator.handle({'op': 'complete', 'worker': 'c', 'chunk': 0})['ok'])
+        self.assertTrue(work_coordinator.wait(0))
+        self.assertEqual({'done': True}, work_coordinator.handle({'op': 'lease', 'worker': 'a'}))
+    
+    def test_heartbeat(self):
+        chain_dict = model.Serializable.chain_as_string_dict(self.chain, '2.0.0')
+        work_coordinator = coordinator.Coordinator(chain_dict, 60)
+        address = work_coordinator.start('127.0.0.1:0')
+        try:
+            self.assertEqual(0, coordinator.send_request(address, {'op': 'lease', 'worker': 'a'})['chunk'])
+            heartbeat = coordinator.Heartbeat(address, {'worker': 'a', 'chunk': 0}, 0.01)
+            time.sleep(0.1)
+            heartbeat.stop()
+            self.assertFalse(heartbeat.lost.is_set())
+            
+            # a worker without the lease stops writing the chunk
+            heartbeat = coordinator.Heartbeat(address, {'worker': 'b', 'chunk': 0}, 0.01)
+            self.assertTrue(heartbeat.lost.wait(5))
+            self.assertEqual([], list(heartbeat.iter_held([['word']])))
+            heartbeat.stop()
+        finally:
+            work_coordinator.stop()
+    
+    def setUp(self):
+        '''
+        Create a temporary word file and a chain that uses it
+        '''
+        self.test_dir = tempfile.mkdtemp()
+        self.test_words_path = os.path.join(self.test_dir, 'test_words.txt')
+        with open(self.test_words_path, 'w') as f:
+            f.write('\n'.join(['test1', 'test word 2', 'THIRDTESTWORD']))
+        
+        self.chain = model.Chain()
+        node = model.BaseNode(is_root=True)
+        node.add_attr(model.FileAttr(path=self.test_words_path))
+        node.add_attr(model.StringListAttr(strings=['hello']))
+        self.chain.add_node(node)
+        node = model.MutateNode(is_case=True)
+        node.add_attr(model.CaseAttr(type_='First', case='Uppercase'))
+        self.chain.add_node(node)
+        node = model.AddNode(prepend=False)
+        node.add_attr(model.RangeAttr(start=0, end=30))
+        self.chain.add_node(node)
+    
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+if __name__ == '__main__':
+    unittest.main()
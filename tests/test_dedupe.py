@@ -0,0 +1,125 @@
+import unittest
+import tempfile
+import shutil
+import os
+import sys
+from unittest import mock
+
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+from mentalist import model, dedupe
+
+class TestDedupe(unittest.TestCase):
+    def test_word_filter(self):
+        word_filter = dedupe.WordFilter(6)
+        self.assertTrue(word_filter.is_exact())
+        self.assertEqual(['a', 'b'], word_filter.filter(['a', 'b', 'a']))
+        self.assertEqual(['c'], word_filter.filter(['b', 'c', 'c']))
+
+    def test_fingerprint_table(self):
+        # more words than expected grow the table
+        table = dedupe.FingerprintTable(1)
+        words = [str(i) for i in range(1000)]
+        self.assertEqual(words, table.filter(words + words))
+        self.assertEqual([], table.filter(words))
+        self.assertEqual(1000, table.count)
+        self.assertGreaterEqual(len(table.slots) * dedupe.MAX_LOAD, 1000)
+
+        # the exact filter is used while its table fits in the memory limit
+        size = 8 * dedupe.get_table_size(1000)
+        self.assertTrue(dedupe.WordFilter(1000, memory_limit=size).is_exact())
+        self.assertFalse(dedupe.WordFilter(1000, memory_limit=size - 1).is_exact())
+
+    def test_fingerprint(self):
+        # the same in every process, whatever PYTHONHASHSEED is
+        self.assertEqual(16417751708935026519, dedupe.get_fingerprint('caf\u00e9'))
+        self.assertEqual(dedupe.get_fingerprint('caf\u00e9'), dedupe.get_fingerprint(b'caf\xc3\xa9'))
+
+    def test_bloom_filter(self):
+        words = [str(i) for i in range(20000)]
+        word_filter = dedupe.WordFilter(2 * len(words), memory_limit=1 << 16, error_rate=0.01)
+        self.assertFalse(word_filter.is_exact())
+        kept = word_filter.filter(words)
+        # a few new words are removed, but repeated words always are
+        self.assertGreater(len(kept), 0.97 * len(words))
+        self.assertEqual([], word_filter.filter(words))
+
+    def test_chain(self):
+        chain = model.Chain()
+        node = model.BaseNode(is_root=True)
+        node.add_attr(model.FileAttr(path=self.words_path))
+        node.add_attr(model.StringListAttr(strings=['two', 'five', 'one']))
+        chain.add_node(node)
+        node = model.AddNode()
+        node.add_attr(model.RangeAttr(start=0, end=3))
+        chain.add_node(node)
+        self.assertEqual(24, chain.count_words())
+
+        chain.nodes[0].dedupe = True
+        expected = [word + str(i) for word in ['one', 'two', 'three', 'four', 'five'] for i in range(3)]
+        self.assertEqual(expected, list(chain.get_words()))
+        self.assertEqual(15, chain.count_words())
+        self.assertEqual(sum(map(len, expected)) + 15, chain.count_bytes())
+        self.assertEqual(expected, [word.decode() for batch in chain.compile(as_bytes=True).iter_batches()
+                                    for word in batch])
+        self.assertEqual(expected[4:11], list(chain.compile().get_words())[4:11])
+        self.assertEqual(expected[4:11], [word for batch in chain.compile().iter_range_batches(4, 11)
+                                          for word in batch])
+        with self.assertRaises(ValueError):
+            chain.get_shards(2)
+
+        # resuming re-reads the words before the position
+        compiled_chain = chain.compile(batch_size=2)
+        items = list(compiled_chain.iter_positioned_batches())
+        for i, (batch, position) in enumerate(items):
+            if position is None:
+                continue
+            words = [word for batch, position in items[:i + 1] for word in batch]
+            words.extend(word for batch, position in compiled_chain.iter_positioned_batches(position)
+                         for word in batch)
+            self.assertEqual(expected, words)
+
+        # the flag is saved with the chain
+        chain_dict = model.Serializable.chain_as_string_dict(chain, '2.0.0')
+        self.assertTrue(model.Serializable.chain_from_string_dict(chain_dict).nodes[0].dedupe)
+
+    def test_background_count(self):
+        class Controller(object):
+            word_calculator_count = 0
+            updates = 0
+            def update_counts(self):
+                self.updates += 1
+        controller = Controller()
+        node = model.BaseNode(is_root=True, controller=controller)
+        node.add_attr(model.StringListAttr(strings=['one', 'two', 'one']))
+        node.dedupe = True
+        # the words aren't read until count_unique_in_background() is called
+        with mock.patch.object(node, 'scan_unique') as scan_unique:
+            self.assertFalse(node.is_deduping())
+            self.assertEqual(3, node.count_words(0))
+            self.assertEqual({'o': [3, 9]}, node.get_character_counts(frozenset('o')).profiles)
+            self.assertFalse(scan_unique.called)
+        self.assertTrue(node.count_unique_in_background())
+        node.unique_thread.join()
+        self.assertEqual(2, controller.updates)
+        self.assertFalse(node.count_unique_in_background())
+        self.assertTrue(node.is_deduping())
+        self.assertEqual(2, node.count_words(0))
+        self.assertEqual({'o': [2, 6]}, node.get_character_counts(frozenset('o')).profiles)
+
+        # new words are counted again
+        node.add_attr(model.StringListAttr(strings=['three']))
+        self.assertFalse(node.is_deduping())
+        self.assertTrue(node.count_unique_in_background())
+        node.stop_counting_unique()
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.words_path = os.path.join(self.test_dir, 'words.txt')
+        with open(self.words_path, 'w') as f:
+            f.write('one\ntwo\nthree\none\nfour\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+if __name__ == '__main__':
+    unittest.main()
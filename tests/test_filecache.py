@@ -0,0 +1,92 @@
+import unittest
+import tempfile
+import shutil
+import os
+import sys
+from unittest import mock
+
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+from mentalist import model
+from mentalist import filecache
+
+class TestFileCache(unittest.TestCase):
+    def test_cached_counts(self):
+        attr = model.FileAttr(path=self.words_path)
+        self.assertEqual(3, attr.count_words(0))
+        self.assertEqual(13, attr.count_bytes(0, 0))
+        self.assertTrue(os.path.exists(os.path.join(self.cache_dir, filecache.CACHE_FILE_NAME)))
+
+        # the second load is answered from the cache
+        with mock.patch.object(model.FileAttr, 'scan_file') as scan_file:
+            attr = model.FileAttr(path=self.words_path)
+            self.assertFalse(scan_file.called)
+        self.assertEqual(3, attr.count_words(0))
+
+        # a changed file is scanned again
+        with open(self.words_path, 'w') as f:
+            f.write('one\ntwo\n')
+        attr = model.FileAttr(path=self.words_path)
+        self.assertEqual(2, attr.count_words(0))
+
+    def test_bundled_metadata(self):
+        with mock.patch.object(model.FileAttr, 'scan_file') as scan_file:
+            attr = model.FileAttr(path='$DATA_DIR/Common_Names_Men.txt')
+            self.assertFalse(scan_file.called)
+        words = list(attr.get_words())
+        self.assertEqual(len(words), attr.count_words(0))
+        self.assertEqual(sum(map(len, words)), attr.count_bytes(0, 0))
+
+    def test_character_index(self):
+        with open(self.words_path, 'w') as f:
+            f.write('hello\nWorld\nhello\nabc\n')
+        chain = model.Chain()
+        node = model.BaseNode(is_root=True)
+        node.add_attr(model.FileAttr(path=self.words_path))
+        chain.add_node(node)
+        node = model.MutateNode(is_case=True)
+        node.add_attr(model.NothingMutatorAttr())
+        node.add_attr(model.CaseAttr(type_='All', case='Uppercase'))
+        node.add_attr(model.CaseAttr(type_='First', case='Uppercase'))
+        chain.add_node(node)
+
+        words = list(chain.get_words())
+        self.assertTrue(chain.has_exact_counts())
+        self.assertEqual(len(words), chain.count_words())
+        self.assertEqual(sum(map(len, words)) + len(words), chain.count_bytes())
+        index_path = chain.nodes[0].attrs[0].get_character_index_path()
+        self.assertTrue(os.path.exists(index_path))
+
+        # the second load is answered from the cache
+        attr = model.FileAttr(path=self.words_path)
+        with mock.patch.object(model.FileAttr, 'uncounted') as uncounted:
+            counts = attr.count_characters(frozenset('lo'))
+            self.assertFalse(uncounted.called)
+        self.assertEqual({'llo': [2, 10], 'lo': [1, 5], '': [1, 3]}, counts.profiles)
+
+        chain.nodes[0].attrs[0] = attr
+        node = model.MutateNode()
+        node.add_attr(model.SubstitutionAttr(type_='All', checked_vals=['o -> 0'], all_together=True))
+        chain.nodes[1] = node
+        self.assertEqual(len(list(chain.get_words())), chain.count_words())
+
+    def test_cache_off(self):
+        with mock.patch.dict(os.environ, {'MENTALIST_CACHE_DIR': ''}):
+            attr = model.FileAttr(path=self.words_path)
+        self.assertEqual(3, attr.count_words(0))
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, filecache.CACHE_FILE_NAME)))
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.test_dir, 'cache')
+        self.environ = mock.patch.dict(os.environ, {'MENTALIST_CACHE_DIR': self.cache_dir})
+        self.environ.start()
+        self.words_path = os.path.join(self.test_dir, 'words.txt')
+        with open(self.words_path, 'w') as f:
+            f.write('abc\ndefg\nhijklm\n')
+
+    def tearDown(self):
+        self.environ.stop()
+        shutil.rmtree(self.test_dir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+import tempfile
+import shutil
+import os
+import sys
+import pickle
+import gzip
+from unittest import mock
+
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+from mentalist import model
+
+class TestLineIndex(unittest.TestCase):
+    def test_line_offsets(self):
+        file_block_size = model.FILE_BLOCK_SIZE
+        model.FILE_BLOCK_SIZE = 8
+        try:
+            for i, data in enumerate([b'', b'\n', b'a', b'one\ntwo', b'a\r\nbb\r\n',
+                                      b'a\r\n\r\nccc\rd\n\r', b'\r\r\n\n\r', b'abcdefghijklmnop\nq\n']):
+                # a new file each time, as the cache can't tell apart files
+                # rewritten within the resolution of their modification time
+                path = os.path.join(self.test_dir, '{}.txt'.format(i))
+                with open(path, 'wb') as f:
+                    f.write(data)
+                attr = model.FileAttr(path=path)
+                self.assertIsNone(attr.get_line_index())
+                offsets = [attr.get_line_offset(i) for i in range(attr.word_count + 2)]
+
+                line_index = attr.build_line_index()
+                self.assertEqual(attr.word_count, line_index.line_count, data)
+                self.assertEqual(offsets, [attr.get_line_offset(i) for i in range(attr.word_count + 2)],
+                                 data)
+                self.assertEqual(offsets[-1], attr.get_line_offset(1, offsets[-2]))
+                words = list(attr.get_words())
+                self.assertEqual(words, [attr.get_line(i) for i in range(len(words))])
+                line_index.close()
+        finally:
+            model.FILE_BLOCK_SIZE = file_block_size
+
+    def test_shards(self):
+        with open(self.words_path, 'w') as f:
+            f.write(''.join('{}\n'.format('x' * (i % 7)) for i in range(100)))
+        attr = model.FileAttr(path=self.words_path)
+        attr.build_line_index()
+
+        # the index is found by a new attribute for the same file
+        attr = model.FileAttr(path=self.words_path)
+        self.assertIsNotNone(attr.get_line_index())
+        words = []
+        for start, stop in attr.get_shards(8):
+            shard = []
+            for batch in attr.get_slice_batches(start, stop):
+                shard.extend(batch)
+            self.assertIn(len(shard), (12, 13))
+            words.extend(shard)
+        self.assertEqual(list(attr.get_words()), words)
+        self.assertEqual('x' * 3, attr.get_line(10))
+
+        # the index is loaded again in other processes
+        attr = pickle.loads(pickle.dumps(attr))
+        self.assertIsNotNone(attr.get_line_index())
+
+        # a changed file doesn't use the old index
+        with open(self.words_path, 'a') as f:
+            f.write('more\n')
+        attr = model.FileAttr(path=self.words_path)
+        self.assertIsNone(attr.get_line_index())
+
+    def test_compressed(self):
+        path = self.words_path + '.gz'
+        with gzip.open(path, 'wt') as f:
+            f.write(''.join('word {}\n'.format(i) for i in range(50)))
+        attr = model.FileAttr(path=path)
+        line_index = attr.build_line_index()
+        self.assertEqual(50, line_index.line_count)
+        self.assertEqual('word 42', attr.get_line(42))
+        start, stop = attr.get_word_range(10, 12)
+        self.assertEqual([['word 10', 'word 11']], list(attr.get_slice_batches(start, stop)))
+        line_index.close()
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.environ = mock.patch.dict(os.environ,
+                                       {'MENTALIST_CACHE_DIR': os.path.join(self.test_dir, 'cache')})
+        self.environ.start()
+        self.words_path = os.path.join(self.test_dir, 'words.txt')
+
+    def tearDown(self):
+        self.environ.stop()
+        shutil.rmtree(self.test_dir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,6 +5,12 @@ import shutil
 import os
 import sys
 import subprocess
+import threading
+import itertools
+import gzip
+import bz2
+import lzma
+from unittest import mock
 
 sys.path.insert(1, os.path.join(sys.path[0], '..'))
 from mentalist import model
@@ -19,6 +25,139 @@ class TestModel(unittest.TestCase):
         self.assertEqual(self.test_words, result)
         self.assertEqual(len(result), attr.count_words(0))
     
+    def test_file_attr_bytes(self):
+        path = os.path.join(self.test_dir, 'bytes.txt')
+        data = b'caf\xc3\xa9\r\nbad \xff byte\n\nlast\r'
+        with open(path, 'wb') as f:
+            f.write(data)
+        attr = model.FileAttr(path=path)
+        
+        # invalid bytes are kept as surrogates and encode back unchanged
+        words = list(attr.get_words())
+        self.assertEqual(4, len(words))
+        self.assertEqual('', words[2])
+        self.assertEqual([b'caf\xc3\xa9', b'bad \xff byte', b'', b'last'],
+                         [w.encode('utf-8', 'surrogateescape') for w in words])
+        
+        batches = list(attr.get_encoded_slice_batches(0, None, encoding='utf-8'))
+        self.assertEqual([[b'caf\xc3\xa9', b'bad \xff byte', b'', b'last']], batches)
+        self.assertEqual([(b'caf\xc3\xa9\nbad \xff byte\n\nlast\n', 4)],
+                         list(attr.iter_word_blocks(0, None, model.BATCH_SIZE, 'utf-8')))
+    
+    def test_file_attr_counts(self):
+        count_block_size = model.COUNT_BLOCK_SIZE
+        path = os.path.join(self.test_dir, 'counts.txt')
+        # the file is rewritten faster than its modification time changes,
+        # so the metadata cache is turned off
+        environ = mock.patch.dict(os.environ, {'MENTALIST_CACHE_DIR': ''})
+        environ.start()
+        try:
+            for data in [b'', b'\n', b'a', b'a\r\nbb\r\n', b'a\r\n\r\nccc\rd\n\r', b'one\ntwo',
+                         b'\r\r\n\n\r']:
+                for block_size in [1, 2, 3, 1024]:
+                    model.COUNT_BLOCK_SIZE = block_size
+                    with open(path, 'wb') as f:
+                        f.write(data)
+                    attr = model.FileAttr(path=path)
+                    words = list(attr.get_words())
+                    self.assertEqual(len(words), attr.count_words(0), data)
+                    self.assertEqual(sum(map(len, words)), attr.count_bytes(0, 0), data)
+                    self.assertEqual(1., attr.count_progress)
+        finally:
+            environ.stop()
+            model.COUNT_BLOCK_SIZE = count_block_size
+    
+    def test_file_attr_compressed(self):
+        data = b''.join(b'word %d\r\n' % i for i in range(1000))
+        for extension, compress in [('gz', gzip.compress), ('bz2', bz2.compress),
+                                    ('xz', lzma.compress)]:
+            path = os.path.join(self.test_dir, 'words.txt.' + extension)
+            with open(path, 'wb') as f:
+                # two streams, as written by CompressedWriter with several threads
+                f.write(compress(data[:5000]) + compress(data[5000:]))
+            attr = model.FileAttr(path=path)
+            words = ['word %d' % i for i in range(1000)]
+            self.assertEqual(words, list(attr.get_words()))
+            self.assertEqual(1000, attr.count_words(0))
+            self.assertEqual(sum(map(len, words)), attr.count_bytes(0, 0))
+            
+            start, stop = attr.get_word_range(300, 310)
+            self.assertEqual([words[300:310]], list(attr.get_slice_batches(start, stop)))
+            self.assertEqual([(0, None)], attr.get_shards(4))
+    
+    def test_directory_attr(self):
+        dir_path = os.path.join(self.test_dir, 'lists')
+        os.mkdir(dir_path)
+        with open(os.path.join(dir_path, 'b.txt'), 'wb') as f:
+            f.write(b'b1\r\nb2') # no final line ending
+        with gzip.open(os.path.join(dir_path, 'a.txt.gz'), 'wb') as f:
+            f.write(b'a1\na2\na3\n')
+        with open(os.path.join(dir_path, 'c.txt'), 'wb') as f:
+            f.write(b'c1\n')
+        words = ['a1', 'a2', 'a3', 'b1', 'b2', 'c1']
+        
+        attr = model.DirectoryAttr(pattern=dir_path)
+        self.assertEqual(words, list(attr.get_words()))
+        self.assertEqual(6, attr.count_words(0))
+        self.assertEqual(12, attr.count_bytes(0, 0))
+        self.assertEqual(1., attr.count_progress)
+        
+        # every file read ahead, only one at a time, and none
+        prefetch_memory = model.PREFETCH_MEMORY
+        try:
+            for model.PREFETCH_MEMORY in [prefetch_memory, 200, 0]:
+                for start in range(7):
+                    for stop in list(range(start, 7)) + [None]:
+                        result = [w for batch in attr.get_slice_batches(start, stop) for w in batch]
+                        self.assertEqual(words[start:stop], result)
+                blocks = list(attr.iter_word_blocks(2, 5, model.BATCH_SIZE, 'utf-8'))
+                self.assertEqual(b'a3\nb1\nb2\n', b''.join(block for block, word_count in blocks))
+                self.assertEqual(3, sum(word_count for block, word_count in blocks))
+        finally:
+            model.PREFETCH_MEMORY = prefetch_memory
+        
+        attr = model.DirectoryAttr(pattern=os.path.join(dir_path, '*.txt'))
+        self.assertEqual(['b1', 'b2', 'c1'], list(attr.get_words()))
+        
+        attr = model.DirectoryAttr(pattern=os.path.join(dir_path, '*.missing'))
+        self.assertIsNotNone(attr.file_error)
+        self.assertEqual(0, attr.count_words(0))
+    
+    def test_iter_in_background(self):
+        self.assertEqual(list(range(10)), list(model.iter_in_background(iter(range(10)), 2)))
+        
+        # the producer is closed when the items are no longer wanted
+        closed = threading.Event()
+        def produce():
+            try:
+                yield from itertools.count()
+            finally:
+                closed.set()
+        items = model.iter_in_background(produce(), 2)
+        self.assertEqual(0, next(items))
+        items.close()
+        self.assertTrue(closed.is_set())
+        
+        def fail():
+            yield 1
+            raise ValueError()
+        with self.assertRaises(ValueError):
+            list(model.iter_in_background(fail()))
+    
+    @unittest.skipUnless(hasattr(os, 'mkfifo'), 'requires named pipes')
+    def test_file_attr_named_pipe(self):
+        path = os.path.join(self.test_dir, 'fifo')
+        os.mkfifo(path)
+        def write():
+            with open(path, 'w') as f:
+                f.write('\n'.join(self.test_words))
+        attr = model.FileAttr(path=self.test_words_path)
+        attr.absolute_path = path
+        writer = threading.Thread(target=write)
+        writer.start()
+        self.assertEqual(self.test_words, list(attr.get_words()))
+        writer.join()
+    
     def test_stringlist_attr(self):
         attr = model.StringListAttr(strings=self.test_words)
         
@@ -79,6 +218,82 @@ class TestModel(unittest.TestCase):
         result = list(attr.get_words(['hello', 'test2']))
         self.assertEqual(result, ['h3l10', 't3st2'])
     
+    def test_substitution_fast_paths(self):
+        # the compiled substitutions match substituting one character at a
+        # time, including chained, multi-character and non-ASCII ones
+        words = ['', 'hello', 'HELLO', 'Kelvin', '\u212aelvin', 'stra\u00dfe', 'ISLAND', '\u0130sland',
+                 'a$b@c', 'llll', 'sassy', 'no match']
+        checked_vals_list = [['e -> 3', 'l -> 1', 'o -> 0'], ['s -> $', 's -> 5', 'l -> i', 'i -> 1'],
+                             ['k -> <', 'a -> a', 'l -> ll'], ['\u00df -> ss', 'i -> \u0130', 's -> ']]
+        for type_ in ['First', 'Last', 'All', 'Nth']:
+            for all_together in [False, True]:
+                for checked_vals in checked_vals_list:
+                    attr = model.SubstitutionAttr(type_=type_, checked_vals=checked_vals,
+                                                  all_together=all_together)
+                    substitute_word = attr.compile_word()
+                    substitute_word_generic = attr.compile_word_generic()
+                    for word in words:
+                        self.assertEqual(substitute_word_generic(word), substitute_word(word),
+                                         (type_, all_together, checked_vals, word))
+    
+    def test_substitution_combinations(self):
+        attr = model.SubstitutionAttr(type_='Combinations', checked_vals=['a -> @', 'o -> 0', 's -> $'],
+                                      all_together=True)
+        self.assertEqual(['pass', 'p@ss', 'pa$s', 'pas$', 'p@$s', 'p@s$', 'pa$$', 'p@$$', 'xyz'],
+                         list(attr.get_words(['pass', 'xyz'])))
+        attr = model.SubstitutionAttr(type_='Combinations', checked_vals=['s -> $', 's -> 5'],
+                                      all_together=False, max_combination_size=1)
+        self.assertEqual(['Sass', '$ass', 'Sa$s', 'Sas$', '5ass', 'Sa5s', 'Sas5'],
+                         list(attr.get_words(['Sass'])))
+        self.assertFalse(attr.check_hashcat_compatible())
+        
+        # the counts are worked out from the characters in the base words
+        chain = model.Chain()
+        node = model.BaseNode(is_root=True)
+        node.add_attr(model.StringListAttr(strings=['password', 'Sass', 'caf\u00e9', '']))
+        chain.add_node(node)
+        node = model.MutateNode()
+        node.add_attr(model.SubstitutionAttr(type_='Combinations', checked_vals=['a -> @', 'o -> 0', 's -> $',
+                                                                                   'e -> 3', 'l -> ll'],
+                                             all_together=True, max_combination_size=2))
+        node.add_attr(model.NothingMutatorAttr())
+        chain.add_node(node)
+        words = list(chain.get_words())
+        self.assertEqual(len(words), chain.count_words())
+        self.assertEqual(sum(len(word.encode('utf-8')) + 1 for word in words), chain.count_bytes())
+        # 'l -> ll' can make the same word twice, as from 'll', which is
+        # only written once
+        self.assertFalse(chain.has_exact_counts())
+        node.attrs[0] = model.SubstitutionAttr(type_='Combinations', checked_vals=['a -> @', 'o -> 0', 's -> $'],
+                                               all_together=True, max_combination_size=2)
+        words = list(chain.get_words())
+        self.assertEqual(len(words), chain.count_words())
+        self.assertTrue(chain.has_exact_counts())
+
+    def test_case_combinations(self):
+        attr = model.CaseAttr(type_='Combinations', idx=3)
+        # the digit is not toggled, so each word is made once
+        self.assertEqual(['a1b', 'A1b', 'a1B', 'A1B', '12'], list(attr.get_words(['a1b', '12'])))
+        self.assertTrue(attr.check_hashcat_compatible())
+        self.assertEqual([':', 'T0', 'T1', 'T2', 'T0T1', 'T0T2', 'T1T2', 'T0T1T2'], attr.get_rules())
+        attr = model.CaseAttr(type_='Combinations', idx=8, max_variants=4)
+        self.assertEqual(['Pass', 'pass', 'PAss', 'PaSs'], list(attr.get_words(['Pass'])))
+        self.assertFalse(attr.check_hashcat_compatible())
+
+        # the counts are worked out from the base words' toggle profiles
+        chain = model.Chain()
+        node = model.BaseNode(is_root=True)
+        node.add_attr(model.StringListAttr(strings=['password1', 'Sass', 'straße', '']))
+        chain.add_node(node)
+        node = model.MutateNode(is_case=True)
+        node.add_attr(model.CaseAttr(type_='Combinations', idx=6, max_variants=40))
+        node.add_attr(model.NothingMutatorAttr())
+        chain.add_node(node)
+        words = list(chain.get_words())
+        self.assertEqual(len(words), chain.count_words())
+        self.assertEqual(sum(len(word.encode('utf-8')) + 1 for word in words), chain.count_bytes())
+        self.assertTrue(chain.has_exact_counts())
+
     def test_range_attr(self):
         range_ = [0, 100]
         attr = model.RangeAttr(start=range_[0], end=range_[1])
@@ -351,6 +566,37 @@ $T$H$I$R$D$T$E$S$T$W$O$R$D:
 '''
         self.assertEqual(rules_truth, rules)
     
+    def test_add_word_table(self):
+        chain = model.Chain()
+        node = model.BaseNode(is_root=True)
+        node.add_attr(model.StringListAttr(strings=['a', 'b', 'c']))
+        chain.add_node(node)
+        node = model.AddNode(prepend=True)
+        node.add_attr(model.FileAttr(path=self.test_words_path))
+        node.add_attr(model.RangeAttr(start=0, end=5))
+        chain.add_node(node)
+        
+        truth_words = [other + word for word in ['a', 'b', 'c']
+                       for other in self.test_words + ['0', '1', '2', '3', '4']]
+        self.assertEqual(truth_words, list(chain.get_words()))
+        
+        # over the memory limit, the words are read from a temporary file
+        memory_limit = model.ADD_WORDS_MEMORY_LIMIT
+        model.ADD_WORDS_MEMORY_LIMIT = 0
+        try:
+            table = model.AddWordTable(node.attrs, batch_size=2)
+            self.assertIsNotNone(table.file)
+            self.assertEqual(8, table.word_count)
+            self.assertEqual(self.test_words + ['0', '1', '2', '3', '4'],
+                             [word for batch in table.iter_batches() for word in batch])
+            self.assertEqual(truth_words, list(chain.get_words()))
+            if chain.can_compile_bytes():
+                compiled = chain.compile(batch_size=3, as_bytes=True)
+                self.assertEqual([word.encode(compiled.encoding) for word in truth_words],
+                                 [word for batch in compiled.iter_batches() for word in batch])
+        finally:
+            model.ADD_WORDS_MEMORY_LIMIT = memory_limit
+    
     def test_append_nothing_chain(self):
         chain = model.Chain()
         
@@ -405,6 +651,28 @@ $B
         self.assertEqual(64, chain.count_bytes())
         self.assertTrue(chain.check_hashcat_compatible())
 
+    def test_mutate_dedupe(self):
+        node = model.MutateNode()
+        node.add_attr(model.NothingMutatorAttr())
+        node.add_attr(model.SubstitutionAttr(type_='All', checked_vals=['a -> @'], all_together=True))
+        node.add_attr(model.SubstitutionAttr(type_='All', checked_vals=['o -> 0'], all_together=True))
+        # only the input word is repeated
+        self.assertEqual([False, False, False], node.get_colliding_attrs())
+        self.assertEqual(['ao', '@o', 'a0', 'xyz'], node.compile_batch()[0](['ao', 'xyz']))
+        self.assertTrue(node.has_exact_counts())
+
+        node.add_attr(model.SubstitutionAttr(type_='All', checked_vals=['a -> @', 'o -> 0'], all_together=True))
+        self.assertEqual([False, True, True, True], node.get_colliding_attrs())
+        # words are kept in the order they are first made
+        self.assertEqual(['ao', '@o', 'a0', '@0', 'a', '@'], node.compile_batch()[0](['ao', 'a']))
+        self.assertFalse(node.has_exact_counts())
+
+        node = model.MutateNode(is_case=True)
+        node.add_attr(model.NothingMutatorAttr())
+        node.add_attr(model.CaseAttr(type_='All', case='Uppercase'))
+        node.add_attr(model.CaseAttr(type_='First', case='Uppercase'))
+        self.assertEqual(['abc', 'ABC', 'Abc', 'ABC', 'Abc'], node.compile_batch()[0](['abc', 'ABC']))
+
     def test_nothing_mutator_chain(self):
         chain = model.Chain()
         
@@ -452,11 +720,10 @@ $B
         truth_words = ['he1lo', 'heilo', 'wor1d', 'worid']
         result = list(chain.get_words())
         self.assertEqual(sorted(truth_words), sorted(result))
-        # Substitution counts are over-estimated due to de-duplication
-        self.assertEqual(2, chain.count_words())
-        # Byte counts for multi-character replacements are estimated as if
-        # they were single-character
-        self.assertEqual(16, chain.count_bytes())
+        # Substitution counts are worked out from the base words' characters
+        self.assertEqual(4, chain.count_words())
+        self.assertEqual(24, chain.count_bytes())
+        self.assertTrue(chain.has_exact_counts())
         self.assertFalse(chain.check_hashcat_compatible())
     
     def test_substitution_hashcat_chain(self):
@@ -590,6 +857,171 @@ $B
         self.assertEqual(len('\n'.join(result)+'\n'), chain.count_bytes())
         self.assertTrue(chain.check_hashcat_compatible())
     
+    def test_iter_batches(self):
+        chain = model.Chain()
+        
+        node = model.BaseNode(is_root=True)
+        node.add_attr(model.FileAttr(path=self.test_words_path))
+        node.add_attr(model.RangeAttr(start=0, end=5))
+        chain.add_node(node)
+        
+        node = model.MutateNode(is_case=True)
+        node.add_attr(model.CaseAttr(type_='All', case='Uppercase'))
+        node.add_attr(model.NothingMutatorAttr())
+        chain.add_node(node)
+        
+        node = model.AddNode(prepend=True)
+        node.add_attr(model.StringListAttr(strings=['A', 'B', 'C']))
+        chain.add_node(node)
+        
+        words = list(chain.get_words())
+        for batch_size in [1, 2, 7, 1000]:
+            batches = list(chain.iter_batches(batch_size))
+            self.assertEqual(words, [word for batch in batches for word in batch])
+        
+        batches = list(chain.iter_batches(2, basewords_only=True))
+        self.assertEqual([['test1', 'test word 2'], ['THIRDTESTWORD'],
+                          ['0', '1'], ['2', '3'], ['4']], batches)
+    
+    def test_compile(self):
+        chain = model.Chain()
+        
+        node = model.BaseNode(is_root=True)
+        node.add_attr(model.StringListAttr(strings=['hello', 'world']))
+        chain.add_node(node)
+        
+        node = model.MutateNode(is_case=True)
+        node.add_attr(model.CaseAttr(type_='First', case='Uppercase'))
+        chain.add_node(node)
+        
+        node = model.MutateNode()
+        node.add_attr(model.SubstitutionAttr(type_='All', checked_vals=['o -> 0'], all_together=False))
+        chain.add_node(node)
+        
+        chain.add_node(model.MutateNode(is_case=True))
+        
+        node = model.AddNode(prepend=False)
+        node.add_attr(model.NothingAdderAttr())
+        chain.add_node(node)
+        
+        node = model.AddNode(prepend=False)
+        node.add_attr(model.RangeAttr(start=0, end=2))
+        chain.add_node(node)
+        
+        compiled = chain.compile()
+        # The Case and Substitution nodes are fused, the empty Mutate node and
+        # the Append Nothing node are left out
+        self.assertEqual(2, len(compiled.stages))
+        
+        words = []
+        for node in chain.nodes:
+            words = list(node.get_words(words))
+        self.assertEqual(['Hell00', 'Hell01', 'W0rld0', 'W0rld1'], words)
+        self.assertEqual(words, list(compiled.get_words()))
+        self.assertEqual(words, list(compiled.get_words()))
+        self.assertEqual(['hello', 'world'],
+                         list(chain.compile(basewords_only=True).get_words()))
+    
+    def test_range_batches(self):
+        chain = model.Chain()
+        
+        node = model.BaseNode(is_root=True)
+        node.add_attr(model.FileAttr(path=self.test_words_path))
+        node.add_attr(model.RangeAttr(start=0, end=5))
+        chain.add_node(node)
+        
+        node = model.MutateNode(is_case=True)
+        node.add_attr(model.CaseAttr(type_='First', case='Uppercase'))
+        chain.add_node(node)
+        
+        node = model.AddNode(prepend=True)
+        node.add_attr(model.StringListAttr(strings=['a', 'b', 'c']))
+        node.add_attr(model.NothingAdderAttr())
+        chain.add_node(node)
+        
+        self.assertEqual(4, chain.get_fanout())
+        words = list(chain.get_words())
+        self.assertEqual(32, len(words))
+        for start, stop in [(0, None), (0, 32), (5, 6), (7, 21), (12, None), (31, 40), (40, None)]:
+            compiled = chain.compile(batch_size=3)
+            result = []
+            for batch in compiled.iter_range_batches(start, stop):
+                result.extend(batch)
+            self.assertEqual(words[start:stop], result)
+        
+        # The number of words generated from each base word varies with a
+        # Substitution node, so the words are skipped after generating them
+        node = model.MutateNode()
+        node.add_attr(model.SubstitutionAttr(type_='All', checked_vals=['e -> 3'], all_together=False))
+        chain.add_node(node)
+        self.assertIsNone(chain.get_fanout())
+        words = list(chain.get_words())
+        result = []
+        for batch in chain.compile().iter_range_batches(3, 9):
+            result.extend(batch)
+        self.assertEqual(words[3:9], result)
+    
+    def test_compile_bytes(self):
+        chain = model.Chain()
+        
+        node = model.BaseNode(is_root=True)
+        node.add_attr(model.FileAttr(path=self.test_words_path))
+        node.add_attr(model.StringListAttr(strings=['hello']))
+        chain.add_node(node)
+        
+        node = model.AddNode(prepend=False)
+        node.add_attr(model.RangeAttr(start=0, end=3))
+        chain.add_node(node)
+        
+        if not chain.can_compile_bytes():
+            self.skipTest('the locale encoding is not supported for bytes')
+        compiled = chain.compile(batch_size=2, as_bytes=True)
+        self.assertFalse(compiled.can_write_blocks())
+        words = [word.encode(compiled.encoding) for word in chain.get_words()]
+        self.assertEqual(words, [word for batch in compiled.iter_batches() for word in batch])
+        
+        compiled = chain.compile(basewords_only=True, as_bytes=True)
+        self.assertTrue(compiled.can_write_blocks())
+        data = b''.join(block for block, word_count in compiled.iter_blocks())
+        self.assertEqual(''.join(word + '\n' for word in self.test_words + ['hello']).encode(), data)
+        
+        # Case nodes need decoded words
+        chain.add_node(model.MutateNode(is_case=True))
+        self.assertTrue(chain.can_compile_bytes())
+        chain.nodes[-1].add_attr(model.CaseAttr(type_='First', case='Uppercase'))
+        self.assertFalse(chain.can_compile_bytes())
+        self.assertRaises(ValueError, chain.compile, as_bytes=True)
+    
+    def test_chain_from_string_dict(self):
+        chain = model.Chain()
+        
+        node = model.BaseNode(is_root=True)
+        node.add_attr(model.FileAttr(path=self.test_words_path))
+        node.add_attr(model.StringListAttr(strings=['hello']))
+        chain.add_node(node)
+        
+        node = model.MutateNode(is_case=True)
+        node.add_attr(model.CaseAttr(type_='First', case='Uppercase'))
+        chain.add_node(node)
+        
+        node = model.AddNode(prepend=False)
+        node.add_attr(model.RangeAttr(start=0, end=3))
+        chain.add_node(node)
+        
+        d = model.Serializable.chain_as_string_dict(chain, '2.0.0')
+        loaded = model.Serializable.chain_from_string_dict(d)
+        
+        self.assertEqual(['BaseNode', 'MutateNode', 'AddNode'],
+                         [node.__class__.__name__ for node in loaded.nodes])
+        self.assertTrue(loaded.nodes[1].is_case)
+        self.assertFalse(loaded.nodes[2].prepend)
+        self.assertEqual(list(chain.get_words()), list(loaded.get_words()))
+        self.assertEqual(chain.count_words(), loaded.count_words())
+        
+        d['nodes'][0]['attributes'][0]['class_name'] = 'Popen'
+        with self.assertRaises(Exception):
+            model.Serializable.chain_from_string_dict(d)
+    
     def run_hashcat(self, rules, basewords=None):
         if basewords is None:
             basewords_path = self.test_words_path
@@ -0,0 +1,89 @@
+import unittest
+import tempfile
+import shutil
+import os
+import sys
+import gzip
+import collections
+from unittest import mock
+
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+from mentalist import model, packed
+
+class TestPacked(unittest.TestCase):
+    def test_pack(self):
+        words = ['bb', 'a', 'ccc', 'a', '', 'bb', 'dddd']
+        for dedupe_words in [False, True]:
+            for sort_by_length in [False, True]:
+                expected = words
+                if dedupe_words:
+                    expected = list(dict.fromkeys(expected))
+                if sort_by_length:
+                    expected = sorted(expected, key=len)
+                path = os.path.join(self.test_dir, 'words_{}_{}.mwl'.format(dedupe_words, sort_by_length))
+                header = packed.pack(self.words_path, path, dedupe_words, sort_by_length)
+                self.assertEqual(len(expected), header['word_count'])
+                
+                # counting doesn't read the words
+                with mock.patch.object(model.FileAttr, 'scan_file') as scan_file:
+                    attr = model.FileAttr(path=path)
+                    self.assertFalse(scan_file.called)
+                self.assertEqual(expected, list(attr.get_words()))
+                self.assertEqual(len(expected), attr.count_words(0))
+                self.assertEqual(sum(map(len, expected)), attr.count_bytes(0, 0))
+                self.assertEqual(collections.Counter(len(word.encode()) for word in expected), header['length_histogram'])
+                
+                # words are found in the packed index
+                self.assertEqual(expected[3], attr.get_line(3))
+                start, stop = attr.get_word_range(1, 4)
+                self.assertEqual([expected[1:4]], list(attr.get_slice_batches(start, stop)))
+                shard_words = []
+                for start, stop in attr.get_shards(3):
+                    for batch in attr.get_slice_batches(start, stop):
+                        shard_words.extend(batch)
+                self.assertEqual(expected, shard_words)
+                blocks = list(attr.iter_word_blocks(0, None, model.BATCH_SIZE, 'utf-8'))
+                self.assertEqual(''.join(word + '\n' for word in expected).encode(),
+                                 b''.join(block for block, word_count in blocks))
+    
+    def test_pack_compressed(self):
+        path = self.words_path + '.gz'
+        with gzip.open(path, 'wt') as f:
+            f.write('one\ntwo\n')
+        out_path = os.path.join(self.test_dir, 'words.mwl')
+        packed.pack(path, out_path)
+        self.assertEqual(['one', 'two'], list(model.FileAttr(path=out_path).get_words()))
+        
+        # packing a packed wordlist
+        packed.pack(out_path, out_path)
+        self.assertEqual(['one', 'two'], list(model.FileAttr(path=out_path).get_words()))
+    
+    def test_pack_empty(self):
+        with open(self.words_path, 'w') as f:
+            pass
+        out_path = os.path.join(self.test_dir, 'words.mwl')
+        packed.pack(self.words_path, out_path, sort_by_length=True)
+        attr = model.FileAttr(path=out_path)
+        self.assertEqual(0, attr.count_words(0))
+        self.assertEqual([], list(attr.get_words()))
+    
+    def test_not_packed(self):
+        out_path = os.path.join(self.test_dir, 'words.mwl')
+        shutil.copy(self.words_path, out_path)
+        attr = model.FileAttr(path=out_path)
+        self.assertIsNotNone(attr.file_error)
+    
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.environ = mock.patch.dict(os.environ, {'MENTALIST_CACHE_DIR': ''})
+        self.environ.start()
+        self.words_path = os.path.join(self.test_dir, 'words.txt')
+        with open(self.words_path, 'wb') as f:
+            f.write(b'bb\r\na\nccc\na\n\nbb\ndddd')
+
+    def tearDown(self):
+        self.environ.stop()
+        shutil.rmtree(self.test_dir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import unittest
+import tempfile
+import shutil
+import os
+import gzip
+import sys
+
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+from mentalist import model, parallel
+
+class TestParallel(unittest.TestCase):
+    def test_file_shards(self):
+        attr = self.chain.nodes[0].attrs[0]
+        shards = attr.get_shards(7)
+        self.assertEqual(0, shards[0][0])
+        self.assertEqual(os.stat(self.test_words_path).st_size, shards[-1][1])
+        words = []
+        for start, stop in shards:
+            for batch in attr.get_slice_batches(start, stop, 3):
+                words.extend(batch)
+        self.assertEqual(self.test_words, words)
+    
+    def test_line_offsets(self):
+        attr = self.chain.nodes[0].attrs[0]
+        for i in range(len(self.test_words) + 2):
+            start, stop = attr.get_word_range(i, None)
+            words = []
+            for batch in attr.get_slice_batches(start, stop):
+                words.extend(batch)
+            self.assertEqual(self.test_words[i:], words)
+    
+    def test_range_shards(self):
+        attr = model.RangeAttr(start=5, end=25, zfill=3)
+        words = []
+        for start, stop in attr.get_shards(3):
+            for batch in attr.get_slice_batches(start, stop, 4):
+                words.extend(batch)
+        self.assertEqual(list(attr.get_words()), words)
+    
+    def test_chain_shards(self):
+        compiled_chain = self.chain.compile()
+        words = []
+        for shard in self.chain.get_shards(5):
+            for batch in compiled_chain.iter_shard_batches(shard):
+                words.extend(batch)
+        self.assertEqual(list(self.chain.get_words()), words)
+    
+    def test_write_parallel(self):
+        out_path = os.path.join(self.test_dir, 'out.txt')
+        word_count, byte_count, paths = parallel.write_parallel(self.chain, out_path, 2)
+        self.assertEqual([out_path], paths)
+        with open(out_path, 'rb') as f:
+            data = f.read()
+        self.assertEqual(b''.join(w.encode() + b'\n' for w in self.chain.get_words()), data)
+        self.assertEqual(len(data), byte_count)
+        self.assertEqual(sorted(os.listdir(self.test_dir)), ['out.txt', 'test_words.txt'])
+    
+    def test_write_parallel_compressed(self):
+        out_path = os.path.join(self.test_dir, 'out.txt.gz')
+        parallel.write_parallel(self.chain, out_path, 2, compression='gz', compress_threads=2)
+        with gzip.open(out_path, 'rb') as f:
+            data = f.read()
+        self.assertEqual(b''.join(w.encode() + b'\n' for w in self.chain.get_words()), data)
+    
+    def test_write_parallel_split(self):
+        out_path = os.path.join(self.test_dir, 'out.txt')
+        word_count, byte_count, paths = parallel.write_parallel(self.chain, out_path, 2, split=True)
+        self.assertFalse(os.path.exists(out_path))
+        words = []
+        for path in paths:
+            with open(path) as f:
+                words.extend(f.read().split('\n')[:-1])
+        self.assertEqual(list(self.chain.get_words()), words)
+        self.assertEqual(len(words), word_count)
+    
+    def test_shard_paths(self):
+        self.assertEqual(['out.txt.0', 'out.txt.1'], parallel.get_shard_paths('out.txt', 2, True))
+        self.assertEqual(['out.txt.08.gz', 'out.txt.09.gz', 'out.txt.10.gz'],
+                         parallel.get_shard_paths('out.txt.gz', 11, True, 'gz')[8:])
+        self.assertEqual(['out.txt.0.xz.tmp'], parallel.get_shard_paths('out.txt.xz', 1, False, 'xz'))
+        # the extension follows the compression rather than the path
+        self.assertEqual(['out.txt.0.gz'], parallel.get_shard_paths('out.txt', 1, True, 'gz'))
+        self.assertEqual(['out.gz.0'], parallel.get_shard_paths('out.gz', 1, True))
+        self.assertEqual(['out.gz.0.bz2'], parallel.get_shard_paths('out.gz', 1, True, 'bz2'))
+    
+    def setUp(self):
+        '''
+        Create a temporary word file with mixed line endings and a chain
+        that uses it
+        '''
+        self.test_dir = tempfile.mkdtemp()
+        self.test_words_path = os.path.join(self.test_dir, 'test_words.txt')
+        self.test_words = ['word{}'.format(i) for i in range(50)] + ['', 'crlf', 'cr', 'last']
+        with open(self.test_words_path, 'wb') as f:
+            f.write('\n'.join(self.test_words[:-3]).encode())
+            f.write(b'\ncrlf\r\ncr\rlast')
+        
+        self.chain = model.Chain()
+        node = model.BaseNode(is_root=True)
+        node.add_attr(model.FileAttr(path=self.test_words_path))
+        node.add_attr(model.StringListAttr(strings=['hello', 'world']))
+        self.chain.add_node(node)
+        node = model.MutateNode(is_case=True)
+        node.add_attr(model.CaseAttr(type_='First', case='Uppercase'))
+        node.add_attr(model.NothingMutatorAttr())
+        self.chain.add_node(node)
+        node = model.AddNode(prepend=False)
+        node.add_attr(model.RangeAttr(start=0, end=10))
+        self.chain.add_node(node)
+    
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+import io
+import os
+import sys
+import gzip
+import bz2
+import lzma
+
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+from mentalist import sink
+
+class ShortWriteFile(io.RawIOBase):
+    '''A file that writes at most 5 bytes per call'''
+    def __init__(self):
+        self.data = bytearray()
+    def writable(self):
+        return True
+    def write(self, b):
+        b = bytes(b[:5])
+        self.data.extend(b)
+        return len(b)
+
+class TestSink(unittest.TestCase):
+    def test_write_batches(self):
+        f = io.BytesIO()
+        with sink.OutputSink(f, buffer_size=20, encoding='utf-8') as output_sink:
+            output_sink.write_batch(['hello', 'world'])
+            self.assertEqual(b'', f.getvalue()) # still buffered
+            output_sink.write_batch([])
+            output_sink.write_batches([['test1', 'test word 2'], ['x']])
+            self.assertEqual(b'hello\nworld\ntest1\ntest word 2\n', f.getvalue())
+        self.assertEqual(b'hello\nworld\ntest1\ntest word 2\nx\n', f.getvalue())
+        self.assertEqual(5, output_sink.word_count)
+        self.assertEqual(len(f.getvalue()), output_sink.byte_count)
+
+    def test_undecodable_bytes(self):
+        raw = b'caf\xe9 \xc3\xa9t\xc3\xa9'
+        word = raw.decode('utf-8', 'surrogateescape')
+        f = io.BytesIO()
+        with sink.OutputSink(f, encoding='utf-8') as output_sink:
+            output_sink.write_batch([word])
+        self.assertEqual(raw + b'\n', f.getvalue())
+
+    def test_short_writes(self):
+        f = ShortWriteFile()
+        with sink.OutputSink(f, buffer_size=1, encoding='utf-8') as output_sink:
+            output_sink.write_batch(['a' * 12, 'b' * 7])
+        self.assertEqual(b'a' * 12 + b'\n' + b'b' * 7 + b'\n', bytes(f.data))
+
+    def test_progress_callback(self):
+        calls = []
+        output_sink = sink.OutputSink(io.BytesIO(), progress_callback=calls.append,
+                                      progress_interval=0)
+        output_sink.write_batch(['a', 'b'])
+        output_sink.write_batch(['c'])
+        self.assertEqual(2, len(calls))
+        self.assertIs(output_sink, calls[0])
+        self.assertEqual(3, output_sink.word_count)
+
+    def test_compressed_writer(self):
+        words = ['word{}'.format(i) for i in range(5000)]
+        expected = ''.join(word + '\n' for word in words).encode()
+        decompress = {'gz': gzip.decompress, 'bz2': bz2.decompress, 'xz': lzma.decompress}
+        for format in ['gz', 'bz2', 'xz']:
+            for threads in [1, 3]:
+                f = io.BytesIO()
+                with sink.CompressedWriter(f, format, threads=threads, max_pending=2) as out:
+                    with sink.OutputSink(out, buffer_size=1000, encoding='utf-8') as output_sink:
+                        output_sink.write_batches(sink_batches(words, 7))
+                self.assertEqual(expected, decompress[format](f.getvalue()))
+    
+    def test_get_compression(self):
+        self.assertEqual('gz', sink.get_compression('wordlist.txt.gz'))
+        self.assertEqual('xz', sink.get_compression('wordlist.XZ'))
+        self.assertIsNone(sink.get_compression('wordlist.txt'))
+
+def sink_batches(words, batch_size):
+    for i in range(0, len(words), batch_size):
+        yield words[i:i + batch_size]
+
+if __name__ == '__main__':
+    unittest.main()